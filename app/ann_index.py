@@ -0,0 +1,394 @@
+# app/ann_index.py
+"""Approximate nearest-neighbour index for the local memory bank.
+
+A pure-NumPy IVF ("inverted file") index: vectors are bucketed under the
+nearest of ~sqrt(n) spherical k-means centroids, and a query only scans the
+`nprobe` buckets closest to it. Below `NM_ANN_MIN_TRAIN` vectors the index
+stays flat (exact scan). It is updated incrementally on ingest and persisted
+next to the chunks file so startup does not rebuild it:
+
+  <chunks>.ivf.vecs  vector rows in NM_BANK_DTYPE, append-only, memory-mapped
+  <chunks>.ivf.npz   centroids, ids, bucket assignments (+ int8 row scales)
+
+Only the ids, assignments and scales are on the heap; the rows stay in the
+page cache, so the index grows with the disk rather than with RAM. Adding
+rows appends to the vectors file; the .npz is rewritten only by `save_index`
+(end of an ingest job, or the ingest worker's debounce timer), so bulk
+ingest is linear. With float16/int8 the similarities the index returns are
+approximate and callers re-score the pool.
+
+The cached index remembers which files it was loaded from or saved to; when
+another process (memory/retention_job.py) rewrites them, the next
+`get_index` / `save_index` / `remove_chunks` reloads from disk instead of
+appending behind the other writer's back. Rows added but not yet saved are
+dropped then; retrieval re-adds whatever the bank has that the index lacks.
+"""
+from typing import List, Dict, Optional, Tuple
+import io, logging, os, threading
+import numpy as np
+
+from app.scoring import normalize_rows, top_k, quantize_rows, dequantize
+from app.memory_bank import BANK_DTYPE
+
+INDEX_SUFFIX = ".ivf.npz"
+VECS_SUFFIX = ".ivf.vecs"
+MIN_TRAIN = int(os.environ.get("NM_ANN_MIN_TRAIN", "1024"))
+NPROBE = int(os.environ.get("NM_ANN_NPROBE", "8"))
+KMEANS_ITERS = 10
+KMEANS_SAMPLE = 50_000
+
+def _kmeans(x: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (cosine) on unit rows; returns unit centroids."""
+    rng = np.random.default_rng(seed)
+    cents = x[rng.choice(len(x), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERS):
+        assign = np.argmax(x @ cents.T, axis=1)
+        sums = np.zeros_like(cents)
+        np.add.at(sums, assign, x)
+        empty = ~sums.any(axis=1)
+        sums[empty] = cents[empty]  # keep empty clusters where they were
+        cents = normalize_rows(sums)
+    return cents
+
+class _Rows:
+    """Vector rows of an index: a growable heap array, or with `path` an append-only
+    file that is memory-mapped (the rows live in the page cache, not the heap)."""
+
+    def __init__(self, dim: int, dtype: str, path: Optional[str] = None, rows: int = 0):
+        self.dim, self.dtype, self.path, self.n = dim, np.dtype(dtype), path, rows
+        self._arr = np.zeros((0, dim), dtype=self.dtype)
+        if path is not None:
+            if rows and (not os.path.exists(path) or os.path.getsize(path) < rows * self.row_bytes):
+                raise ValueError(f"{path} holds fewer than {rows} rows")
+            with open(path, "ab") as f:
+                f.truncate(rows * self.row_bytes)  # drop rows appended after the last save
+            self._map()
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    def _map(self) -> None:
+        self._arr = (np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(self.n, self.dim)) if self.n
+                     else np.zeros((0, self.dim), dtype=self.dtype))
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return self._arr[rows]
+
+    def __setitem__(self, rows, value) -> None:
+        self._arr[rows] = value
+
+    def append(self, raw: np.ndarray) -> None:
+        raw = np.ascontiguousarray(raw, dtype=self.dtype)
+        need = self.n + len(raw)
+        if self.path is None:
+            if need > len(self._arr):
+                buf = np.zeros((max(need, 2 * len(self._arr), 64), self.dim), dtype=self.dtype)
+                buf[:self.n] = self._arr[:self.n]
+                self._arr = buf
+            self._arr[self.n:need] = raw
+        else:
+            with open(self.path, "r+b") as f:
+                f.seek(self.n * self.row_bytes)
+                f.write(raw.tobytes())
+        self.n = need
+        if self.path is not None: self._map()
+
+    def keep(self, rows: np.ndarray, block: int = 65536) -> None:
+        """Keep only `rows` (in order)."""
+        if self.path is None:
+            self._arr, self.n = np.ascontiguousarray(self._arr[rows]), len(rows)
+            return
+        with open(self.path + ".tmp", "wb") as f:
+            for s in range(0, len(rows), block):
+                f.write(np.ascontiguousarray(self._arr[rows[s:s + block]]).tobytes())
+        self._arr = np.zeros((0, self.dim), dtype=self.dtype)  # unmap before replacing the file
+        os.replace(self.path + ".tmp", self.path)
+        self.n = len(rows)
+        self._map()
+
+    def flush(self) -> None:
+        if isinstance(self._arr, np.memmap): self._arr.flush()
+
+class IVFIndex:
+    def __init__(self, dim: int, dtype: str = BANK_DTYPE, path: Optional[str] = None, rows: int = 0):
+        """`path`: memory-mapped vectors file (see module doc); None keeps the rows on the heap."""
+        self.dim, self.dtype = dim, dtype
+        self.centroids = np.zeros((0, dim), dtype=np.float32)
+        self.ids: List[str] = []
+        self.trained_size = 0
+        self.dirty = False  # changed since the last save()
+        self._rows = _Rows(dim, dtype, path, rows)
+        self._scales = np.ones(0, dtype=np.float32)  # capacity buffers, first len(ids) live; scale is int8 only
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._members: List[List[int]] = []
+        self._cache: Dict[int, np.ndarray] = {}
+        self._pos: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, cid: str) -> bool:
+        return cid in self._pos
+
+    @property
+    def vecs(self) -> np.ndarray:
+        """Live rows as float32 (decoded when quantized). Materializes every row; for tests and tools."""
+        return self._decode(slice(0, len(self.ids)))
+
+    def _decode(self, rows) -> np.ndarray:
+        return dequantize(self._rows[rows], self._scales[rows] if self.dtype == "int8" else None)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of vector data (memory-mapped when the index has a vectors file)."""
+        n = len(self.ids)
+        return n * self._rows.row_bytes + (self._scales[:n].nbytes if self.dtype == "int8" else 0)
+
+    def _grow(self, extra: int) -> None:
+        need = len(self.ids) + extra
+        if need <= len(self._assign): return
+        cap, n = max(need, 2 * len(self._assign), 64), len(self.ids)
+        scales = np.ones(cap, dtype=np.float32); scales[:n] = self._scales[:n]
+        assign = np.zeros(cap, dtype=np.int32); assign[:n] = self._assign[:n]
+        self._scales, self._assign = scales, assign
+
+    def _rebucket(self, reassign: bool = True) -> None:
+        n = len(self.ids)
+        if reassign and len(self.centroids):
+            for s in range(0, n, 8192):  # bounded memory for the n x nlist product
+                self._assign[s:min(s + 8192, n)] = np.argmax(self._decode(slice(s, min(s + 8192, n))) @ self.centroids.T, axis=1)
+        elif reassign:
+            self._assign[:n] = 0
+        nlist = max(1, len(self.centroids))
+        order = np.argsort(self._assign[:n], kind="stable")
+        bounds = np.searchsorted(self._assign[:n][order], np.arange(nlist + 1))
+        self._members = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(nlist)]
+        self._cache = {}
+
+    def train(self) -> None:
+        n = len(self.ids)
+        nlist = int(np.clip(np.sqrt(n), 1, 4096))
+        if n >= MIN_TRAIN:
+            # k-means on a sample read from the map; the full set is never decoded at once
+            rng = np.random.default_rng(0)
+            pick = np.sort(rng.choice(n, KMEANS_SAMPLE, replace=False)) if n > KMEANS_SAMPLE else slice(0, n)
+            self.centroids = _kmeans(self._decode(pick), nlist)
+        else:
+            self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+        self.trained_size = n
+        self._rebucket()
+
+    def add(self, ids: List[str], vecs) -> None:
+        """Add (or replace) vectors; retrains once the index has grown 4x since the last training."""
+        vecs = normalize_rows(vecs) if len(vecs) else np.zeros((0, self.dim), dtype=np.float32)
+        with self._lock:
+            self._add(list(ids), vecs)
+
+    def _add(self, ids: List[str], vecs: np.ndarray) -> None:
+        raw, scales = quantize_rows(vecs, self.dtype)
+        fresh = []
+        for i, cid in enumerate(ids):
+            j = self._pos.get(cid)
+            if j is not None:
+                self._rows[j] = raw[i]  # edited chunk: update in place, bucket fixed on next retrain
+                if scales is not None: self._scales[j] = scales[i]
+                self.dirty = True
+            else:
+                fresh.append(i)
+        if not fresh: return
+        self.dirty = True
+        self._grow(len(fresh))
+        start = len(self.ids)
+        self._rows.append(raw[fresh])
+        if scales is not None: self._scales[start:start + len(fresh)] = scales[fresh]
+        for off, i in enumerate(fresh):
+            self._pos[ids[i]] = start + off
+            self.ids.append(ids[i])
+        n = len(self.ids)
+        if (self.trained_size == 0 and n >= MIN_TRAIN) or (self.trained_size and n >= 4 * self.trained_size):
+            self.train(); return
+        assign = np.argmax(vecs[fresh] @ self.centroids.T, axis=1) if len(self.centroids) else np.zeros(len(fresh), dtype=np.int64)
+        if not self._members: self._members = [[]]
+        for off, c in enumerate(assign.tolist()):
+            self._assign[start + off] = c
+            self._members[c].append(start + off)
+            self._cache.pop(c, None)
+
+    def remove(self, ids: List[str]) -> int:
+        """Drop vectors by id (centroids are kept); returns how many were present."""
+        with self._lock:
+            gone = [self._pos[cid] for cid in set(ids) if cid in self._pos]
+            if not gone: return 0
+            mask = np.ones(len(self.ids), dtype=bool)
+            mask[gone] = False
+            keep = np.flatnonzero(mask)
+            self._rows.keep(keep)
+            self._scales = self._scales[keep]
+            self._assign = self._assign[keep]
+            self.ids = [self.ids[i] for i in keep.tolist()]
+            self._pos = {cid: i for i, cid in enumerate(self.ids)}
+            self._rebucket(reassign=False)
+            self.dirty = True
+            return len(gone)
+
+    def _bucket(self, c: int) -> np.ndarray:
+        arr = self._cache.get(c)
+        if arr is None:
+            arr = self._cache[c] = np.asarray(self._members[c], dtype=np.int64)
+        return arr
+
+    def search(self, q_vec, pool: int, nprobe: int = NPROBE) -> Tuple[List[str], np.ndarray]:
+        """Return up to `pool` (ids, cosine) best-first from the probed buckets (approximate when quantized)."""
+        q = normalize_rows(q_vec)[0]
+        with self._lock:
+            if not self.ids: return [], np.zeros(0, dtype=np.float32)
+            if len(self.centroids):
+                probe = top_k(self.centroids @ q, nprobe)
+                cand = np.sort(np.concatenate([self._bucket(int(c)) for c in probe]))  # file order for the map
+            else:
+                cand = np.arange(len(self.ids))
+            sims = self._decode(cand) @ q
+            best = top_k(sims, pool)
+            return [self.ids[i] for i in cand[best].tolist()], sims[best]
+
+    def save(self, path: str) -> None:
+        """Write the metadata (.npz) and flush the vectors file; a heap-only index stores its rows in the .npz."""
+        buf = io.BytesIO()
+        with self._lock:
+            n = len(self.ids)
+            extra = {"vecs": self._rows[:n]} if self._rows.path is None else {}
+            self._rows.flush()
+            np.savez(buf, centroids=self.centroids, scales=self._scales[:n], assign=self._assign[:n],
+                     ids=np.array(self.ids, dtype=str), trained_size=np.int64(self.trained_size),
+                     dtype=np.array(self.dtype), dim=np.int64(self.dim), **extra)
+            self.dirty = False
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, dtype: str = BANK_DTYPE, vecs_path: Optional[str] = None) -> "IVFIndex":
+        """Load a saved index (rows from `vecs_path`, default <chunks>.ivf.vecs, or from the .npz for
+        heap-only and older indexes), re-encoding the vectors if it was saved with another dtype."""
+        with np.load(path) as z:
+            ids = [str(x) for x in z["ids"].tolist()]
+            inline = z["vecs"] if "vecs" in z.files else None
+            saved = str(z["dtype"]) if "dtype" in z.files else str(inline.dtype)
+            dim = int(z["dim"]) if "dim" in z.files else int(inline.shape[1])
+            scales = z["scales"].astype(np.float32) if "scales" in z.files else np.ones(len(ids), dtype=np.float32)
+            centroids, assign = z["centroids"].astype(np.float32), z["assign"].astype(np.int32)
+            trained_size = int(z["trained_size"])
+        if inline is not None:
+            idx = cls(dim, saved, vecs_path)
+            idx._rows.append(inline)  # older .npz with the rows inside: move them to the vectors file
+        else:
+            if vecs_path is None and path.endswith(INDEX_SUFFIX): vecs_path = path[:-len(INDEX_SUFFIX)] + VECS_SUFFIX
+            if vecs_path is None: raise ValueError(f"{path} keeps its vectors in a separate file")
+            idx = cls(dim, saved, vecs_path, rows=len(ids))
+        idx.centroids, idx.trained_size = centroids, trained_size
+        idx.ids, idx._scales, idx._assign = ids, scales, assign
+        idx._pos = {cid: i for i, cid in enumerate(ids)}
+        if saved != dtype:
+            idx._recode(dtype)
+        idx._rebucket(reassign=False)
+        idx.dirty = inline is not None or saved != dtype
+        return idx
+
+    def _recode(self, dtype: str, block: int = 65536) -> None:
+        n = len(self.ids)
+        target = None if self._rows.path is None else self._rows.path + ".recode"
+        rows, scales = _Rows(self.dim, dtype, target), np.ones(n, dtype=np.float32)
+        for s in range(0, n, block):
+            raw, sc = quantize_rows(self._decode(slice(s, min(s + block, n))), dtype)
+            rows.append(raw)
+            if sc is not None: scales[s:s + len(raw)] = sc
+        if target is not None:
+            self._rows = None
+            os.replace(target, target[:-len(".recode")])
+            rows.path = target[:-len(".recode")]
+        self.dtype, self._rows, self._scales = dtype, rows, scales
+
+# ---- process-wide registry, one index per chunks file ----
+_INDEXES: Dict[str, IVFIndex] = {}
+_STAMPS: Dict[str, Tuple] = {}  # chunks path -> _stamp() of the files the cached index matches
+_lock = threading.Lock()
+
+def _stamp(chunks_path: str) -> Tuple:
+    """(inode, mtime, size) of the .npz and inode of the vectors file; both are replaced, not edited, by a save
+    or removal elsewhere, while this process's own appends keep the vectors file's inode."""
+    out = []
+    for path in (chunks_path + INDEX_SUFFIX, chunks_path + VECS_SUFFIX):
+        try:
+            st = os.stat(path)
+        except OSError:
+            out.append(None); continue
+        out.append((st.st_ino, st.st_mtime_ns, st.st_size) if path.endswith(INDEX_SUFFIX) else st.st_ino)
+    return tuple(out)
+
+def _open(chunks_path: str) -> Optional[IVFIndex]:
+    path = chunks_path + INDEX_SUFFIX
+    if not os.path.exists(path): return None
+    try:
+        return IVFIndex.load(path, vecs_path=chunks_path + VECS_SUFFIX)
+    except Exception:
+        return None  # unreadable or torn: rebuilt from the bank on first use
+
+def _cached(chunks_path: str) -> Optional[IVFIndex]:
+    """The cached index, or None if there is none or another process has rewritten its files (call under _lock)."""
+    idx = _INDEXES.get(chunks_path)
+    if idx is not None and _STAMPS.get(chunks_path) != _stamp(chunks_path):
+        if idx.dirty: logging.warning("ANN index for %s was rewritten elsewhere; reloading it (unsaved additions dropped)", chunks_path)
+        del _INDEXES[chunks_path]
+        idx = None
+    return idx
+
+def _install(chunks_path: str, idx: IVFIndex) -> IVFIndex:
+    _INDEXES[chunks_path] = idx
+    _STAMPS[chunks_path] = _stamp(chunks_path)
+    return idx
+
+def get_index(chunks_path: str, dim: int) -> IVFIndex:
+    """Return the cached index for `chunks_path`, (re)loading it from disk on first use or after an outside rewrite."""
+    with _lock:
+        idx = _cached(chunks_path)
+        if idx is None or idx.dim != dim:
+            idx = _open(chunks_path)
+            if idx is None or idx.dim != dim:
+                idx = IVFIndex(dim, path=chunks_path + VECS_SUFFIX)
+            _install(chunks_path, idx)
+        return idx
+
+def add_chunks(chunks_path: str, ids: List[str], vecs) -> None:
+    """Incrementally add freshly ingested vectors (rows are appended; call `save_index` to persist)."""
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if vecs.ndim != 2 or len(vecs) == 0: return
+    get_index(chunks_path, vecs.shape[1]).add(list(ids), vecs)
+
+def save_index(chunks_path: str) -> bool:
+    """Persist the cached index for `chunks_path` if it changed since the last save (and nobody else saved since)."""
+    with _lock:
+        idx = _cached(chunks_path)
+        if idx is None or not idx.dirty: return False
+        idx.save(chunks_path + INDEX_SUFFIX)
+        _STAMPS[chunks_path] = _stamp(chunks_path)
+    return True
+
+def remove_chunks(chunks_path: str, ids: List[str]) -> int:
+    """Remove evicted chunks from the index (cached or on disk) and persist it."""
+    with _lock:
+        idx = _cached(chunks_path)
+        if idx is None:
+            idx = _open(chunks_path)
+            if idx is None: return 0
+            _install(chunks_path, idx)
+        removed = idx.remove(list(ids))
+        if removed:
+            idx.save(chunks_path + INDEX_SUFFIX)
+            _STAMPS[chunks_path] = _stamp(chunks_path)
+    return removed
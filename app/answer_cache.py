@@ -0,0 +1,89 @@
+# app/answer_cache.py
+"""Answer cache in front of generation.
+
+Exact mode keys on a hash of the built prompt (same query, same chunks, same
+order), so a hit is exactly what beam search would have produced again.
+Semantic mode additionally reuses an answer when the retrieved citation set is
+identical and the new query embedding is within NM_ANSWER_CACHE_SIM cosine of
+the cached query. Entries live in one LRU; a side index groups prompt keys by
+citation set so the semantic check only compares a handful of vectors.
+`variant` (the decoding mode) is part of both keys: a greedy answer is never
+served for a beam-search request or vice versa.
+"""
+from typing import Dict, FrozenSet, Hashable, List, Optional, Tuple
+import hashlib, os, threading
+import numpy as np
+
+from app.cache import LRUCache
+from app.scoring import normalize_rows
+
+ENABLED = os.environ.get("NM_ANSWER_CACHE", "1") == "1"
+SEMANTIC = os.environ.get("NM_ANSWER_CACHE_SEMANTIC", "0") == "1"
+SIM_THRESHOLD = float(os.environ.get("NM_ANSWER_CACHE_SIM", "0.95"))
+CACHE_SIZE = int(os.environ.get("NM_ANSWER_CACHE_SIZE", "512"))
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    def __init__(self, maxsize: int, semantic: bool = False, threshold: float = 0.95):
+        self.semantic, self.threshold = semantic, threshold
+        self._lru = LRUCache(maxsize, on_evict=self._forget)
+        self._by_cites: Dict[Tuple[FrozenSet[str], str], Dict[str, np.ndarray]] = {}  # (citations, variant) -> {key: unit q_vec}
+        self._lock = threading.Lock()
+        self.exact_hits = self.semantic_hits = self.misses = 0
+
+    def _forget(self, key: Hashable, entry: Dict) -> None:
+        with self._lock:
+            group = self._by_cites.get(entry["cites"])
+            if group is not None:
+                group.pop(key, None)
+                if not group: del self._by_cites[entry["cites"]]
+
+    def lookup(self, prompt: str, citations: List[str], q_vec=None,
+               variant: str = "") -> Tuple[Optional[Dict], Optional[str]]:
+        """Return (cached generation result, "exact" | "semantic") or (None, None)."""
+        entry = self._lru.get(prompt_key(prompt + variant))
+        if entry is not None:
+            self.exact_hits += 1
+            return dict(entry["result"]), "exact"
+        if self.semantic and q_vec is not None:
+            entry = self._nearest(citations, q_vec, variant)
+            if entry is not None:
+                self.semantic_hits += 1
+                return dict(entry["result"]), "semantic"
+        self.misses += 1
+        return None, None
+
+    def _nearest(self, citations: List[str], q_vec, variant: str = "") -> Optional[Dict]:
+        with self._lock:
+            group = dict(self._by_cites.get((frozenset(citations), variant), {}))
+        if not group: return None
+        keys = list(group)
+        sims = np.stack([group[k] for k in keys]) @ normalize_rows(q_vec)[0]
+        best = int(np.argmax(sims))
+        if float(sims[best]) < self.threshold: return None
+        return self._lru.get(keys[best])
+
+    def store(self, prompt: str, citations: List[str], result: Dict, q_vec=None, variant: str = "") -> None:
+        if self._lru.maxsize <= 0: return
+        key, cites = prompt_key(prompt + variant), (frozenset(citations), variant)
+        self._lru.put(key, {"result": result, "cites": cites})
+        if self.semantic and q_vec is not None:
+            with self._lock:
+                self._by_cites.setdefault(cites, {})[key] = normalize_rows(q_vec)[0]
+
+    def clear(self) -> None:
+        self._lru.clear()
+        with self._lock:
+            self._by_cites.clear()
+
+    def stats(self) -> Dict:
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {"enabled": self._lru.maxsize > 0, "semantic": self.semantic, "threshold": self.threshold,
+                "size": len(self._lru), "maxsize": self._lru.maxsize, "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits, "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0}
+
+ANSWER_CACHE = AnswerCache(CACHE_SIZE if ENABLED else 0, SEMANTIC, SIM_THRESHOLD)
@@ -0,0 +1,66 @@
+# app/cache.py
+"""Small thread-safe LRU cache with optional TTL, byte budget and hit/miss counters."""
+from typing import Any, Callable, Dict, Hashable, Optional
+from collections import OrderedDict
+import threading, time
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl_s: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+                 max_bytes: int = 0, sizeof: Optional[Callable[[Any], int]] = None):
+        """`max_bytes` > 0 also bounds the summed `sizeof(value)` of the entries."""
+        self.maxsize, self.ttl_s, self.on_evict = maxsize, ttl_s, on_evict
+        self.max_bytes, self.sizeof = max_bytes, sizeof
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires at, size)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.bytes = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            expired = item is not None and item[1] is not None and item[1] <= time.monotonic()
+            if item is None or expired:
+                if expired:
+                    del self._data[key]
+                    self.bytes -= item[2]
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+        if expired and self.on_evict: self.on_evict(key, item[0])
+        return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0: return
+        expires = time.monotonic() + self.ttl_s if self.ttl_s else None
+        size = self.sizeof(value) if self.sizeof else 0
+        evicted = []
+        with self._lock:
+            old = self._data.get(key)
+            if old is not None: self.bytes -= old[2]
+            self._data[key] = (value, expires, size)
+            self._data.move_to_end(key)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes and len(self._data) > 1):
+                old_key, (old_value, _, old_size) = self._data.popitem(last=False)
+                self.bytes -= old_size
+                evicted.append((old_key, old_value))
+        if self.on_evict:
+            for old_key, old_value in evicted: self.on_evict(old_key, old_value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        out = {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+               "hit_rate": round(self.hits / total, 4) if total else 0.0}
+        if self.max_bytes: out.update(bytes=self.bytes, max_bytes=self.max_bytes)
+        return out
@@ -0,0 +1,53 @@
+# app/executors.py
+"""Bounded executors for the async request path.
+
+I/O (BigQuery round-trips) and CPU work (embedding, scoring, generation) run in
+separately sized thread pools. Each pool admits at most `workers + max_queue`
+tasks; past that `submit` raises `Overloaded` and the server answers 503, so a
+burst turns into fast rejections instead of an unbounded backlog.
+"""
+from typing import Dict, Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio, functools, os, threading
+
+class Overloaded(RuntimeError):
+    """Raised when a pool (or the generation queue) is at its admission limit."""
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name, self.workers = name, workers
+        self.limit = workers + max_queue
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _release(self, _fut: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._pending >= self.limit:
+                raise Overloaded(f"{self.name}: {self._pending} tasks pending")
+            self._pending += 1
+        try:
+            fut = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        fut.add_done_callback(self._release)
+        return fut
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(functools.partial(fn, *args, **kwargs)))
+
+    def stats(self) -> Dict:
+        return {"workers": self.workers, "pending": self._pending, "limit": self.limit}
+
+IO_POOL = BoundedExecutor("nm-io", int(os.environ.get("NM_IO_WORKERS", "16")),
+                          int(os.environ.get("NM_IO_MAX_QUEUE", "64")))
+CPU_POOL = BoundedExecutor("nm-cpu", int(os.environ.get("NM_CPU_WORKERS", str(min(4, os.cpu_count() or 1)))),
+                           int(os.environ.get("NM_CPU_MAX_QUEUE", "32")))
+# one thread per /predict/stream generation for its whole duration; no queue, a full pool is a 503
+STREAM_POOL = BoundedExecutor("nm-stream", int(os.environ.get("NM_STREAM_WORKERS", "2")),
+                              int(os.environ.get("NM_STREAM_MAX_QUEUE", "0")))
@@ -1,53 +1,514 @@
-﻿from typing import List, Dict
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+﻿from typing import Callable, List, Dict, NamedTuple, Tuple, Optional
+from concurrent.futures import Future
+import asyncio, functools, hashlib, logging, os, queue, threading, time, warnings
+import numpy as np
+
+from app.cache import LRUCache
+from app.executors import CPU_POOL, Overloaded
+from app.models import REGISTRY, lazy_import
+
+torch = lazy_import("torch")  # imported with the model, not with the app
 
 _MODEL_NAME = "t5-small"
 _tokenizer = None
 _model = None
-_device = "cuda" if torch.cuda.is_available() else "cpu"
+_device = "cpu"
+
+# CPU inference backend: eager fp32 ("torch"), dynamic int8 linear layers ("int8"),
+# or an ONNX Runtime export with KV cache ("onnx", needs optimum[onnxruntime])
+BACKEND = os.environ.get("NM_T5_BACKEND", "torch")
+ONNX_DIR = os.environ.get("NM_T5_ONNX_DIR", "")  # exported model is saved/reused here; empty = export on every start
+NUM_THREADS = int(os.environ.get("NM_TORCH_THREADS", "0"))  # 0 = torch default (all cores)
+INTEROP_THREADS = int(os.environ.get("NM_TORCH_INTEROP_THREADS", "0"))
+# decoding when a request doesn't choose: "beam" (3 beams) or "greedy"
+DECODING = os.environ.get("NM_GEN_DECODING", "beam")
+BEAMS = {"beam": 3, "greedy": 1}
+# streamed answers (stream_answer) decode one token at a time: greedy, or nucleus sampling
+STREAM_DECODINGS = ("greedy", "sample")
+TOP_P = float(os.environ.get("NM_GEN_TOP_P", "0.9"))
+TEMPERATURE = float(os.environ.get("NM_GEN_TEMPERATURE", "0.7"))
+
+# dynamic batching of concurrent generate_answer calls
+BATCHING = os.environ.get("NM_GEN_BATCHING", "1") == "1"
+BATCH_MAX = int(os.environ.get("NM_GEN_BATCH_MAX", "8"))
+BATCH_WAIT_MS = float(os.environ.get("NM_GEN_BATCH_WAIT_MS", "5"))
+MAX_PENDING = int(os.environ.get("NM_GEN_MAX_PENDING", "64"))
+
+# opt-in cache of encoder outputs by token ids (torch / int8 backends), LRU bounded by NM_ENCODER_CACHE_MB:
+# "prompt" reuses them for an identical tokenized prompt only (answers unchanged); it pays off
+# when the same prompt is re-decoded with other parameters (decoding=greedy after beam, streaming),
+# which the answer cache keys apart. "chunks" encodes the question header, each context line and
+# the trailer separately so a chunk's states are reused across questions (approximate; see _segment_ids)
+ENCODER_CACHE_MODE = os.environ.get("NM_ENCODER_CACHE", "off")
+ENCODER_CACHE_MB = float(os.environ.get("NM_ENCODER_CACHE_MB", "64"))
+ENCODER_CACHE = LRUCache(maxsize=1 << 20, max_bytes=int(ENCODER_CACHE_MB * (1 << 20)),
+                         sizeof=lambda t: t.element_size() * t.nelement())
+_encoder_owner = None  # the model whose states ENCODER_CACHE holds
+
+# context packing (pack_prompt): chunks fill the encoder budget in blend order
+PACK_MIN_TOKENS = int(os.environ.get("NM_PACK_MIN_TOKENS", "24"))  # a chunk cut shorter than this is dropped instead
+PACK_DEDUP = float(os.environ.get("NM_PACK_DEDUP", "0.8"))  # drop a chunk when this share of its 8-grams is already in
+_chunk_tokens = LRUCache(maxsize=int(os.environ.get("NM_PACK_CACHE_SIZE", "8192")))  # line -> (token ids, char ends)
+_pack_lock = threading.Lock()
+_pack_totals = {"prompts": 0, "chunks_dropped": 0, "duplicates": 0, "chunks_cut": 0, "tokens_dropped": 0}
+
+def decoding_beams(decoding: Optional[str] = None) -> int:
+    """num_beams for a decoding name (None = NM_GEN_DECODING); ValueError for unknown names."""
+    decoding = decoding or DECODING
+    if decoding not in BEAMS:
+        raise ValueError(f"unknown decoding {decoding!r}; expected one of {sorted(BEAMS)}")
+    return BEAMS[decoding]
+
+def _set_threads() -> None:
+    if NUM_THREADS > 0:
+        torch.set_num_threads(NUM_THREADS)
+    if INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(INTEROP_THREADS)
+        except RuntimeError as e:  # only allowed before the first parallel op
+            logging.warning("NM_TORCH_INTEROP_THREADS ignored: %s", e)
+
+def _load_onnx():
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise RuntimeError("NM_T5_BACKEND=onnx needs ONNX Runtime. Run: pip install optimum[onnxruntime]") from e
+    if ONNX_DIR and os.path.isdir(ONNX_DIR):
+        return ORTModelForSeq2SeqLM.from_pretrained(ONNX_DIR, use_cache=True)
+    model = ORTModelForSeq2SeqLM.from_pretrained(_MODEL_NAME, export=True, use_cache=True)
+    if ONNX_DIR: model.save_pretrained(ONNX_DIR)
+    return model
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(_MODEL_NAME)
+
+def _load_t5(backend: Optional[str] = None):
+    from transformers import AutoModelForSeq2SeqLM
+    backend = backend or BACKEND
+    _set_threads()
+    tokenizer = REGISTRY.get("tokenizer")
+    if backend == "onnx":
+        return tokenizer, _load_onnx(), "cpu"
+    if backend not in ("torch", "int8"):
+        raise ValueError(f"unknown NM_T5_BACKEND {backend!r}; expected torch, int8 or onnx")
+    model = AutoModelForSeq2SeqLM.from_pretrained(_MODEL_NAME)
+    model.eval()
+    if backend == "int8":
+        # int8 weights, activations quantized on the fly; CPU only
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return tokenizer, model, "cpu"
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    return tokenizer, model, device
 
 def _load():
-    global _tokenizer, _model
+    global _tokenizer, _model, _device
     if _tokenizer is None or _model is None:
-        _tokenizer = AutoTokenizer.from_pretrained(_MODEL_NAME)
-        _model = AutoModelForSeq2SeqLM.from_pretrained(_MODEL_NAME)
-        _model.to(_device)
-        _model.eval()
-
-def build_prompt(query: str, chunks: List[Dict], max_chars_per_chunk: int = 600, max_chunks: int = 5) -> str:
-    use = chunks[:max_chunks]
-    lines = []
-    for c in use:
-        txt = (c.get("text") or "")[:max_chars_per_chunk]
-        cid = c.get("chunk_id") or ""
-        lines.append(f"[{cid}] {txt}")
-    ctx = "\n".join(lines)
-    prompt = (
+        _tokenizer, _model, _device = REGISTRY.get("t5")
+
+def _tokenizer_only():
+    """The T5 tokenizer without the model (prompt packing, token counts on a cold instance)."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = REGISTRY.get("t5")[0] if REGISTRY.loaded("t5") else REGISTRY.get("tokenizer")
+    return _tokenizer
+
+_TRAILER = "\n\nAnswer:"
+
+def _header(query: str) -> str:
+    return (
         "You are a helpful assistant. Use ONLY the context to answer.\n"
         "Write 2-4 concise sentences. Include bracketed citations like [chunk_id] after facts.\n"
-        f"Question: {query}\n\nContext:\n{ctx}\n\nAnswer:"
+        f"Question: {query}\n\nContext:\n"
     )
-    return prompt
 
-@torch.inference_mode()
-def generate_answer(query: str, chunks: List[Dict], max_input_tokens: int = 512, max_new_tokens: int = 128) -> str:
+def _line_tokens(cid: str, line: str) -> Tuple[List[int], List[int]]:
+    """(token ids, end char offset of each token) for a context line, cached per chunk_id + text."""
+    key = (cid, hashlib.blake2b(line.encode("utf-8"), digest_size=16).digest())
+    hit = _chunk_tokens.get(key)
+    if hit is not None: return hit
+    if _tokenizer.is_fast:
+        enc = _tokenizer(line, add_special_tokens=False, return_offsets_mapping=True)
+        hit = (enc["input_ids"], [end for _, end in enc["offset_mapping"]])
+    else:
+        ids = _tokenizer(line, add_special_tokens=False)["input_ids"]
+        hit = (ids, [len(_tokenizer.decode(ids[:n + 1])) for n in range(len(ids))])
+    _chunk_tokens.put(key, hit)
+    return hit
+
+def _shingles(ids: List[int], n: int = 8) -> set:
+    return {tuple(ids[i:i + n]) for i in range(max(1, len(ids) - n + 1))}
+
+def pack_prompt(query: str, chunks: List[Dict], max_input_tokens: int = 512,
+                max_chunks: int = 5) -> Tuple[List[str], Dict]:
+    """Prompt segments (header, context lines, trailer) that fit `max_input_tokens`, plus a packing report
+    whose "chunk_ids" lists the chunks that made it into the prompt, in prompt order.
+
+    Chunks are taken in blend order: one whose 8-grams are mostly covered by
+    chunks already taken is skipped as a duplicate, the first that no longer
+    fits is cut at a token boundary (if at least NM_PACK_MIN_TOKENS remain),
+    and the rest are dropped, so the encoder never truncates the trailer.
+    """
+    _tokenizer_only()
+    limit = min(max_input_tokens, 512)
+    header = _header(query)
+    budget = (limit - len(_tokenizer(header, add_special_tokens=False)["input_ids"])
+              - len(_tokenizer(_TRAILER)["input_ids"]))
+    ranked = sorted(chunks, key=lambda c: -(c.get("blend") or 0.0))  # stable: unscored chunks keep their order
+    lines, used, seen = [], [], set()
+    report = {"chunks": len(chunks), "chunk_ids": used, "chunks_used": 0, "chunks_cut": 0, "chunks_dropped": 0, "duplicates": 0,
+              "tokens_used": 0, "tokens_dropped": 0}
+    for c in ranked:
+        cid = c.get("chunk_id") or ""
+        prefix = f"[{cid}] "
+        line = prefix + (c.get("text") or "")[:limit * 16]  # no chunk can use more than the budget anyway
+        ids, ends = _line_tokens(cid, line)
+        body = _shingles([t for t, end in zip(ids, ends) if end > len(prefix)])
+        if seen and len(body & seen) >= PACK_DEDUP * len(body):
+            report["duplicates"] += 1
+            continue
+        if len(lines) >= max_chunks or budget < min(len(ids), PACK_MIN_TOKENS):
+            report["chunks_dropped"] += 1
+            report["tokens_dropped"] += len(ids)
+            continue
+        if len(ids) > budget:
+            line = line[:ends[budget - 1]]
+            report["chunks_cut"] += 1
+            report["tokens_dropped"] += len(ids) - budget
+            ids = ids[:budget]
+        lines.append(line)
+        used.append(c.get("chunk_id"))
+        seen |= body
+        budget -= len(ids)
+        report["tokens_used"] += len(ids)
+    report["chunks_used"] = len(lines)
+    with _pack_lock:
+        _pack_totals["prompts"] += 1
+        for k in ("chunks_dropped", "duplicates", "chunks_cut", "tokens_dropped"): _pack_totals[k] += report[k]
+    return [header] + [l + "\n" for l in lines[:-1]] + lines[-1:] + [_TRAILER], report
+
+def prompt_segments(query: str, chunks: List[Dict], max_input_tokens: int = 512, max_chunks: int = 5) -> List[str]:
+    """The prompt as [header with the question, one piece per context line..., trailer]; joins to build_prompt()."""
+    return pack_prompt(query, chunks, max_input_tokens, max_chunks)[0]
+
+def build_prompt(query: str, chunks: List[Dict], max_input_tokens: int = 512, max_chunks: int = 5,
+                 *, max_chars_per_chunk: Optional[int] = None) -> str:
+    """The packed prompt as one string. `max_chars_per_chunk` is deprecated: the token budget bounds
+    chunks now; if given, each chunk's text is still cut to that many characters before packing."""
+    if max_chars_per_chunk is not None:
+        warnings.warn("build_prompt(max_chars_per_chunk=...) is deprecated; use max_input_tokens",
+                      DeprecationWarning, stacklevel=2)
+        chunks = [dict(c, text=(c.get("text") or "")[:max_chars_per_chunk]) for c in chunks]
+    return "".join(prompt_segments(query, chunks, max_input_tokens, max_chunks))
+
+def _inference_mode(fn):
+    """torch.inference_mode() as a decorator that doesn't import torch at definition time."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with torch.inference_mode():
+            return fn(*args, **kwargs)
+    return wrapper
+
+def _ms(t0: float, t1: float) -> float:
+    return round((t1 - t0) * 1000.0, 2)
+
+def _encoder_mode() -> str:
+    # the ONNX backend runs its own encoder session and takes no precomputed states
+    if ENCODER_CACHE_MODE not in ("prompt", "chunks") or not isinstance(_model, torch.nn.Module): return "off"
+    return ENCODER_CACHE_MODE
+
+def _encode(rows: List[List[int]]) -> Tuple[List, int]:
+    """Encoder states (length x d_model) per token id list via ENCODER_CACHE; returns (states, cache hits)."""
+    global _encoder_owner
+    if _encoder_owner is not _model:
+        # another model / backend was installed: its encoder states aren't interchangeable
+        ENCODER_CACHE.clear()
+        _encoder_owner = _model
+    tag = f"{type(_model).__name__}@{_device}".encode()
+    keys = [hashlib.blake2b(tag + np.asarray(r, dtype=np.int64).tobytes(), digest_size=16).digest() for r in rows]
+    states = [ENCODER_CACHE.get(k) for k in keys]
+    hits = sum(s is not None for s in states)
+    todo: Dict[bytes, List[int]] = {}  # each distinct miss is encoded once, all in one padded call
+    for k, r, st in zip(keys, rows, states):
+        if st is None: todo.setdefault(k, r)
+    if todo:
+        width = max(len(r) for r in todo.values())
+        pad = _tokenizer.pad_token_id
+        ids = torch.tensor([r + [pad] * (width - len(r)) for r in todo.values()], device=_device)
+        mask = torch.tensor([[1] * len(r) + [0] * (width - len(r)) for r in todo.values()], device=_device)
+        hidden = _model.get_encoder()(input_ids=ids, attention_mask=mask).last_hidden_state
+        fresh = {}
+        for j, (k, r) in enumerate(todo.items()):
+            fresh[k] = hidden[j, :len(r)].clone()  # clone: a view would pin the whole padded batch
+            ENCODER_CACHE.put(k, fresh[k])
+        states = [st if st is not None else fresh[k] for k, st in zip(keys, states)]
+    return states, hits
+
+def _segment_ids(segments: List[str], limit: int) -> Tuple[List[List[int]], bool]:
+    """Token ids per prompt segment, cut to `limit` tokens in total; the last segment (+ </s>) is always kept.
+
+    Segments are encoded on their own, so a context line attends only to itself:
+    the states differ from encoding the whole prompt, and answers can drift
+    from NM_ENCODER_CACHE=prompt. In exchange a chunk is encoded once and then
+    reused by every question it is retrieved for.
+    """
+    tail = _tokenizer(segments[-1])["input_ids"]
+    budget, out, cut = limit - len(tail), [], False
+    for seg in segments[:-1]:
+        ids = _tokenizer(seg, add_special_tokens=False)["input_ids"]
+        if len(ids) > budget: ids, cut = ids[:max(0, budget)], True
+        if ids: out.append(ids)
+        budget -= len(ids)
+        if cut: break
+    return out + [tail], cut
+
+def _stack(states: List):
+    """Right-padded (batch, length, d_model) states and their attention mask."""
+    width = max(len(st) for st in states)
+    hidden = states[0].new_zeros((len(states), width, states[0].shape[-1]))
+    mask = torch.zeros((len(states), width), dtype=torch.long, device=hidden.device)
+    for i, st in enumerate(states):
+        hidden[i, :len(st)] = st
+        mask[i, :len(st)] = 1
+    return hidden, mask
+
+@_inference_mode
+def _generate_batch(prompts: List[str], max_input_tokens: int = 512, max_new_tokens: int = 128,
+                    num_beams: int = 3, segments: Optional[List[Optional[List[str]]]] = None,
+                    **generate_kwargs) -> List[Dict]:
+    """One padded `generate` call for a list of prompts.
+
+    Each result carries the answer plus telemetry read off the tensors already
+    built here (input/output token counts, truncation, stage timings), so the
+    caller never has to tokenize the prompt or answer again. `segments` (from
+    prompt_segments) are only used by NM_ENCODER_CACHE=chunks; `generate_kwargs`
+    (streamer, sampling) override the default generate arguments.
+    """
     _load()
-    prompt = build_prompt(query, chunks)
-    enc = _tokenizer(prompt, return_tensors="pt", truncation=True, max_length=min(max_input_tokens, 512)).to(_device)
+    limit = min(max_input_tokens, 512)
+    mode, hits = _encoder_mode(), 0
+    t0 = time.perf_counter()
+    if mode == "chunks":
+        cut_rows = [_segment_ids(segs or [p, ""], limit) for p, segs in zip(prompts, segments or [None] * len(prompts))]
+        truncated = [cut for _, cut in cut_rows]
+        t1 = time.perf_counter()
+        flat, hits = _encode([ids for segs, _ in cut_rows for ids in segs])
+        pieces = iter(flat)
+        states = [torch.cat([next(pieces) for _ in segs]) for segs, _ in cut_rows]
+    else:
+        enc = _tokenizer(prompts, return_tensors="pt", padding=True)
+        lengths = enc["attention_mask"].sum(dim=1)
+        truncated = lengths > limit
+        if bool(truncated.any()):
+            # same result as truncation=True (keep limit-1 tokens + </s>), but we learn who was cut
+            enc["input_ids"] = enc["input_ids"][:, :limit].clone()
+            enc["attention_mask"] = enc["attention_mask"][:, :limit]
+            enc["input_ids"][truncated, limit - 1] = _tokenizer.eos_token_id
+            lengths = lengths.clamp(max=limit)
+        lengths, truncated = lengths.tolist(), truncated.tolist()
+        t1 = time.perf_counter()
+        if mode == "prompt":
+            states, hits = _encode([row[:n] for row, n in zip(enc["input_ids"].tolist(), lengths)])
+        else:
+            inputs = enc.to(_device)
+    if mode != "off":
+        from transformers.modeling_outputs import BaseModelOutput
+        hidden, mask = _stack(states)
+        inputs = {"encoder_outputs": BaseModelOutput(last_hidden_state=hidden), "attention_mask": mask}
+        lengths = [len(st) for st in states]
+    t2 = time.perf_counter()
+    params = dict(max_new_tokens=max_new_tokens, num_beams=num_beams, no_repeat_ngram_size=3,
+                  do_sample=False, early_stopping=num_beams > 1)
+    params.update(generate_kwargs)
     try:
-        ids = _model.generate(
-            **enc,
-            max_new_tokens=max_new_tokens,
-            num_beams=3,
-            no_repeat_ngram_size=3,
-            do_sample=False,
-            early_stopping=True,
-        )
+        ids = _model.generate(**inputs, **params)
     except Exception:
-        ids = _model.generate(**enc, max_new_tokens=min(64, max_new_tokens))
-    return _tokenizer.decode(ids[0], skip_special_tokens=True)
+        if generate_kwargs: raise  # a streamer may already have emitted text; don't run a second pass
+        ids = _model.generate(**inputs, max_new_tokens=min(64, max_new_tokens))
+    t3 = time.perf_counter()
+    answers = _tokenizer.batch_decode(ids, skip_special_tokens=True)
+    out_lens = (ids != _tokenizer.pad_token_id).sum(dim=1).tolist()
+    t4 = time.perf_counter()
+    timings = {"tokenize_ms": _ms(t0, t1), "encode_ms": _ms(t1, t2), "generate_ms": _ms(t2, t3),
+               "decode_ms": _ms(t3, t4), "batch_size": len(prompts), "num_beams": num_beams,
+               "encoder_cache": mode, "encoder_hits": hits}
+    return [{"answer": a, "token_in": int(n_in), "token_out": int(n_out), "truncated": bool(cut),
+             "timings": dict(timings)}
+            for a, n_in, n_out, cut in zip(answers, lengths, out_lens, truncated)]
+
+def _warm_t5(_) -> None:
+    # one short generation: first-call allocations and kernel selection happen here, not in /predict
+    _generate_batch(["Question: warmup\n\nContext:\n\nAnswer:"], 32, 4, decoding_beams())
+
+REGISTRY.register("tokenizer", _load_tokenizer)
+REGISTRY.register("t5", _load_t5, warmup=_warm_t5)
+
+class _Job(NamedTuple):
+    prompt: str
+    max_input_tokens: int
+    max_new_tokens: int
+    num_beams: int
+    segments: Optional[List[str]]
+    fut: Future
+    enqueued: float
+
+class _MicroBatcher:
+    """Collects prompts arriving within `max_wait_s` (up to `max_batch`) into one generate call.
+
+    Callers block on a Future; one worker thread runs every batched generate
+    call, so concurrent /predict requests share a forward pass instead of
+    queueing on it. It is not the model's only caller: streamed answers
+    (STREAM_POOL) and NM_GEN_BATCHING=0 (CPU_POOL) call `_generate_batch` on
+    their own threads, alongside it. Generation only reads the model, and the
+    caches it touches are locked, so those calls compete for cores rather than
+    needing a lock; NM_STREAM_WORKERS and NM_CPU_WORKERS bound them.
+    """
+
+    def __init__(self, max_batch: int, max_wait_s: float, max_pending: int):
+        self.max_batch, self.max_wait_s, self.max_pending = max_batch, max_wait_s, max_pending
+        self._q: "queue.Queue[_Job]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def enqueue(self, prompt: str, max_input_tokens: int, max_new_tokens: int, num_beams: int = 3,
+                segments: Optional[List[str]] = None) -> Future:
+        if self._q.qsize() >= self.max_pending:
+            raise Overloaded(f"generation queue full ({self.max_pending})")
+        fut: Future = Future()
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="nm-generate", daemon=True)
+                self._worker.start()
+        self._q.put(_Job(prompt, max_input_tokens, max_new_tokens, num_beams, segments, fut, time.perf_counter()))
+        return fut
+
+    def submit(self, prompt: str, max_input_tokens: int, max_new_tokens: int, num_beams: int = 3,
+               segments: Optional[List[str]] = None) -> Dict:
+        return self.enqueue(prompt, max_input_tokens, max_new_tokens, num_beams, segments).result()
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try:
+                    batch.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # requests with different generation limits or beam counts can't share a call
+            groups: Dict[Tuple[int, int, int], List[_Job]] = {}
+            for job in batch:
+                groups.setdefault((job.max_input_tokens, job.max_new_tokens, job.num_beams), []).append(job)
+            for (max_in, max_new, beams), jobs in groups.items():
+                try:
+                    started = time.perf_counter()
+                    outs = _generate_batch([j.prompt for j in jobs], max_in, max_new, beams,
+                                           [j.segments for j in jobs])
+                    for job, out in zip(jobs, outs):
+                        out["timings"]["queue_ms"] = _ms(job.enqueued, started)
+                        job.fut.set_result(out)
+                except Exception as e:
+                    for job in jobs:
+                        job.fut.set_exception(e)
+
+_batcher = _MicroBatcher(BATCH_MAX, BATCH_WAIT_MS / 1000.0, MAX_PENDING)
+
+def generate_answers(queries: List[str], chunk_lists: List[List[Dict]], max_input_tokens: int = 512,
+                     max_new_tokens: int = 128, decoding: Optional[str] = None) -> List[Dict]:
+    """Answer several queries with padded batches of at most NM_GEN_BATCH_MAX prompts."""
+    beams = decoding_beams(decoding)
+    packed = [pack_prompt(q, c, max_input_tokens) for q, c in zip(queries, chunk_lists)]
+    segments = [segs for segs, _ in packed]
+    prompts = ["".join(segs) for segs in segments]
+    out: List[Dict] = []
+    for s in range(0, len(prompts), BATCH_MAX):
+        out.extend(_generate_batch(prompts[s:s + BATCH_MAX], max_input_tokens, max_new_tokens, beams,
+                                   segments[s:s + BATCH_MAX]))
+    for res, (_, report) in zip(out, packed): res["context"] = report
+    return out
+
+def generate_answer(query: str, chunks: List[Dict], max_input_tokens: int = 512, max_new_tokens: int = 128,
+                    decoding: Optional[str] = None) -> Dict:
+    """Return {"answer", "token_in", "token_out", "truncated", "timings", "context"} for one query."""
+    beams = decoding_beams(decoding)
+    segments, report = pack_prompt(query, chunks, max_input_tokens)
+    prompt = "".join(segments)
+    if BATCHING:
+        out = _batcher.submit(prompt, max_input_tokens, max_new_tokens, beams, segments)
+    else:
+        out = _generate_batch([prompt], max_input_tokens, max_new_tokens, beams, [segments])[0]
+    out["context"] = report
+    return out
+
+async def generate_answer_async(query: str, chunks: List[Dict], max_input_tokens: int = 512,
+                                max_new_tokens: int = 128, prompt: Optional[str] = None,
+                                decoding: Optional[str] = None, segments: Optional[List[str]] = None) -> Dict:
+    """Awaitable generate_answer: waits on the batcher without holding a thread; raises Overloaded when full.
+
+    Pass the `segments` from pack_prompt() when the caller already packed the
+    prompt; a bare `prompt` is encoded whole.
+    """
+    beams = decoding_beams(decoding)
+    if prompt is None:
+        if segments is None: segments = prompt_segments(query, chunks, max_input_tokens)
+        prompt = "".join(segments)
+    if BATCHING:
+        return await asyncio.wrap_future(_batcher.enqueue(prompt, max_input_tokens, max_new_tokens, beams, segments))
+    outs = await CPU_POOL.run(_generate_batch, [prompt], max_input_tokens, max_new_tokens, beams, [segments])
+    return outs[0]
+
+def _text_streamer(on_text: Callable[[str], None]):
+    from transformers import TextStreamer
+    class _Streamer(TextStreamer):
+        # TextStreamer holds text back until a word is complete, so pieces never split a word
+        def on_finalized_text(self, text: str, stream_end: bool = False) -> None:
+            if text: on_text(text)
+    return _Streamer(_tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+def _stop_when(cancel: threading.Event):
+    from transformers import StoppingCriteria, StoppingCriteriaList
+    class _Cancelled(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), cancel.is_set(), dtype=torch.bool, device=input_ids.device)
+    return StoppingCriteriaList([_Cancelled()])
+
+def stream_answer(query: str, chunks: List[Dict], on_text: Callable[[str], None], max_input_tokens: int = 512,
+                  max_new_tokens: int = 128, decoding: str = "greedy", segments: Optional[List[str]] = None,
+                  cancel: Optional[threading.Event] = None) -> Dict:
+    """Generate one answer outside the micro-batcher, calling `on_text(piece)` as words are decoded.
+
+    Blocking; run it on STREAM_POOL. Beam search can't stream (beams are
+    reordered until the end), so `decoding` is "greedy" or "sample" (top-p
+    NM_GEN_TOP_P at NM_GEN_TEMPERATURE). Setting `cancel` stops generation at
+    the next token. Returns the generate_answer dict, with timings.first_token_ms.
+    """
+    if decoding not in STREAM_DECODINGS:
+        raise ValueError(f"decoding {decoding!r} can't be streamed; expected one of {list(STREAM_DECODINGS)}")
+    t0 = time.perf_counter()
+    if segments is None: segments = prompt_segments(query, chunks, max_input_tokens)
+    first: List[float] = []
+    def emit(text: str) -> None:
+        if not first: first.append(time.perf_counter())
+        on_text(text)
+    kwargs = {"streamer": _text_streamer(emit)}
+    if decoding == "sample": kwargs.update(do_sample=True, top_p=TOP_P, temperature=TEMPERATURE)
+    if cancel is not None: kwargs["stopping_criteria"] = _stop_when(cancel)
+    out = _generate_batch(["".join(segments)], max_input_tokens, max_new_tokens, 1, [segments], **kwargs)[0]
+    out["timings"]["first_token_ms"] = _ms(t0, first[0]) if first else None
+    return out
+
+def generation_stats() -> Dict:
+    return {"batching": BATCHING, "pending": _batcher.depth(), "limit": MAX_PENDING,
+            "backend": BACKEND, "decoding": DECODING,
+            "encoder_cache": {"mode": ENCODER_CACHE_MODE, **ENCODER_CACHE.stats()},
+            "packing": {**_pack_totals, "token_cache": _chunk_tokens.stats()}}
 
 def count_tokens(text: str) -> int:
-    _load()
+    _tokenizer_only()
     return len(_tokenizer.encode(text))
@@ -0,0 +1,109 @@
+# app/ingest_queue.py
+"""In-process ingest pipeline for the local memory bank.
+
+`/ingest` enqueues records and returns a job id right away. A single worker
+thread drains the queue in batches: one `local_embed_many` call per batch, one
+append to the chunks file, and once ingest traffic goes quiet a debounced
+PageRank refresh and a save of the ANN index. Having exactly one writer also
+means concurrent requests no longer race on the JSONL and its `.tmp` rewrite.
+"""
+from typing import List, Dict, Optional
+from collections import OrderedDict
+from datetime import datetime, timezone
+import logging, os, queue, threading, time, uuid
+
+from app.memory_retrieve import local_embed_many, EMBED_MODEL, NM_USE_ANN
+from app.memory_bank import append_records
+from app.ann_index import add_chunks, save_index
+from app.pagerank_local import update_pagerank
+
+BATCH_MAX = int(os.environ.get("NM_INGEST_BATCH", "256"))
+PR_DEBOUNCE_S = float(os.environ.get("NM_PR_DEBOUNCE_S", "2.0"))
+MAX_JOBS_KEPT = 1000
+
+def write_records(path: str, records: List[Dict], vecs) -> None:
+    """Append embedded chunk records to the local bank: ANN index (unless NM_USE_ANN=0), then vectors + rows
+    (bumps the generation). With ANN off no index is kept; turning it on later builds one from the bank.
+    Records without a created_at are stamped with the write time (retention ages uncited chunks by it)."""
+    if not records: return
+    now = datetime.now(timezone.utc).isoformat()
+    records = [r if r.get("created_at") else dict(r, created_at=now) for r in records]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if NM_USE_ANN: add_chunks(path, [r["chunk_id"] for r in records], vecs)
+    append_records(path, records, vecs, local_embed_many, EMBED_MODEL)
+
+class IngestQueue:
+    def __init__(self, path: str):
+        self.path = path
+        self._q: "queue.Queue[str]" = queue.Queue()
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._records: Dict[str, List[Dict]] = {}
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._pr_due: Optional[float] = None
+
+    def submit(self, records: List[Dict]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"job_id": job_id, "state": "queued", "queued": len(records),
+                                  "chunk_ids": [r["chunk_id"] for r in records], "error": None,
+                                  "submitted_at": time.time()}
+            while len(self._jobs) > MAX_JOBS_KEPT:
+                self._jobs.popitem(last=False)
+            self._records[job_id] = records
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="nm-ingest", daemon=True)
+                self._worker.start()
+        self._q.put(job_id)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None: return None
+            return dict(job, pagerank_pending=self._pr_due is not None, queue_depth=self._q.qsize())
+
+    def _set(self, job_ids: List[str], **fields) -> None:
+        with self._lock:
+            for jid in job_ids:
+                if jid in self._jobs: self._jobs[jid].update(fields)
+
+    def _run(self) -> None:
+        while True:
+            timeout = None if self._pr_due is None else max(0.0, self._pr_due - time.monotonic())
+            try:
+                first = self._q.get(timeout=timeout)
+            except queue.Empty:
+                self._refresh_pagerank()
+                continue
+            job_ids, records = [first], list(self._records.pop(first, []))
+            while len(records) < BATCH_MAX:
+                try:
+                    jid = self._q.get_nowait()
+                except queue.Empty:
+                    break
+                job_ids.append(jid); records.extend(self._records.pop(jid, []))
+            self._set(job_ids, state="running")
+            try:
+                self._write(records)
+                self._set(job_ids, state="done", finished_at=time.time())
+                self._pr_due = time.monotonic() + PR_DEBOUNCE_S
+            except Exception as e:
+                logging.exception("ingest batch failed")
+                self._set(job_ids, state="failed", error=str(e), finished_at=time.time())
+
+    def _write(self, records: List[Dict]) -> None:
+        if not records: return
+        # embed once here so retrieval never has to re-encode stored chunks
+        write_records(self.path, records, local_embed_many([r["text"] for r in records]))
+
+    def _refresh_pagerank(self) -> None:
+        try:
+            save_index(self.path)
+        except Exception:
+            logging.exception("saving the ANN index failed")
+        try:
+            update_pagerank(self.path)
+        except Exception:
+            logging.exception("debounced pagerank refresh failed")
+        self._pr_due = None
@@ -0,0 +1,405 @@
+# app/memory_bank.py
+"""Local memory-bank storage.
+
+Chunk vectors are computed once (at ingest, or lazily the first time a chunk is
+seen) and persisted next to the chunks JSONL:
+
+  <chunks>.vecs.f32  raw float32 rows, append-only, memory-mapped on read
+  <chunks>.vecs.idx  header line, then one "chunk_id<TAB>content_hash" per row
+
+A row is reused only while its content hash matches the chunk text, so edited
+chunks are re-embedded instead of silently served stale.
+
+`MemoryBank` keeps the parsed chunks and their vectors resident so the query
+path never touches JSON. With NM_BANK_DTYPE=float16|int8 the resident vectors
+are quantized (2x / 4x smaller) and the top `pool` candidates of each query
+are re-scored against the memory-mapped float32 store.
+
+With NM_MEMORY_FORMAT=segments the bank is instead stored in the binary
+segment format of app/segment_store.py (the JSONL is imported on first use and
+no longer written). The module-level helpers below (`read_rows`, `iter_texts`,
+`append_records`, `write_pagerank`, `get_bank`) pick the right backend, so
+ingest, PageRank and retrieval don't care which one is active.
+"""
+from typing import List, Dict, Callable, Iterator, Tuple, Optional
+import hashlib, itertools, json, os, threading
+import numpy as np
+
+from app.scoring import ScoringMatrix, normalize_rows, quantize_rows
+
+FORMAT = os.environ.get("NM_MEMORY_FORMAT", "jsonl")  # "jsonl" | "segments"
+BANK_DTYPE = os.environ.get("NM_BANK_DTYPE", "float32")  # resident vectors: float32 | float16 | int8
+VECS_SUFFIX = ".vecs.f32"
+IDX_SUFFIX = ".vecs.idx"
+
+_lock = threading.Lock()
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:16]
+
+class _StoreIndex:
+    """Parsed <chunks>.vecs.idx of one path; later reads parse only the lines appended since."""
+
+    def __init__(self, inode: Optional[int] = None, header: bytes = b""):
+        self.inode, self.header, self.offset = inode, header, 0
+        self.model, self.dim = None, 0
+        self.ids: List[str] = []
+        self.hashes: List[str] = []
+        self.pos: Dict[str, int] = {}  # chunk_id -> latest row
+
+_INDEXES: Dict[str, _StoreIndex] = {}
+_index_lock = threading.Lock()
+
+def _read_index(path: str, model: str) -> Tuple[int, int, List[str], List[str], Dict[str, int]]:
+    """Return (dim, rows, ids, hashes, pos); empty if missing or written by another model.
+
+    The lists are shared and keep growing: only their first `rows` entries
+    (and `pos` values below `rows`) belong to this read.
+    """
+    idx_path = path + IDX_SUFFIX
+    with _index_lock:
+        try:
+            st = os.stat(idx_path)
+            with open(idx_path, "rb") as f:
+                header = f.readline()
+                ent = _INDEXES.get(path)
+                if ent is None or ent.inode != st.st_ino or ent.header != header or st.st_size < ent.offset:
+                    ent = _INDEXES[path] = _StoreIndex(st.st_ino, header)  # new or rewritten: parse from the top
+                    meta = dict(kv.split("=", 1) for kv in header.decode("utf-8").split() if "=" in kv)
+                    ent.model, ent.dim, ent.offset = meta.get("model"), int(meta.get("dim", 0)), len(header)
+                f.seek(ent.offset)
+                data = f.read()
+        except FileNotFoundError:
+            _INDEXES.pop(path, None)
+            return 0, 0, [], [], {}
+        end = data.rfind(b"\n") + 1  # a half-written last line is parsed on a later read
+        ent.offset += end
+        for line in data[:end].decode("utf-8").splitlines():
+            parts = line.split("\t")
+            if len(parts) == 2:
+                ent.pos[parts[0]] = len(ent.ids)
+                ent.ids.append(parts[0]); ent.hashes.append(parts[1])
+        if ent.model != model: return 0, 0, [], [], {}
+        return ent.dim, len(ent.ids), ent.ids, ent.hashes, ent.pos
+
+def _open_matrix(path: str, dim: int, n: int) -> np.ndarray:
+    vec_path = path + VECS_SUFFIX
+    if dim <= 0 or n <= 0 or not os.path.exists(vec_path):
+        return np.zeros((0, max(dim, 0)), dtype=np.float32)
+    rows = min(n, os.path.getsize(vec_path) // (4 * dim))
+    if rows == 0:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.memmap(vec_path, dtype=np.float32, mode="r", shape=(rows, dim))
+
+def append_vectors(path: str, ids: List[str], texts: List[str], vecs, model: str) -> None:
+    """Append vectors for (ids, texts) to the store; resets it on model/dim change."""
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    if vecs.ndim != 2 or len(vecs) == 0: return
+    dim = vecs.shape[1]
+    vec_path, idx_path = path + VECS_SUFFIX, path + IDX_SUFFIX
+    with _lock:
+        old_dim, n, _, _, _ = _read_index(path, model)  # parses only what was appended since the last call
+        if old_dim != dim:
+            n = 0
+            with open(idx_path, "w", encoding="utf-8") as f:
+                f.write(f"# model={model} dim={dim}\n")
+        # drop any torn tail from an interrupted append before writing new rows
+        with open(vec_path, "ab") as f:
+            f.truncate(n * dim * 4)
+            f.write(vecs.tobytes())
+        with open(idx_path, "a", encoding="utf-8") as f:
+            for cid, txt in zip(ids, texts):
+                f.write(f"{cid}\t{content_hash(txt)}\n")
+
+def compact_vectors(path: str, keep_ids, model: str, block: int = 65536) -> int:
+    """Rewrite the store with only the latest row of each id in `keep_ids`; returns rows kept."""
+    keep_ids = set(keep_ids)
+    vec_path, idx_path = path + VECS_SUFFIX, path + IDX_SUFFIX
+    with _lock:
+        dim, n, ids, hashes, _ = _read_index(path, model)
+        mat = _open_matrix(path, dim, n)
+        latest = {cid: i for i, cid in enumerate(ids[:len(mat)]) if cid in keep_ids}
+        rows = np.array(sorted(latest.values()), dtype=np.int64)
+        with open(vec_path + ".tmp", "wb") as f:
+            for s in range(0, len(rows), block):
+                f.write(np.ascontiguousarray(mat[rows[s:s + block]]).tobytes())
+        with open(idx_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(f"# model={model} dim={dim}\n")
+            for i in rows.tolist():
+                f.write(f"{ids[i]}\t{hashes[i]}\n")
+        del mat
+        os.replace(vec_path + ".tmp", vec_path)
+        os.replace(idx_path + ".tmp", idx_path)
+    return len(rows)
+
+def _match(path: str, rows: List[Dict], model: str) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """(store matrix, store row per entry of `rows` or -1, indices of rows that are missing or stale)."""
+    dim, n, ids, hashes, pos = _read_index(path, model)  # pos: later rows win
+    mat = _open_matrix(path, dim, n)
+    n = len(mat)
+    take = np.full(len(rows), -1, dtype=np.int64)
+    missing = []
+    for i, r in enumerate(rows):
+        j = pos.get(str(r.get("chunk_id")))
+        if j is not None and j < n and hashes[j] == content_hash(r.get("text", "")):
+            take[i] = j
+        else:
+            missing.append(i)
+    return mat, take, missing
+
+def load_vectors(path: str, rows: List[Dict], embed_many: Callable[[List[str]], np.ndarray],
+                 model: str, persist: bool = True, fmt: Optional[str] = None) -> np.ndarray:
+    """Return a float32 (len(rows), dim) matrix aligned with `rows`.
+
+    Vectors come from the persisted store; rows that are missing or whose text
+    hash changed are embedded in a single `embed_many` call and appended.
+    """
+    if (fmt or FORMAT) == "segments":
+        from app.segment_store import get_store
+        store = get_store(path)
+        if store.exists(): return store.vectors_for(rows, embed_many)
+    mat, take, missing = _match(path, rows, model)
+    dim = mat.shape[1]
+    new = None
+    if missing:
+        texts = [rows[i].get("text", "") for i in missing]
+        new = np.asarray(embed_many(texts), dtype=np.float32)
+        dim = new.shape[1]
+        if persist:
+            append_vectors(path, [str(rows[i].get("chunk_id")) for i in missing], texts, new, model)
+    out = np.empty((len(rows), dim), dtype=np.float32)
+    hit = take >= 0
+    if hit.any(): out[hit] = mat[take[hit]]
+    if new is not None: out[missing] = new
+    return out
+
+def locate_vectors(path: str, rows: List[Dict], embed_many: Callable[[List[str]], np.ndarray],
+                   model: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(memory-mapped store, store row of each entry of `rows`), embedding and appending missing rows first."""
+    mat, take, missing = _match(path, rows, model)
+    if missing:
+        texts = [rows[i].get("text", "") for i in missing]
+        append_vectors(path, [str(rows[i].get("chunk_id")) for i in missing], texts, embed_many(texts), model)
+        mat, take, missing = _match(path, rows, model)
+        if missing: raise RuntimeError(f"{path}{VECS_SUFFIX} changed while appending vectors")
+    return mat, take
+
+# ---- In-memory bank (columnar, reloaded only when the file changes) ----
+FALLBACK_ROWS = [{"chunk_id": "doc_fallback_0", "doc_id": "doc_fallback",
+                  "text": "Local mode is active. Provide telemetry/local_chunks.jsonl for your own memory.",
+                  "pagerank": 0.0}]
+
+_GENERATIONS: Dict[str, int] = {}
+_VIEW_VERSIONS = itertools.count(1)
+
+def bump_generation(path: str) -> int:
+    """Called by every in-process writer (ingest, PageRank) after changing `path`."""
+    with _lock:
+        _GENERATIONS[path] = _GENERATIONS.get(path, 0) + 1
+        return _GENERATIONS[path]
+
+def generation(path: str) -> int:
+    return _GENERATIONS.get(path, 0)
+
+def _parse_lines(data: bytes) -> List[Dict]:
+    rows = []
+    for line in data.splitlines():
+        try:
+            rows.append(json.loads(line))
+        except Exception:
+            continue
+    return rows
+
+class BankView:
+    """Immutable snapshot of the bank; readers keep using it while a reload builds the next one."""
+
+    def __init__(self, ids: List[str], doc_ids: List[str], texts: List[str], scorer: ScoringMatrix, generation: int):
+        self.ids, self.doc_ids, self.texts = ids, doc_ids, texts
+        self.scorer = scorer
+        self.generation = generation
+        self.version = next(_VIEW_VERSIONS)  # unique per snapshot; keys caches derived from the bank
+        self.pos = {cid: i for i, cid in enumerate(ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> Dict:
+        return {"chunk_id": self.ids[i], "doc_id": self.doc_ids[i],
+                "text": self.texts[i], "pagerank": float(self.scorer.pagerank[i])}
+
+class MemoryBank:
+    """Process-wide cache of a chunks file: ids, texts, PageRank array and normalized vectors.
+
+    `snapshot()` re-stats the file; an unchanged file costs nothing, an appended
+    tail (same inode, larger size) parses only the new lines, and anything else
+    (rewrite, shrink, new inode, generation bump with no append) reloads fully.
+    """
+
+    def __init__(self, path: str, embed_many: Callable[[List[str]], np.ndarray], model: str):
+        self.path, self.embed_many, self.model = path, embed_many, model
+        self._lock = threading.Lock()
+        self._view: Optional[BankView] = None
+        self._sig: Optional[Tuple] = None   # (generation, inode, size, mtime_ns)
+        self._offset = 0                     # bytes of complete lines consumed
+        self._src: Optional[Tuple[int, np.ndarray, np.ndarray]] = None  # quantized: (store inode, store map, row per bank row)
+
+    def snapshot(self) -> BankView:
+        with self._lock:
+            gen = generation(self.path)
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                if self._sig != (gen, None, 0, 0):
+                    self._view = self._build(FALLBACK_ROWS, gen, persist=False)
+                    self._sig, self._offset = (gen, None, 0, 0), 0
+                return self._view
+            sig = (gen, st.st_ino, st.st_size, st.st_mtime_ns)
+            if sig == self._sig and self._view is not None:
+                return self._view
+            old = self._sig
+            if old is not None and old[1] == st.st_ino and st.st_size > self._offset and self._view is not None:
+                self._view = self._append_tail(gen)
+            else:
+                self._offset = 0
+                self._view = self._build(self._read_tail(), gen)
+            self._sig = sig
+            return self._view
+
+    def _read_tail(self) -> List[Dict]:
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # leave a half-written last line for the next refresh
+        self._offset += end
+        return _parse_lines(data[:end])
+
+    def _build(self, rows: List[Dict], gen: int, persist: bool = True) -> BankView:
+        pr = [float(r.get("pagerank", 0.0) or 0.0) for r in rows]
+        ids, doc_ids, texts = [str(r.get("chunk_id")) for r in rows], [r.get("doc_id") for r in rows], [r.get("text") or "" for r in rows]
+        if BANK_DTYPE == "float32" or not persist:
+            self._src = None
+            vecs = load_vectors(self.path, rows, self.embed_many, self.model, persist=persist)
+            return BankView(ids, doc_ids, texts, ScoringMatrix(vecs, pr), gen)
+        src, take = locate_vectors(self.path, rows, self.embed_many, self.model)
+        raw, scales = quantize_rows(_UnitRows(src, take), BANK_DTYPE)
+        self._src = (os.stat(self.path + VECS_SUFFIX).st_ino, src, take)
+        scorer = ScoringMatrix.from_blocks([raw], pr, [scales], _exact_rows(src, take))
+        return BankView(ids, doc_ids, texts, scorer, gen)
+
+    def _append_tail(self, gen: int) -> BankView:
+        rows = self._read_tail()
+        old = self._view
+        if not rows:
+            return BankView(old.ids, old.doc_ids, old.texts, old.scorer, gen)
+        prev, exact = self._src, None
+        new = self._build(rows, gen)
+        if prev is not None and self._src is not None:
+            if self._src[0] != prev[0]:  # the store was compacted under us: row numbers moved
+                self._offset = 0
+                return self._build(self._read_tail(), gen)
+            ino, src, take = self._src[0], self._src[1], np.concatenate([prev[2], self._src[2]])
+            self._src = (ino, src, take)  # the newer map covers the older rows too (append-only file)
+            exact = _exact_rows(src, take)
+        return BankView(old.ids + new.ids, old.doc_ids + new.doc_ids, old.texts + new.texts,
+                        old.scorer.extend(new.scorer, exact), gen)
+
+class _UnitRows:
+    """Row-sliceable, normalized view of store rows `take` (lets quantize_rows stream from the map)."""
+
+    def __init__(self, src: np.ndarray, take: np.ndarray):
+        self.src, self.take = src, take
+        self.shape = (len(take), src.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.take)
+
+    def __getitem__(self, sl: slice) -> np.ndarray:
+        return normalize_rows(self.src[self.take[sl]])
+
+def _exact_rows(src: np.ndarray, take: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+    def fetch(idx: np.ndarray) -> np.ndarray:
+        return normalize_rows(src[take[idx]]) if len(idx) else np.zeros((0, src.shape[1]), dtype=np.float32)
+    return fetch
+
+_BANKS: Dict[str, MemoryBank] = {}
+
+def get_bank(path: str, embed_many: Callable[[List[str]], np.ndarray], model: str) -> MemoryBank:
+    with _lock:
+        bank = _BANKS.get(path)
+        if bank is None or bank.model != model:
+            if FORMAT == "segments":
+                from app.segment_store import SegmentBank
+                bank = _BANKS[path] = SegmentBank(path, embed_many, model)
+            else:
+                bank = _BANKS[path] = MemoryBank(path, embed_many, model)
+        return bank
+
+# ---- Format-independent access for writers and batch jobs ----
+def _segment_store(path: str):
+    if FORMAT != "segments": return None
+    from app.segment_store import get_store
+    store = get_store(path)
+    return store if store.exists() else None
+
+def read_rows(path: str) -> List[Dict]:
+    """Every chunk row of the bank at `path` (empty if there is none)."""
+    return read_rows_sized(path)[0]
+
+def read_rows_sized(path: str) -> Tuple[List[Dict], Optional[int]]:
+    """read_rows, plus the JSONL byte offset they were read up to (a torn last line is left out;
+    None for segments), so a rewrite can carry over lines appended after it (see write_pagerank)."""
+    store = _segment_store(path)
+    if store is not None: return list(store.rows()), None
+    if not os.path.exists(path): return [], 0
+    with open(path, "rb") as f:
+        data = f.read()
+    size = data.rfind(b"\n") + 1
+    return _parse_lines(data[:size]), size
+
+def iter_texts(path: str) -> Iterator[str]:
+    store = _segment_store(path)
+    if store is not None:
+        for seg in store.segments()[1]:
+            yield from seg.strings("texts")
+        return
+    if not os.path.exists(path): return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line).get("text") or ""
+            except Exception:
+                continue
+
+def append_records(path: str, records: List[Dict], vecs, embed_many: Callable[[List[str]], np.ndarray], model: str) -> None:
+    """Append embedded chunk records: a new segment, or vectors + one JSONL write."""
+    if FORMAT == "segments":
+        from app.segment_store import open_store
+        open_store(path, embed_many, model).append(records, vecs)
+        return
+    append_vectors(path, [r["chunk_id"] for r in records], [r["text"] for r in records], vecs, model)
+    payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(payload)  # whole batch in a single write
+    bump_generation(path)
+
+def write_pagerank(path: str, rows: List[Dict], values: Dict[str, float], size: Optional[int] = None) -> None:
+    """Store new PageRank values: an overlay per segment, or a rewrite of the JSONL `rows`.
+
+    `size` is the offset `rows` were read up to (read_rows_sized): lines appended
+    past it while the caller was computing are copied over unchanged, not lost.
+    """
+    store = _segment_store(path)
+    if store is not None:
+        store.set_pagerank(values)
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for r in rows:
+            r["pagerank"] = float(values.get(r.get("chunk_id"), 0.0))
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        if size is not None:
+            with open(path, "rb") as src:
+                src.seek(size)
+                f.write(src.read().decode("utf-8"))  # appended by an ingest meanwhile: keep as-is
+    os.replace(tmp, path)
+    bump_generation(path)
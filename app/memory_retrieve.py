@@ -1,7 +1,14 @@
 ﻿# app/memory_retrieve.py
+from __future__ import annotations
 from typing import List, Dict, Tuple, Optional, Callable
-import logging, math, os, json
-from google.cloud import bigquery
+import hashlib, logging, os, threading, time
+import numpy as np
+
+from app import memory_bank, scoring, ann_index
+from app.cache import LRUCache
+from app.models import REGISTRY, lazy_import
+
+bigquery = lazy_import("google.cloud.bigquery")  # only imported once a BigQuery path runs
 
 BQ_DATASET = "neuromem"
 BQ_TABLE   = "chunks"
@@ -10,89 +17,280 @@ DEFAULT_POOL = 200
 # ---- toggle: local (no BQ) vs BigQuery ----
 NM_USE_BQ = os.environ.get("NM_USE_BQ", "1") == "1"
 LOCAL_CHUNKS_PATH = os.environ.get("NM_LOCAL_CHUNKS", "telemetry/local_chunks.jsonl")
+# local ANN candidate search kicks in once the bank is larger than this
+NM_USE_ANN = os.environ.get("NM_USE_ANN", "1") == "1"
+ANN_MIN_CHUNKS = int(os.environ.get("NM_ANN_MIN_CHUNKS", "2000"))
 
 # ---- Local embed helper ----
-try:
-    from sentence_transformers import SentenceTransformer
-    _ST_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
-except Exception:
-    _ST_MODEL = None
+EMBED_MODEL = "all-MiniLM-L6-v2"
+
+def _load_embedder():
+    from sentence_transformers import SentenceTransformer  # pulls in torch: deferred until first use
+    return SentenceTransformer(EMBED_MODEL)
+
+REGISTRY.register("embedder", _load_embedder, warmup=lambda m: m.encode(["warmup"], convert_to_numpy=True))
+
+def _embedder():
+    try:
+        return REGISTRY.get("embedder")
+    except Exception as e:
+        raise RuntimeError("Local embedder not available. Run: pip install sentence-transformers") from e
 
 def local_embed(text: str) -> List[float]:
-    if _ST_MODEL is None:
-        raise RuntimeError("Local embedder not available. Run: pip install sentence-transformers")
-    vec = _ST_MODEL.encode([text], convert_to_numpy=True)[0]
+    vec = _embedder().encode([text], convert_to_numpy=True)[0]
     return [float(x) for x in vec.tolist()]
 
-# ---- Basic math helpers ----
-def _cosine(a: List[float], b: List[float]) -> float:
-    n = min(len(a), len(b))
-    if n == 0: return 0.0
-    dot = sa = sb = 0.0
-    for i in range(n):
-        ai = float(a[i]); bi = float(b[i])
-        dot += ai * bi; sa += ai * ai; sb += bi * bi
-    return 0.0 if sa == 0.0 or sb == 0.0 else dot / (math.sqrt(sa) * math.sqrt(sb))
+def local_embed_many(texts: List[str]) -> np.ndarray:
+    model = _embedder()
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    return model.encode(list(texts), convert_to_numpy=True, batch_size=64).astype(np.float32)
+
+# ---- Query caches ----
+# query text -> embedding, and (embedding, alpha, k, pool, memory version) -> ranked chunks.
+# The memory version changes with every bank reload, so /ingest and PageRank refreshes
+# invalidate cached results without any explicit purge.
+NM_QUERY_CACHE = os.environ.get("NM_QUERY_CACHE", "1") == "1"
+_embed_cache = LRUCache(int(os.environ.get("NM_EMBED_CACHE_SIZE", "4096")))
+_result_cache = LRUCache(int(os.environ.get("NM_RESULT_CACHE_SIZE", "1024")),
+                         ttl_s=float(os.environ.get("NM_RESULT_CACHE_TTL_S", "300")))
+
+def _normalize_query(text: str) -> str:
+    # MiniLM is uncased, so case and whitespace don't change the embedding
+    return " ".join((text or "").split()).lower()
+
+def embed_query(text: str) -> List[float]:
+    """local_embed with an LRU in front, keyed on the normalized query text."""
+    if not NM_QUERY_CACHE:
+        return local_embed(text)
+    key = _normalize_query(text)
+    vec = _embed_cache.get(key)
+    if vec is None:
+        vec = local_embed(text)
+        _embed_cache.put(key, vec)
+    return vec
+
+def embed_queries(texts: List[str]) -> np.ndarray:
+    """embed_query for a batch: one encode call for every text not already cached."""
+    keys = [_normalize_query(t) for t in texts]
+    vecs = {key: _embed_cache.get(key) for key in set(keys)} if NM_QUERY_CACHE else {}
+    missing: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if vecs.get(key) is None: missing.setdefault(key, text)
+    if missing:
+        for key, vec in zip(missing, local_embed_many(list(missing.values()))):
+            vecs[key] = [float(x) for x in vec.tolist()]
+            if NM_QUERY_CACHE: _embed_cache.put(key, vecs[key])
+    return np.asarray([vecs[key] for key in keys], dtype=np.float32)
+
+def memory_version() -> int:
+    """Changes whenever the local bank is reloaded; BigQuery results rely on the TTL instead."""
+    return 0 if NM_USE_BQ else _local_bank().version
+
+def cache_stats() -> Dict:
+    return {"embeddings": _embed_cache.stats(), "results": _result_cache.stats()}
+
+# ---- Result helpers ----
+def _ranked_rows(rows: List[Dict], idx, cosine, blend) -> List[Dict]:
+    return [{
+        "chunk_id": rows[i].get("chunk_id"),
+        "text": rows[i].get("text"),
+        "pagerank": float(rows[i].get("pagerank", 0.0) or 0.0),
+        "cosine": float(cosine[i]),
+        "blend": float(blend[i]),
+    } for i in idx]
 
 # ---- Local provider (no GCP usage) ----
-def _iter_local_chunks():
-    if os.path.exists(LOCAL_CHUNKS_PATH):
-        with open(LOCAL_CHUNKS_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    yield json.loads(line)
-                except Exception:
-                    continue
+_ann_synced_view = None
+
+def _load_bank() -> memory_bank.MemoryBank:
+    # the registry holds the live bank, never a snapshot: a reload replaces the view it serves
+    bank = memory_bank.get_bank(LOCAL_CHUNKS_PATH, local_embed_many, EMBED_MODEL)
+    bank.snapshot()
+    return bank
+
+def _local_bank() -> memory_bank.BankView:
+    return REGISTRY.get("bank").snapshot()
+
+def _sync_ann(view: memory_bank.BankView) -> ann_index.IVFIndex:
+    """Make sure every chunk in `view` is in the ANN index (once per bank snapshot)."""
+    global _ann_synced_view
+    idx = ann_index.get_index(LOCAL_CHUNKS_PATH, view.scorer.dim)
+    if _ann_synced_view is not view:
+        missing = [i for i, cid in enumerate(view.ids) if cid not in idx]
+        # first use, or chunks written by something other than /ingest; in blocks so
+        # a first sync of a large bank never holds all its float32 rows at once
+        for s in range(0, len(missing), 65536):
+            part = missing[s:s + 65536]
+            ann_index.add_chunks(LOCAL_CHUNKS_PATH, [view.ids[i] for i in part], view.scorer.rows(part))
+        if missing: ann_index.save_index(LOCAL_CHUNKS_PATH)
+        _ann_synced_view = view
+    return idx
+
+def _warm_bank(bank: memory_bank.MemoryBank) -> None:
+    view = bank.snapshot()
+    if NM_USE_ANN and len(view) >= ANN_MIN_CHUNKS:
+        _sync_ann(view)
+
+# loads the chunks, their vectors and (for large banks) the ANN index before the first query
+REGISTRY.register("bank", _load_bank, warmup=_warm_bank)
+
+def _retrieve_local_ann(q_vec: List[float], view: memory_bank.BankView, alpha: float, k: int, pool: int) -> Tuple[List[Dict], Dict]:
+    """Pool-sized ANN candidate set, then the PageRank blend on that pool (like the BQ VECTOR path)."""
+    index = _sync_ann(view)
+    ids, sims = index.search(q_vec, pool)
+    keep = [i for i, cid in enumerate(ids) if cid in view.pos]
+    rows = [view.pos[ids[i]] for i in keep]
+    cands = [view[i] for i in rows]
+    # quantized index: re-score the pool at full precision
+    cosine = view.scorer.rescore(rows, q_vec) if index.dtype != "float32" else sims[keep]
+    top_idx, blend = scoring.rank(cosine, [c["pagerank"] for c in cands], alpha, k)
+    return _ranked_rows(cands, top_idx, cosine, blend), {"alpha": alpha, "k": k, "pool": pool, "method": "local_ann"}
+
+def _retrieve_local(query_text: str, embed_fn, alpha: float, k: int, pool: int = DEFAULT_POOL,
+                    q_vec: Optional[List[float]] = None) -> Tuple[List[Dict], Dict]:
+    view = _local_bank()
+    if q_vec is None:
+        q_vec = embed_fn(query_text)
+    if embed_fn is local_embed and NM_USE_ANN and len(view) >= max(ANN_MIN_CHUNKS, pool):
+        return _retrieve_local_ann(q_vec, view, alpha, k, pool)
+    if embed_fn is local_embed:
+        # resident, pre-normalized vectors; nothing is parsed or encoded per query
+        scorer = view.scorer
     else:
-        # fallback: tiny built-in set
-        yield {"chunk_id": "doc_fallback_0", "doc_id":"doc_fallback",
-               "text": "Local mode is active. Provide telemetry/local_chunks.jsonl for your own memory.",
-               "pagerank": 0.0}
-
-def _retrieve_local(query_text: str, embed_fn, alpha: float, k: int) -> Tuple[List[Dict], Dict]:
-    q_vec = embed_fn(query_text)
-    cands = []
-    # collect first to compute PR normalization
-    rows = list(_iter_local_chunks())
-    pr_vals = [float(r.get("pagerank", 0.0)) for r in rows] or [0.0]
-    min_pr, max_pr = min(pr_vals), max(pr_vals)
-    denom = (max_pr - min_pr) or 1.0
-    for r in rows:
-        cosine = _cosine(q_vec, embed_fn(r.get("text","")))
-        pr = float(r.get("pagerank", 0.0))
-        pr_norm = (pr - min_pr) / denom if denom else 0.0
-        blend = float(alpha * cosine + (1.0 - alpha) * pr_norm)
-        cands.append({
-            "chunk_id": r.get("chunk_id"),
-            "text": r.get("text"),
-            "pagerank": pr,
-            "cosine": cosine,
-            "blend": blend
-        })
-    top = sorted(cands, key=lambda x: x["blend"], reverse=True)[:k]
-    return top, {"alpha": alpha, "k": k, "pool": 0, "method": "local"}
+        scorer = scoring.ScoringMatrix([embed_fn(t) for t in view.texts], view.scorer.pagerank)
+    idx, cosine, blend = scorer.rank(q_vec, alpha, k, pool)
+    return _ranked_rows(view, idx, cosine, blend), {"alpha": alpha, "k": k, "pool": pool if scorer.quantized else 0,
+                                                    "method": "local"}
+
+def _retrieve_local_batch(q_mat: np.ndarray, alpha: float, k: int, pool: int) -> List[Tuple[List[Dict], Dict]]:
+    view = _local_bank()
+    if NM_USE_ANN and len(view) >= max(ANN_MIN_CHUNKS, pool):
+        # IVF probing is per query; the win here is the shared encode call and snapshot
+        return [_retrieve_local_ann(q, view, alpha, k, pool) for q in q_mat]
+    meta = {"alpha": alpha, "k": k, "pool": pool if view.scorer.quantized else 0, "method": "local"}
+    return [(_ranked_rows(view, idx, cosine, blend), dict(meta))
+            for idx, cosine, blend in view.scorer.rank_many(q_mat, alpha, k, pool=pool)]
 
 # ---- BigQuery provider (read-only) ----
+# Top-`pool` cosine for ARRAY<FLOAT64> vectors. @qvec is unit-length, so
+# cosine = dot(vector, qvec) / |vector|, computed element-wise with UNNEST ... WITH OFFSET.
+# tools/emulate_bq_array_query.py translates both ARRAY queries to SQLite for offline checks.
+ARRAY_TOPK_SQL = """
+SELECT chunk_id, text, pagerank, cosine FROM (
+  SELECT c.chunk_id, c.text, c.pagerank,
+         (SELECT SUM(v * @qvec[OFFSET(i)]) FROM UNNEST(c.vector) AS v WITH OFFSET i)
+           / NULLIF(SQRT((SELECT SUM(v * v) FROM UNNEST(c.vector) AS v)), 0) AS cosine
+  FROM `{table}` AS c
+  WHERE c.vector IS NOT NULL AND ARRAY_LENGTH(c.vector) = ARRAY_LENGTH(@qvec)
+)
+WHERE cosine IS NOT NULL
+ORDER BY cosine DESC
+LIMIT @pool
+"""
+
+# Same scoring for a batch of queries in one job: @queries is ARRAY<STRUCT<qid INT64, qvec ARRAY<FLOAT64>>>
+# with unit-length qvecs; chunk norms are computed once and the top `pool` rows are kept per qid.
+ARRAY_BATCH_TOPK_SQL = """
+WITH q AS (SELECT qid, qvec FROM UNNEST(@queries)),
+c AS (
+  SELECT chunk_id, text, pagerank, vector,
+         SQRT((SELECT SUM(v * v) FROM UNNEST(vector) AS v)) AS norm
+  FROM `{table}`
+  WHERE vector IS NOT NULL
+)
+SELECT qid, chunk_id, text, pagerank, cosine FROM (
+  SELECT q.qid, c.chunk_id, c.text, c.pagerank,
+         (SELECT SUM(v * q.qvec[OFFSET(i)]) FROM UNNEST(c.vector) AS v WITH OFFSET i) / NULLIF(c.norm, 0) AS cosine
+  FROM c CROSS JOIN q
+  WHERE ARRAY_LENGTH(c.vector) = ARRAY_LENGTH(q.qvec)
+)
+WHERE cosine IS NOT NULL
+QUALIFY ROW_NUMBER() OVER (PARTITION BY qid ORDER BY cosine DESC) <= @pool
+"""
+
+# The batch for VECTOR columns: @queries as above, each qvec cast to a VECTOR once and scored
+# with VECTOR_COSINE_SIMILARITY, keeping the top `pool` rows per qid.
+VECTOR_BATCH_TOPK_SQL = """
+WITH q AS (SELECT qid, CAST(qvec AS VECTOR<FLOAT32>) AS qvec FROM UNNEST(@queries))
+SELECT q.qid, c.chunk_id, c.text, c.pagerank, VECTOR_COSINE_SIMILARITY(c.vector, q.qvec) AS cosine
+FROM `{table}` AS c CROSS JOIN q
+WHERE c.vector IS NOT NULL
+QUALIFY ROW_NUMBER() OVER (PARTITION BY q.qid ORDER BY cosine DESC) <= @pool
+"""
+
+# Clients are long-lived (one per project) and the detected vector column type
+# is cached for NM_BQ_SCHEMA_TTL_S, so a retrieval costs exactly one query job.
+SCHEMA_TTL_S = float(os.environ.get("NM_BQ_SCHEMA_TTL_S", "600"))
+_bq_lock = threading.Lock()
+_bq_clients: Dict[Optional[str], bigquery.Client] = {}
+_bq_schema: Dict[str, Tuple[str, float]] = {}  # table -> (vector type, expires at)
+
 def _get_client(project: Optional[str] = None) -> bigquery.Client:
-    return bigquery.Client(project=project) if project else bigquery.Client()
+    with _bq_lock:
+        client = _bq_clients.get(project)
+        if client is None:
+            client = bigquery.Client(project=project) if project else bigquery.Client()
+            _bq_clients[project] = client
+        return client
+
+def _table_id(client: bigquery.Client) -> str:
+    return f"{client.project}.{BQ_DATASET}.{BQ_TABLE}"
+
+def reset_bq_cache(project: Optional[str] = None, drop_client: bool = False) -> None:
+    """Forget the cached schema for `project` (and optionally its client) so the next call re-detects."""
+    with _bq_lock:
+        client = _bq_clients.pop(project, None) if drop_client else _bq_clients.get(project)
+        if client is not None:
+            _bq_schema.pop(_table_id(client), None)
+    if drop_client and project is None: REGISTRY.reset("bigquery")
+
+def _drop_client(client: bigquery.Client) -> None:
+    with _bq_lock:
+        for project, c in list(_bq_clients.items()):
+            if c is client: del _bq_clients[project]
+        _bq_schema.pop(_table_id(client), None)
+    if REGISTRY.loaded("bigquery") and REGISTRY.get("bigquery") is client:
+        REGISTRY.reset("bigquery")
 
 def _detect_vector_column_type(client: bigquery.Client) -> str:
+    table_id = _table_id(client)
+    hit = _bq_schema.get(table_id)
+    if hit is not None and hit[1] > time.monotonic():
+        return hit[0]
     try:
-        table = client.get_table(f"{client.project}.{BQ_DATASET}.{BQ_TABLE}")
+        vtype = "ARRAY"
+        table = client.get_table(table_id)
         for f in table.schema:
             if f.name == "vector":
                 t = (getattr(f, "field_type", "") or "").upper()
-                if t == "VECTOR": return "VECTOR"
-                if f.mode == "REPEATED" and t in ("FLOAT","FLOAT64"): return "ARRAY"
-        return "ARRAY"
+                if t == "VECTOR": vtype = "VECTOR"; break
+                if f.mode == "REPEATED" and t in ("FLOAT","FLOAT64"): vtype = "ARRAY"; break
     except Exception as e:
         logging.warning("detect vector type failed: %s", e)
-        return "ARRAY"
+        return "ARRAY"  # not cached: retry detection on the next query
+    with _bq_lock:
+        _bq_schema[table_id] = (vtype, time.monotonic() + SCHEMA_TTL_S)
+    return vtype
 
-def _retrieve_bq(query_text: str, embed_fn, alpha: float, k: int, pool: int) -> Tuple[List[Dict], Dict]:
-    client = _get_client()
-    q_vec = embed_fn(query_text)
-    vector_type = _detect_vector_column_type(client)
+def prepare_bq(project: Optional[str] = None) -> Tuple[bigquery.Client, str]:
+    """Client + vector column type; lets callers overlap this round-trip with query embedding.
+
+    The default project's client comes from the registry, so a query that
+    succeeds after a failed preload also marks BigQuery ready.
+    """
+    client = REGISTRY.get("bigquery") if project is None else _get_client(project)
+    return client, _detect_vector_column_type(client)
+
+# the default-project client; warmup caches the vector column type
+REGISTRY.register("bigquery", lambda: _get_client(), warmup=lambda c: _detect_vector_column_type(c))
+
+def _retrieve_bq(query_text: str, embed_fn, alpha: float, k: int, pool: int,
+                 q_vec: Optional[List[float]] = None,
+                 bq: Optional[Tuple[bigquery.Client, str]] = None) -> Tuple[List[Dict], Dict]:
+    client, vector_type = bq or prepare_bq()
+    if q_vec is None:
+        q_vec = embed_fn(query_text)
     method_used = "unknown"
     candidates: List[Dict] = []
 
@@ -128,9 +326,32 @@ def _retrieve_bq(query_text: str, embed_fn, alpha: float, k: int, pool: int) ->
             method_used = "bq_vector_sql"
         except Exception as e:
             logging.warning("VECTOR SQL path failed, falling back to ARRAY/python: %s", e)
+            _bq_schema.pop(_table_id(client), None)  # schema may have changed; re-detect next time
             vector_type = "ARRAY"
 
     if vector_type != "VECTOR":
+        # cosine computed in BigQuery over the whole table; only the top `pool` rows come back
+        try:
+            sql = ARRAY_TOPK_SQL.format(table=_table_id(client))
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ArrayQueryParameter("qvec", "FLOAT64", [float(x) for x in scoring.normalize_rows(q_vec)[0]]),
+                bigquery.ScalarQueryParameter("pool", "INT64", pool),
+            ])
+            rows = client.query(sql, job_config=job_config).result()
+            for r in rows:
+                rd = dict(r)
+                candidates.append({
+                    "chunk_id": rd.get("chunk_id"),
+                    "text": rd.get("text"),
+                    "pagerank": float(rd.get("pagerank") or 0.0),
+                    "cosine": float(rd.get("cosine") or 0.0),
+                })
+            method_used = "bq_array_sql"
+        except Exception as e:
+            logging.warning("ARRAY SQL path failed, falling back to python scoring: %s", e)
+            candidates = []
+
+    if vector_type != "VECTOR" and method_used == "unknown":
         try:
             limit = max(pool * 5, 500)
             sql = f"""
@@ -144,47 +365,66 @@ def _retrieve_bq(query_text: str, embed_fn, alpha: float, k: int, pool: int) ->
                 bigquery.ScalarQueryParameter("limit", "INT64", limit)
             ])
             rows = client.query(sql, job_config=job_config).result()
+            vecs = []
             for r in rows:
                 rd = dict(r)
                 vec = rd.get("vector")
                 if vec is None: continue
-                try:
-                    vlist = list(vec)
-                except Exception:
-                    vlist = vec
-                cosine = _cosine(q_vec, vlist)
+                vecs.append(list(vec))
                 candidates.append({
                     "chunk_id": rd.get("chunk_id"),
                     "text": rd.get("text"),
                     "pagerank": float(rd.get("pagerank") or 0.0),
-                    "cosine": float(cosine),
                 })
+            for c, cosine in zip(candidates, scoring.cosine_scores(q_vec, vecs)):
+                c["cosine"] = float(cosine)
             method_used = "python_fallback"
         except Exception as e:
             logging.error("ARRAY/python fallback failed: %s", e)
+            _drop_client(client)  # stale session/credentials: build a fresh client next time
             candidates = []
 
+    return _blend_candidates(candidates, alpha, k, pool, method_used)
+
+def _blend_candidates(candidates: List[Dict], alpha: float, k: int, pool: int, method: str) -> Tuple[List[Dict], Dict]:
+    meta = {"alpha": alpha, "k": k, "pool": pool, "method": method}
     if not candidates:
-        return [], {"alpha": alpha, "k": k, "pool": pool, "method": method_used}
-
-    pr_vals = [c.get("pagerank", 0.0) for c in candidates]
-    min_pr, max_pr = min(pr_vals), max(pr_vals)
-    denom = (max_pr - min_pr) or 1.0
-
-    scored = []
-    for c in candidates:
-        pr_norm = (c.get("pagerank", 0.0) - min_pr) / denom if denom else 0.0
-        cosine = c.get("cosine", 0.0)
-        blend = float(alpha * cosine + (1.0 - alpha) * pr_norm)
-        scored.append({
-            "chunk_id": c.get("chunk_id"),
-            "text": c.get("text"),
-            "pagerank": c.get("pagerank", 0.0),
-            "cosine": cosine,
-            "blend": blend
-        })
-    top = sorted(scored, key=lambda x: x["blend"], reverse=True)[:k]
-    return top, {"alpha": alpha, "k": k, "pool": pool, "method": method_used}
+        return [], meta
+    cosine = [c.get("cosine", 0.0) for c in candidates]
+    idx, blend = scoring.rank(cosine, [c.get("pagerank", 0.0) for c in candidates], alpha, k)
+    return _ranked_rows(candidates, idx, cosine, blend), meta
+
+def _retrieve_bq_batch(queries: List[str], q_mat: np.ndarray, alpha: float, k: int, pool: int,
+                       bq: Tuple[bigquery.Client, str]) -> List[Tuple[List[Dict], Dict]]:
+    client, vector_type = bq
+    if vector_type == "VECTOR":
+        sql, method = VECTOR_BATCH_TOPK_SQL, "bq_vector_batch_sql"
+    else:
+        sql, method = ARRAY_BATCH_TOPK_SQL, "bq_array_batch_sql"
+    try:
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter("queries", "STRUCT", [
+                bigquery.StructQueryParameter(
+                    None,
+                    bigquery.ScalarQueryParameter("qid", "INT64", i),
+                    bigquery.ArrayQueryParameter("qvec", "FLOAT64", [float(x) for x in q]))
+                for i, q in enumerate(scoring.normalize_rows(q_mat))]),
+            bigquery.ScalarQueryParameter("pool", "INT64", pool),
+        ])
+        per_query: List[List[Dict]] = [[] for _ in queries]
+        for r in client.query(sql.format(table=_table_id(client)), job_config=job_config).result():
+            rd = dict(r)
+            per_query[int(rd["qid"])].append({
+                "chunk_id": rd.get("chunk_id"),
+                "text": rd.get("text"),
+                "pagerank": float(rd.get("pagerank") or 0.0),
+                "cosine": float(rd.get("cosine") or 0.0),
+            })
+        return [_blend_candidates(c, alpha, k, pool, method) for c in per_query]
+    except Exception as e:
+        logging.warning("batched %s SQL failed, retrieving per query: %s", vector_type, e)
+    # one job per query, through the single-query path and its fallbacks
+    return [_retrieve_bq(text, local_embed, alpha, k, pool, q.tolist(), bq) for text, q in zip(queries, q_mat)]
 
 # ---- Public API (chooses provider) ----
 def retrieve_with_alpha(query_text: str,
@@ -192,9 +432,50 @@ def retrieve_with_alpha(query_text: str,
                         alpha: float = 0.5,
                         k: int = 5,
                         pool: int = DEFAULT_POOL,
-                        project: Optional[str] = None) -> Tuple[List[Dict], Dict]:
+                        project: Optional[str] = None,
+                        q_vec: Optional[List[float]] = None,
+                        bq: Optional[Tuple[bigquery.Client, str]] = None) -> Tuple[List[Dict], Dict]:
+    """Top-k chunks by alpha*cosine + (1-alpha)*PageRank.
+
+    `q_vec` skips embedding the query (already done by the caller); `bq` is a
+    `prepare_bq()` result to reuse on the BigQuery path.
+    """
     if embed_fn is None:
         embed_fn = local_embed
+    if embed_fn is not local_embed or not NM_QUERY_CACHE:
+        return _retrieve(query_text, embed_fn, alpha, k, pool, q_vec, bq)
+    if q_vec is None:
+        q_vec = embed_query(query_text)
+    key = (hashlib.sha1(np.asarray(q_vec, dtype=np.float32).tobytes()).hexdigest(),
+           float(alpha), int(k), int(pool), memory_version())
+    hit = _result_cache.get(key)
+    if hit is None:
+        hit = _retrieve(query_text, embed_fn, alpha, k, pool, q_vec, bq)
+        _result_cache.put(key, hit)
+    chunks, meta = hit
+    return [dict(c) for c in chunks], dict(meta)
+
+def retrieve_batch(queries: List[str],
+                   alpha: float = 0.5,
+                   k: int = 5,
+                   pool: int = DEFAULT_POOL,
+                   project: Optional[str] = None,
+                   q_vecs: Optional[np.ndarray] = None,
+                   bq: Optional[Tuple[bigquery.Client, str]] = None) -> List[Tuple[List[Dict], Dict]]:
+    """retrieve_with_alpha for many queries, one (chunks, meta) pair per query, in order.
+
+    Queries are embedded with a single encode call (or pass `q_vecs` from
+    `embed_queries`); locally they are scored as one matrix product against the
+    bank, on BigQuery as one query job. The result cache is not consulted.
+    """
+    if not queries:
+        return []
+    q_mat = embed_queries(queries) if q_vecs is None else np.asarray(q_vecs, dtype=np.float32)
+    if not NM_USE_BQ:
+        return _retrieve_local_batch(q_mat, alpha, k, pool)
+    return _retrieve_bq_batch(queries, q_mat, alpha, k, pool, bq or prepare_bq(project))
+
+def _retrieve(query_text, embed_fn, alpha, k, pool, q_vec, bq) -> Tuple[List[Dict], Dict]:
     if not NM_USE_BQ:
-        return _retrieve_local(query_text, embed_fn, alpha, k)
-    return _retrieve_bq(query_text, embed_fn, alpha, k, pool)
+        return _retrieve_local(query_text, embed_fn, alpha, k, pool, q_vec)
+    return _retrieve_bq(query_text, embed_fn, alpha, k, pool, q_vec, bq)
@@ -0,0 +1,115 @@
+# app/models.py
+"""Lazy registry for the heavy components (embedder, T5, BigQuery client, local bank).
+
+Nothing is imported or loaded when the app modules are imported. A component
+loads the first time `REGISTRY.get(name)` is called, exactly once even under
+concurrent callers. The server calls `REGISTRY.preload()` at startup, which
+loads every wanted component in parallel, runs each one's warmup (one
+embedding, one short generation) and records per-component timings that
+`/ready` reports. Until that finishes `/ready` answers 503, so Cloud Run only
+routes traffic to an instance whose first request won't pay for model loads.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import importlib, logging, os, threading, time, types
+
+PRELOAD = os.environ.get("NM_PRELOAD", "1") == "1"
+PRELOAD_WORKERS = int(os.environ.get("NM_PRELOAD_WORKERS", "4"))
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Module proxy that imports `name` on first attribute access (e.g. bigquery, torch)."""
+    class _Lazy(types.ModuleType):
+        def __getattr__(self, attr: str) -> Any:
+            module = importlib.import_module(name)
+            for key, value in module.__dict__.items():
+                self.__dict__.setdefault(key, value)  # later lookups skip __getattr__; patched names win
+            return self.__dict__[attr] if attr in self.__dict__ else getattr(module, attr)
+    return _Lazy(name)
+
+class ModelRegistry:
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._warmups: Dict[str, Callable[[Any], None]] = {}
+        self._values: Dict[str, Any] = {}
+        self._status: Dict[str, Dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._preload: Optional[threading.Thread] = None
+        self.wanted: List[str] = []
+
+    def register(self, name: str, loader: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None) -> None:
+        with self._lock:
+            self._loaders[name] = loader
+            if warmup is not None: self._warmups[name] = warmup
+            self._locks.setdefault(name, threading.Lock())
+            self._status.setdefault(name, {"loaded": False})
+
+    def get(self, name: str) -> Any:
+        """Load on first use; concurrent callers wait for the one load. Failures are retried on the next call."""
+        if name in self._values: return self._values[name]
+        with self._locks[name]:
+            if name in self._values: return self._values[name]
+            t0 = time.perf_counter()
+            try:
+                value = self._loaders[name]()
+            except Exception as e:
+                self._status[name] = {"loaded": False, "error": f"{type(e).__name__}: {e}"}
+                raise
+            self._status[name] = {"loaded": True, "load_ms": round((time.perf_counter() - t0) * 1000.0, 2)}
+            self._values[name] = value
+            return value
+
+    def set(self, name: str, value: Any) -> None:
+        """Install an already-built component (tests, or a caller that loaded it some other way)."""
+        self._values[name] = value
+        self._status[name] = {"loaded": True, "load_ms": 0.0}
+
+    def reset(self, name: str) -> None:
+        """Forget a loaded component (e.g. a client found broken); the next `get` loads it again."""
+        with self._locks[name]:
+            self._values.pop(name, None)
+            self._status[name] = {"loaded": False}
+
+    def loaded(self, name: str) -> bool:
+        return name in self._values
+
+    def _load_and_warm(self, name: str) -> None:
+        try:
+            value = self.get(name)
+            warmup = self._warmups.get(name)
+            if warmup is not None:
+                t0 = time.perf_counter()
+                warmup(value)
+                self._status[name]["warmup_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+        except Exception as e:
+            self._status[name].setdefault("error", f"{type(e).__name__}: {e}")
+            logging.exception("preloading %s failed", name)
+
+    def preload(self, names: Iterable[str], workers: int = PRELOAD_WORKERS) -> Dict:
+        """Load and warm `names` in parallel (blocking); returns `status()`."""
+        names = list(names)
+        self.wanted = names
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names) or 1)), thread_name_prefix="nm-load") as ex:
+            list(ex.map(self._load_and_warm, names))
+        logging.info("preloaded %s in %.0f ms", ", ".join(names), (time.perf_counter() - t0) * 1000.0)
+        return self.status()
+
+    def preload_async(self, names: Iterable[str], workers: int = PRELOAD_WORKERS) -> None:
+        names = list(names)
+        self.wanted = names
+        with self._lock:
+            if self._preload is None:
+                self._preload = threading.Thread(target=self.preload, args=(names, workers),
+                                                 name="nm-preload", daemon=True)
+                self._preload.start()
+
+    def ready(self) -> bool:
+        """Every wanted component is loaded and the startup preload (if any) has finished warming it."""
+        if self._preload is not None and self._preload.is_alive(): return False
+        return all(self.loaded(n) for n in self.wanted)
+
+    def status(self) -> Dict:
+        return {n: dict(self._status.get(n, {"loaded": False})) for n in self._loaders}
+
+REGISTRY = ModelRegistry()
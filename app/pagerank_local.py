@@ -1,89 +1,166 @@
 ﻿from __future__ import annotations
-from typing import List, Dict, Tuple
-import json, os, math, uuid, tempfile, shutil
+from typing import List, Dict, Tuple, NamedTuple, Optional
+import io, logging, os
+import numpy as np
 
-# Reuse the local embedder from memory_retrieve
-from app.memory_retrieve import local_embed, LOCAL_CHUNKS_PATH
+# Reuse the local embedder and the persisted chunk vectors
+from app.memory_retrieve import local_embed_many, LOCAL_CHUNKS_PATH, EMBED_MODEL
+from app.memory_bank import load_vectors, read_rows_sized, write_pagerank
+from app.scoring import normalize_rows, minmax
 
 SIM_THRESHOLD = float(os.environ.get("NM_PR_SIM_THRESHOLD", "0.38"))
 DAMPING = float(os.environ.get("NM_PR_DAMPING", "0.85"))
-ITERS = int(os.environ.get("NM_PR_ITERS", "20"))
-
-def _load_chunks(path: str) -> List[Dict]:
-    rows = []
-    if not os.path.exists(path): return rows
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                rows.append(json.loads(line))
-            except Exception:
-                pass
-    return rows
-
-def _cosine(a: List[float], b: List[float]) -> float:
-    n = min(len(a), len(b))
-    if n == 0: return 0.0
-    dot = sa = sb = 0.0
-    for i in range(n):
-        ai, bi = float(a[i]), float(b[i])
-        dot += ai * bi; sa += ai*ai; sb += bi*bi
-    return 0.0 if sa==0.0 or sb==0.0 else dot/(math.sqrt(sa)*math.sqrt(sb))
-
-def _build_graph(rows: List[Dict]) -> Tuple[List[str], Dict[str, Dict[str, float]]]:
-    """Return (ids, adj) where adj[u][v]=weight if sim>=threshold."""
+ITERS = int(os.environ.get("NM_PR_ITERS", "100"))  # upper bound; stops early at NM_PR_TOL
+TOL = float(os.environ.get("NM_PR_TOL", "1e-6"))
+INCR_ITERS = int(os.environ.get("NM_PR_INCR_ITERS", "10"))
+STATE_SUFFIX = ".pr.npz"
+BLOCK = int(os.environ.get("NM_PR_BLOCK", "1024"))
+
+def _load_chunks(path: str) -> Tuple[List[Dict], Optional[int]]:
+    return read_rows_sized(path)
+
+class Graph(NamedTuple):
+    """Similarity graph in CSR form: edges of node i are indices/weights[indptr[i]:indptr[i+1]]."""
+    ids: List[str]
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+
+def _to_csr(ids: List[str], src: np.ndarray, dst: np.ndarray, w: np.ndarray) -> Graph:
+    order = np.lexsort((dst, src))
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(ids)), out=indptr[1:])
+    return Graph(ids, indptr, dst[order].astype(np.int32), w[order].astype(np.float32))
+
+def _similarity_edges(rows: np.ndarray, mat: np.ndarray, threshold: float, offset: int = 0,
+                      block: int = BLOCK) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(src, dst, weight) for every pair with cosine >= threshold, one row block at a time.
+
+    `rows` are nodes offset..offset+len(rows)-1 of `mat`; self-loops are skipped.
+    """
+    src, dst, w = [], [], []
+    for s in range(0, len(rows), block):
+        sims = rows[s:s + block] @ mat.T  # at most block x n floats live at once
+        r = np.arange(len(sims))
+        sims[r, offset + s + r] = -np.inf
+        i, j = np.nonzero(sims >= threshold)
+        src.append(offset + s + i); dst.append(j); w.append(sims[i, j])
+    if not src:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    return np.concatenate(src), np.concatenate(dst), np.concatenate(w)
+
+def _build_graph(rows: List[Dict], path: str = LOCAL_CHUNKS_PATH) -> Graph:
+    """Sparse graph with an edge u->v weighted by cosine wherever sim >= threshold."""
     ids = [r.get("chunk_id") for r in rows]
-    texts = [r.get("text","") for r in rows]
-    vecs = [local_embed(t) for t in texts]
-
-    adj: Dict[str, Dict[str, float]] = {cid:{} for cid in ids}
-    n = len(ids)
-    for i in range(n):
-        for j in range(n):
-            if i==j: continue
-            sim = _cosine(vecs[i], vecs[j])
-            if sim >= SIM_THRESHOLD:
-                adj[ids[i]][ids[j]] = sim
-    return ids, adj
-
-def _pagerank(ids: List[str], adj: Dict[str, Dict[str, float]]) -> Dict[str, float]:
-    n = len(ids)
-    pr = {cid: 1.0/n for cid in ids}
-    # precompute out-weight
-    outw = {u: sum(adj[u].values()) for u in ids}
-    # build reverse adjacency for efficiency
-    incoming: Dict[str, List[Tuple[str,float]]] = {v: [] for v in ids}
-    for u in ids:
-        for v,w in adj[u].items():
-            incoming[v].append((u,w))
-    base = (1.0 - DAMPING) / n
-    for _ in range(ITERS):
-        new = {}
-        for v in ids:
-            s = 0.0
-            for (u,w) in incoming[v]:
-                denom = outw[u] or 1.0
-                s += pr[u] * (w/denom)
-            new[v] = base + DAMPING * s
-        pr = new
+    vecs = load_vectors(path, rows, local_embed_many, EMBED_MODEL, persist=os.path.exists(path))
+    mat = normalize_rows(vecs)
+    src, dst, w = _similarity_edges(mat, mat, SIM_THRESHOLD)
+    return _to_csr(ids, src, dst, w)
+
+def _load_state(path: str) -> Optional[Tuple[Graph, np.ndarray]]:
+    """Graph and raw (sum-to-one) PageRank saved by the last run, or None."""
+    state = path + STATE_SUFFIX
+    if not os.path.exists(state): return None
+    try:
+        with np.load(state) as z:
+            graph = Graph(z["ids"].tolist(), z["indptr"], z["indices"], z["weights"])
+            return graph, z["pr"]
+    except Exception:
+        return None
+
+def _save_state(path: str, graph: Graph, pr: np.ndarray) -> None:
+    buf = io.BytesIO()
+    np.savez(buf, ids=np.array(graph.ids, dtype=str), indptr=graph.indptr,
+             indices=graph.indices, weights=graph.weights, pr=pr)
+    with open(path + STATE_SUFFIX + ".tmp", "wb") as f:
+        f.write(buf.getvalue())
+    os.replace(path + STATE_SUFFIX + ".tmp", path + STATE_SUFFIX)
+
+def _pagerank(graph: Graph, start: Optional[np.ndarray] = None,
+              tol: float = TOL, max_iter: int = ITERS) -> Tuple[np.ndarray, Dict]:
+    """Power iteration on the weighted transition matrix.
+
+    Dangling nodes (no out-edges) spread their mass uniformly; iteration stops
+    once the L1 change drops below `tol`. Returns (raw scores summing to 1, stats).
+    """
+    n = len(graph.ids)
+    x = np.full(n, 1.0 / n) if start is None else np.asarray(start, dtype=np.float64)
+    x = x / (x.sum() or 1.0)
+    # transition weights: w(u->v) / outweight(u), row by row of the CSR
+    src = np.repeat(np.arange(n), np.diff(graph.indptr))
+    outw = np.bincount(src, weights=graph.weights, minlength=n)
+    dangling = outw == 0.0
+    outw[dangling] = 1.0
+    norm_w = graph.weights / outw[src]
+    it, resid = 0, float("inf")
+    while it < max_iter and resid >= tol:
+        new = DAMPING * np.bincount(graph.indices, weights=x[src] * norm_w, minlength=n)
+        new += (DAMPING * x[dangling].sum() + 1.0 - DAMPING) / n
+        resid = float(np.abs(new - x).sum())
+        x, it = new, it + 1
+    return x, {"nodes": n, "edges": int(len(graph.indices)), "iterations": it,
+               "residual": resid, "converged": resid < tol}
+
+def _write_chunks(path: str, rows: List[Dict], graph: Graph, pr: np.ndarray, size: Optional[int]) -> None:
     # min-max normalize for easier blend later (0..1)
-    vals = list(pr.values()) or [0.0]
-    lo, hi = min(vals), max(vals)
-    rng = (hi - lo) or 1.0
-    pr_norm = {k: (v - lo)/rng for k,v in pr.items()}
-    return pr_norm
-
-def recompute_pagerank(path: str = LOCAL_CHUNKS_PATH) -> int:
-    rows = _load_chunks(path)
+    pr_norm = dict(zip(graph.ids, minmax(pr).tolist()))
+    # write out with updated pagerank; chunks appended since `rows` were read are carried over
+    write_pagerank(path, rows, pr_norm, size)
+
+def recompute_pagerank(path: str = LOCAL_CHUNKS_PATH, warm_start: bool = True) -> int:
+    """Full rebuild of the graph and PageRank; meant for the periodic job (python -m app.pagerank_local)."""
+    rows, size = _load_chunks(path)
     if not rows: return 0
-    ids, adj = _build_graph(rows)
-    pr_norm = _pagerank(ids, adj)
-    # write out with updated pagerank
-    tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        for r in rows:
-            r["pagerank"] = float(pr_norm.get(r.get("chunk_id"), 0.0))
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-    shutil.move(tmp, path)
+    graph = _build_graph(rows, path)
+    start = None
+    state = _load_state(path) if warm_start else None
+    if state is not None:
+        prev = dict(zip(state[0].ids, state[1].tolist()))
+        start = np.array([prev.get(cid, 1.0 / len(rows)) for cid in graph.ids])
+    pr, stats = _pagerank(graph, start)
+    logging.info("pagerank: %(nodes)d nodes, %(edges)d edges, %(iterations)d iters, residual %(residual).2e", stats)
+    _save_state(path, graph, pr)
+    _write_chunks(path, rows, graph, pr, size)
+    return len(rows)
+
+def update_pagerank(path: str = LOCAL_CHUNKS_PATH) -> int:
+    """Fold chunks appended since the last run into the saved graph and refine PageRank.
+
+    Only the graph update is incremental: edges are computed for the new chunks
+    alone (new x all), and PageRank is refined with at most NM_PR_INCR_ITERS
+    warm-started iterations instead of a full rebuild. A run is still O(n) in
+    the bank size: it reads every row and vector, and rewrites every chunk's
+    PageRank (the JSONL, or one overlay per segment), since new edges and the
+    min-max normalization move all the values. Falls back to
+    `recompute_pagerank` when there is no saved graph or chunks were removed.
+    """
+    rows, size = _load_chunks(path)
+    if not rows: return 0
+    state = _load_state(path)
+    by_id = {r.get("chunk_id"): r for r in rows}
+    if state is None or any(cid not in by_id for cid in state[0].ids):
+        return recompute_pagerank(path)
+    graph, prev = state
+    known = set(graph.ids)
+    fresh = [r for r in rows if r.get("chunk_id") not in known]
+    if not fresh: return len(rows)
+
+    ordered = [by_id[cid] for cid in graph.ids] + fresh
+    ids = [r.get("chunk_id") for r in ordered]
+    n_old = len(graph.ids)
+    mat = normalize_rows(load_vectors(path, ordered, local_embed_many, EMBED_MODEL))
+    s_new, d_new, w_new = _similarity_edges(mat[n_old:], mat, SIM_THRESHOLD, offset=n_old)
+    back = d_new < n_old  # cosine is symmetric: mirror new->old edges as old->new
+    src = np.concatenate([np.repeat(np.arange(n_old), np.diff(graph.indptr)), s_new, d_new[back]])
+    dst = np.concatenate([graph.indices, d_new, s_new[back]])
+    w = np.concatenate([graph.weights, w_new, w_new[back]])
+    graph = _to_csr(ids, src, dst, w)
+
+    start = np.concatenate([prev, np.full(len(fresh), 1.0 / len(ids))])
+    pr, stats = _pagerank(graph, start, max_iter=INCR_ITERS)
+    logging.info("pagerank (+%d chunks): %d iters, residual %.2e", len(fresh), stats["iterations"], stats["residual"])
+    _save_state(path, graph, pr)
+    _write_chunks(path, rows, graph, pr, size)
     return len(rows)
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+# app/scoring.py
+"""Vectorized scoring shared by retrieval and PageRank.
+
+Everything works on contiguous float32 matrices of L2-normalized rows, so
+cosine similarity is a single matrix product and the alpha/PageRank blend plus
+top-k selection happen in one batched pass.
+"""
+from typing import Callable, Iterator, List, Tuple, Optional
+import numpy as np
+
+def normalize_rows(vecs) -> np.ndarray:
+    """Return a contiguous float32 copy of `vecs` with unit-length rows (zero rows stay zero)."""
+    mat = np.array(vecs, dtype=np.float32, copy=True, ndmin=2)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    mat /= norms
+    return np.ascontiguousarray(mat)
+
+def cosine_scores(q_vec, vecs) -> np.ndarray:
+    """Cosine of one query against every row of `vecs` (not pre-normalized)."""
+    if len(vecs) == 0: return np.zeros(0, dtype=np.float32)
+    return normalize_rows(vecs) @ normalize_rows(q_vec)[0]
+
+def minmax(x) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    if x.size == 0: return x
+    lo = float(x.min())
+    return (x - lo) / ((float(x.max()) - lo) or 1.0)
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first (argpartition, then sort only k)."""
+    n = len(scores)
+    k = max(0, min(int(k), n))
+    if k == 0: return np.zeros(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def rank(cosine, pagerank, alpha: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Blend cosine with min-max normalized PageRank; return (top-k indices, blend for all)."""
+    cosine = np.asarray(cosine, dtype=np.float32)
+    blend = alpha * cosine + (1.0 - alpha) * minmax(pagerank)
+    return top_k(blend, k), blend
+
+def quantize_rows(unit: np.ndarray, dtype: str, block: int = 65536) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Encode unit rows as `dtype` ("float32", "float16" or "int8"); int8 gets a symmetric per-row scale.
+
+    Works `block` rows at a time, so `unit` may be a memory map larger than RAM.
+    """
+    if dtype == "float32": return np.ascontiguousarray(unit, dtype=np.float32), None
+    if dtype not in ("float16", "int8"): raise ValueError(f"unknown vector dtype {dtype!r}")
+    out = np.empty(unit.shape, dtype=np.float16 if dtype == "float16" else np.int8)
+    scales = np.ones(len(unit), dtype=np.float32) if dtype == "int8" else None
+    for s in range(0, len(unit), block):
+        rows = np.asarray(unit[s:s + block], dtype=np.float32)
+        if scales is None:
+            out[s:s + block] = rows
+            continue
+        scale = np.abs(rows).max(axis=1) / 127.0 if rows.size else np.ones(len(rows), dtype=np.float32)
+        scale[scale == 0.0] = 1.0
+        out[s:s + block] = np.clip(np.rint(rows / scale[:, None]), -127, 127)
+        scales[s:s + block] = scale
+    return out, scales
+
+def dequantize(raw: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    if raw.dtype == np.float32: return raw
+    out = raw.astype(np.float32)
+    if scales is not None: out *= scales[:, None]
+    return out
+
+class ScoringMatrix:
+    """Corpus held as pre-normalized row blocks plus a PageRank column.
+
+    Blocks are scored one after another and the scores concatenated, so a
+    bank made of several memory-mapped segments (or an appended tail) is
+    scored in place without first being copied into one matrix.
+
+    Blocks may be float16 or int8 (with a float32 scale per row) to keep 2-4x
+    more rows resident. Their cosines are approximate, so `rank()` re-scores
+    the best `pool` candidates with full-precision rows from `exact`
+    (a callable: global row indices -> unit float32 rows), when there is one.
+    """
+
+    MERGE_ROWS = 4096   # trailing blocks smaller than this are merged on extend()
+    SCORE_ROWS = 16384  # quantized rows are widened to float32 this many at a time
+
+    def __init__(self, vecs, pagerank: Optional[np.ndarray] = None):
+        mat = normalize_rows(vecs) if len(vecs) else np.zeros((0, 0), dtype=np.float32)
+        self.blocks: List[np.ndarray] = [mat]
+        self.scales: List[Optional[np.ndarray]] = [None]
+        self.exact: Optional[Callable[[np.ndarray], np.ndarray]] = None
+        self.pagerank = (np.zeros(len(mat)) if pagerank is None
+                         else np.asarray(pagerank, dtype=np.float64))
+
+    @classmethod
+    def from_blocks(cls, blocks: List[np.ndarray], pagerank, scales: Optional[List[Optional[np.ndarray]]] = None,
+                    exact: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> "ScoringMatrix":
+        """Wrap already-normalized (or quantized) blocks, e.g. memory-mapped segments, without copying."""
+        out = cls.__new__(cls)
+        scales = scales or [None] * len(blocks)
+        keep = [i for i, b in enumerate(blocks) if len(b)]
+        out.blocks = [blocks[i] for i in keep] or [np.zeros((0, 0), dtype=np.float32)]
+        out.scales = [scales[i] for i in keep] or [None]
+        out.exact = exact
+        out.pagerank = np.asarray(pagerank, dtype=np.float64)
+        return out
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self.blocks)
+
+    @property
+    def dim(self) -> int:
+        return self.blocks[0].shape[1]
+
+    @property
+    def quantized(self) -> bool:
+        return any(b.dtype != np.float32 for b in self.blocks)
+
+    @property
+    def nbytes(self) -> int:
+        """Resident size of the vectors and scales (memory-mapped blocks included)."""
+        return sum(b.nbytes + (s.nbytes if s is not None else 0) for b, s in zip(self.blocks, self.scales))
+
+    @property
+    def mat(self) -> np.ndarray:
+        """All rows as one float32 matrix (copies when there is more than one block or rows are quantized)."""
+        if len(self.blocks) > 1 or self.quantized:
+            return np.ascontiguousarray(np.vstack([dequantize(b, s) for b, s in zip(self.blocks, self.scales)]))
+        return self.blocks[0]
+
+    def rows(self, idx) -> np.ndarray:
+        """Unit float32 rows by global index: from `exact` when set, else decoded from the blocks."""
+        idx = np.asarray(idx, dtype=np.int64)
+        if self.exact is not None: return self.exact(idx)
+        starts = np.cumsum([0] + [len(b) for b in self.blocks])
+        which = np.searchsorted(starts, idx, side="right") - 1
+        out = np.empty((len(idx), self.dim), dtype=np.float32)
+        for bi in np.unique(which).tolist():
+            sel = which == bi
+            local = idx[sel] - starts[bi]
+            s = self.scales[bi]
+            out[sel] = dequantize(self.blocks[bi][local], s[local] if s is not None else None)
+        return out
+
+    def extend(self, other: "ScoringMatrix", exact: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> "ScoringMatrix":
+        """New matrix with `other`'s rows appended (both already normalized); `exact` must cover both."""
+        pairs = [(b, s) for b, s in zip(self.blocks + other.blocks, self.scales + other.scales) if len(b)]
+        if len(pairs) > 1 and len(pairs[-2][0]) < self.MERGE_ROWS and pairs[-2][0].dtype == pairs[-1][0].dtype:
+            (b0, s0), (b1, s1) = pairs[-2:]
+            pairs[-2:] = [(np.ascontiguousarray(np.vstack([b0, b1])),
+                           None if s0 is None else np.concatenate([s0, s1]))]
+        return ScoringMatrix.from_blocks([b for b, _ in pairs], np.concatenate([self.pagerank, other.pagerank]),
+                                         [s for _, s in pairs], exact)
+
+    def _scores(self, q: np.ndarray) -> np.ndarray:
+        """(len(q) x n) cosine for unit query rows `q`."""
+        parts = []
+        for b, s in zip(self.blocks, self.scales):
+            if b.dtype == np.float32:
+                parts.append(q @ b.T); continue
+            out = np.empty((len(q), len(b)), dtype=np.float32)
+            for r in range(0, len(b), self.SCORE_ROWS):
+                out[:, r:r + self.SCORE_ROWS] = q @ b[r:r + self.SCORE_ROWS].astype(np.float32).T
+            if s is not None: out *= s
+            parts.append(out)
+        return np.hstack(parts)
+
+    def cosine(self, q_vec) -> np.ndarray:
+        if len(self) == 0: return np.zeros(0, dtype=np.float32)
+        return self._scores(normalize_rows(q_vec))[0]
+
+    def rescore(self, idx, q_vec) -> np.ndarray:
+        """Full-precision cosine of rows `idx` (decoded rows if there is no exact source)."""
+        return self.rows(idx) @ normalize_rows(q_vec)[0]
+
+    def _refine(self, q: np.ndarray, cosine: np.ndarray, blend: np.ndarray, alpha: float, k: int,
+                pool: int) -> np.ndarray:
+        """Re-score the top `pool` by approximate blend with exact rows (in place); return the new top-k."""
+        cand = top_k(blend, max(pool, k))
+        exact = self.exact(cand) @ q
+        blend[cand] += alpha * (exact - cosine[cand])
+        cosine[cand] = exact
+        return cand[top_k(blend[cand], k)]
+
+    def rank(self, q_vec, alpha: float, k: int, pool: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return (top-k indices, cosine, blend) for one query; quantized rows are re-scored over `pool`."""
+        cosine = self.cosine(q_vec)
+        idx, blend = rank(cosine, self.pagerank, alpha, k)
+        if pool and self.exact is not None and self.quantized and len(cosine):
+            idx = self._refine(normalize_rows(q_vec)[0], cosine, blend, alpha, k, pool)
+        return idx, cosine, blend
+
+    def rank_many(self, q_mat, alpha: float, k: int, block: int = 256,
+                  pool: int = 0) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """rank() for a batch of queries: one (block x n) matrix product per block of queries."""
+        q = normalize_rows(q_mat)
+        if len(self) == 0:
+            for _ in range(len(q)):
+                empty = np.zeros(0, dtype=np.float32)
+                yield np.zeros(0, dtype=np.int64), empty, empty
+            return
+        pr = (1.0 - alpha) * minmax(self.pagerank)
+        refine = pool and self.exact is not None and self.quantized
+        for s in range(0, len(q), block):
+            for j, cosine in enumerate(self._scores(q[s:s + block])):
+                blend = alpha * cosine + pr
+                idx = self._refine(q[s + j], cosine, blend, alpha, k, pool) if refine else top_k(blend, k)
+                yield idx, cosine, blend
@@ -0,0 +1,493 @@
+# app/segment_store.py
+"""Segment-based binary format for the local memory bank (NM_MEMORY_FORMAT=segments).
+
+The bank lives in a directory next to where the chunks JSONL would be:
+
+  <chunks>.segs/MANIFEST              JSON: version, ordered segments, PageRank overlays
+  <chunks>.segs/seg-000001.nmseg      immutable segment files
+  <chunks>.segs/seg-000001.pr-000007  PageRank overlay for a segment (float32 per row)
+
+Segment layout (little-endian, every block 64-byte aligned):
+
+  header    128 bytes: magic, format version, vector dtype, rows, dim, block offsets
+  vectors   rows x dim unit vectors: float32, float16, or int8 with ...
+  scales    ... one float32 scale per row (int8 only)
+  pagerank  float32 per row
+  ids, doc_ids, texts, extras
+            string columns: uint64 offsets (rows + 1), then a UTF-8 blob;
+            extras holds any other row fields as JSON
+
+Segments are memory-mapped: float32 vectors and PageRank are NumPy views on
+the map and a text is decoded only when it is read. A segment is never
+modified. Appends add a segment, PageRank updates write a small per-segment
+overlay, and small adjacent segments are merged by a background compaction
+that swaps the manifest atomically.
+
+CLI: python -m app.segment_store {import,export,compact,info} [--path CHUNKS_JSONL]
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import argparse, json, logging, os, struct, threading
+import numpy as np
+
+from app.scoring import ScoringMatrix, normalize_rows, quantize_rows, dequantize
+from app import memory_bank
+
+SEGS_SUFFIX = ".segs"
+SEG_EXT = ".nmseg"
+MAGIC = b"NMSEG\x00\x00\x01"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sHHIII12Q8x")  # 128 bytes
+OFFSETS = ("vectors", "scales", "pagerank", "ids", "ids_blob", "doc_ids", "doc_ids_blob",
+           "texts", "texts_blob", "extras", "extras_blob", "end")
+DTYPES = {0: "float32", 1: "float16", 2: "int8"}
+DTYPE_CODES = {v: k for k, v in DTYPES.items()}
+BASE_FIELDS = ("chunk_id", "doc_id", "text", "pagerank")
+ALIGN = 64
+
+VECTOR_DTYPE = os.environ.get("NM_SEG_DTYPE", "float32")
+MAX_SEGMENTS = int(os.environ.get("NM_SEG_MAX_SEGMENTS", "8"))
+SMALL_ROWS = int(os.environ.get("NM_SEG_SMALL_ROWS", "100000"))  # only segments below this get merged
+IMPORT_ROWS = 65536
+
+def segments_dir(path: str) -> str:
+    return os.path.splitext(path)[0] + SEGS_SUFFIX
+
+# ---- encoding ----
+def _strings(values: List[str]) -> Tuple[np.ndarray, bytes]:
+    enc = [(v or "").encode("utf-8") for v in values]
+    offs = np.zeros(len(enc) + 1, dtype=np.uint64)
+    offs[1:] = np.cumsum([len(b) for b in enc], dtype=np.uint64)
+    return offs, b"".join(enc)
+
+def write_segment(file_path: str, records: List[Dict], vecs, dtype: str = VECTOR_DTYPE) -> int:
+    """Write `records` (chunk dicts) and their vectors as one segment file; returns rows written."""
+    n = len(records)
+    unit = normalize_rows(vecs)
+    raw, scales = quantize_rows(unit, dtype)
+    extras = [json.dumps({k: v for k, v in r.items() if k not in BASE_FIELDS}, ensure_ascii=False)
+              if any(k not in BASE_FIELDS for k in r) else "" for r in records]
+    blocks: List[Tuple[str, bytes]] = [
+        ("vectors", raw.tobytes()),
+        ("scales", scales.tobytes() if scales is not None else b""),
+        ("pagerank", np.asarray([float(r.get("pagerank", 0.0) or 0.0) for r in records], dtype=np.float32).tobytes()),
+    ]
+    for col, values in (("ids", [str(r.get("chunk_id")) for r in records]),
+                        ("doc_ids", [r.get("doc_id") or "" for r in records]),
+                        ("texts", [r.get("text") or "" for r in records]),
+                        ("extras", extras)):
+        offs, blob = _strings(values)
+        blocks += [(col, offs.tobytes()), (col + "_blob", blob)]
+    offsets, pos = {}, HEADER.size
+    for name, data in blocks:
+        pos = -(-pos // ALIGN) * ALIGN
+        offsets[name] = pos
+        pos += len(data)
+    offsets["end"] = pos
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], n, unit.shape[1], 0,
+                         *[offsets[k] for k in OFFSETS])
+    tmp = file_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        for name, data in blocks:
+            f.seek(offsets[name])
+            f.write(data)
+        f.truncate(pos)
+    os.replace(tmp, file_path)
+    return n
+
+class Segment:
+    """Read-only, memory-mapped view of one segment file."""
+
+    def __init__(self, file_path: str, pr_path: Optional[str] = None):
+        self.file_path, self.name = file_path, os.path.basename(file_path)
+        with open(file_path, "rb") as f:
+            magic, version, dtype, n, dim, _, *offs = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{file_path}: not a v{FORMAT_VERSION} memory segment")
+        self.n, self.dim, self.dtype = n, dim, DTYPES[dtype]
+        o = dict(zip(OFFSETS, offs))
+        self._map = np.memmap(file_path, dtype=np.uint8, mode="r")
+        self.raw = np.frombuffer(self._map, dtype=np.dtype(self.dtype), count=n * dim, offset=o["vectors"]).reshape(n, dim)
+        self.scales = (np.frombuffer(self._map, dtype=np.float32, count=n, offset=o["scales"])
+                       if self.dtype == "int8" else None)
+        self.pagerank = (np.fromfile(pr_path, dtype=np.float32, count=n) if pr_path
+                         else np.frombuffer(self._map, dtype=np.float32, count=n, offset=o["pagerank"]))
+        self._cols = {col: (np.frombuffer(self._map, dtype=np.uint64, count=n + 1, offset=o[col]), o[col + "_blob"])
+                      for col in ("ids", "doc_ids", "texts", "extras")}
+        self._ids: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return self.n
+
+    def string(self, col: str, i: int) -> str:
+        offs, base = self._cols[col]
+        return bytes(self._map[base + int(offs[i]):base + int(offs[i + 1])]).decode("utf-8")
+
+    def strings(self, col: str) -> List[str]:
+        offs, base = self._cols[col]
+        blob = bytes(self._map[base:base + int(offs[-1])])
+        bounds = offs.tolist()
+        return [blob[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(self.n)]
+
+    @property
+    def ids(self) -> List[str]:
+        if self._ids is None: self._ids = self.strings("ids")
+        return self._ids
+
+    def vectors(self) -> np.ndarray:
+        """Unit float32 rows: a view on the map for float32 segments, a dequantized copy otherwise."""
+        return dequantize(self.raw, self.scales)
+
+    def row(self, i: int) -> Dict:
+        r = {"chunk_id": self.ids[i], "doc_id": self.string("doc_ids", i) or None,
+             "text": self.string("texts", i), "pagerank": float(self.pagerank[i])}
+        extra = self.string("extras", i)
+        if extra: r.update(json.loads(extra))
+        return r
+
+    def rows(self) -> Iterator[Dict]:
+        for i in range(self.n):
+            yield self.row(i)
+
+class SegmentStore:
+    def __init__(self, path: str):
+        self.path, self.root = path, segments_dir(path)
+        self._lock = threading.RLock()
+        self._open: Dict[Tuple[str, Optional[str]], Segment] = {}
+        self._compactor: Optional[threading.Thread] = None
+
+    # -- manifest --
+    def manifest(self) -> Dict:
+        try:
+            with open(os.path.join(self.root, "MANIFEST"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 0, "next": 1, "segments": []}
+
+    def _commit(self, m: Dict) -> None:
+        m["version"] += 1
+        tmp = os.path.join(self.root, "MANIFEST.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(m, f)
+        os.replace(tmp, os.path.join(self.root, "MANIFEST"))
+        memory_bank.bump_generation(self.path)
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.root, "MANIFEST"))
+
+    def segments(self) -> Tuple[int, List[Segment]]:
+        """(manifest version, open segments in order); segment maps are reused across calls."""
+        with self._lock:
+            m = self.manifest()
+            out = []
+            for e in m["segments"]:
+                key = (e["name"], e.get("pr"))
+                seg = self._open.get(key)
+                if seg is None:
+                    seg = self._open[key] = Segment(os.path.join(self.root, e["name"]),
+                                                    os.path.join(self.root, e["pr"]) if e.get("pr") else None)
+                out.append(seg)
+            live = {(e["name"], e.get("pr")) for e in m["segments"]}
+            for key in [k for k in self._open if k not in live]:
+                del self._open[key]
+            return m["version"], out
+
+    def _new_name(self, m: Dict) -> str:
+        name = f"seg-{m['next']:06d}{SEG_EXT}"
+        m["next"] += 1
+        return name
+
+    # -- writes --
+    def append(self, records: List[Dict], vecs, dtype: str = VECTOR_DTYPE) -> None:
+        if not records: return
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            m = self.manifest()
+            name = self._new_name(m)
+            rows = write_segment(os.path.join(self.root, name), records, vecs, dtype)
+            m["segments"].append({"name": name, "rows": rows, "pr": None})
+            self._commit(m)
+        self.maybe_compact_async()
+
+    def set_pagerank(self, values: Dict[str, float]) -> None:
+        """Write new PageRank overlays; chunks missing from `values` keep their current value."""
+        with self._lock:
+            m = self.manifest()
+            _, segs = self.segments()
+            stale = []
+            for e, seg in zip(m["segments"], segs):
+                pr = np.array([values.get(cid, p) for cid, p in zip(seg.ids, seg.pagerank.tolist())], dtype=np.float32)
+                name = f"{e['name'].rsplit('.', 1)[0]}.pr-{m['version'] + 1:06d}"
+                pr.tofile(os.path.join(self.root, name + ".tmp"))
+                os.replace(os.path.join(self.root, name + ".tmp"), os.path.join(self.root, name))
+                if e.get("pr"): stale.append(e["pr"])
+                e["pr"] = name
+            self._commit(m)
+            self._remove(stale)
+
+    def replace(self, old: List[str], records: List[Dict], vecs, dtype: str = VECTOR_DTYPE,
+                overlays: Optional[List[Optional[str]]] = None) -> bool:
+        """Swap the adjacent segments named in `old` for one segment holding `records`.
+
+        Returns False (and writes nothing) if those segments changed in the meantime,
+        or if `overlays` is given and their PageRank overlays no longer match it.
+        """
+        with self._lock:
+            m = self.manifest()
+            names = [e["name"] for e in m["segments"]]
+            if not old or any(n not in names for n in old): return False
+            at = names.index(old[0])
+            if names[at:at + len(old)] != old: return False
+            if overlays is not None and [e.get("pr") for e in m["segments"][at:at + len(old)]] != overlays:
+                return False
+            new = []
+            if records:
+                name = self._new_name(m)
+                write_segment(os.path.join(self.root, name), records, vecs, dtype)
+                new = [{"name": name, "rows": len(records), "pr": None}]
+            dropped = m["segments"][at:at + len(old)]
+            m["segments"][at:at + len(old)] = new
+            self._commit(m)
+            self._remove([e["name"] for e in dropped] + [e["pr"] for e in dropped if e.get("pr")])
+            return True
+
+    def _remove(self, names: List[str]) -> None:
+        for name in names:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                pass  # still mapped (Windows); collected by the next compaction
+        for key in [k for k in self._open if k[0] in names or k[1] in names]:
+            del self._open[key]
+
+    def _gc(self) -> None:
+        with self._lock:
+            m = self.manifest()
+            live = {e["name"] for e in m["segments"]} | {e["pr"] for e in m["segments"] if e.get("pr")}
+            junk = [f for f in os.listdir(self.root)
+                    if (f.endswith(SEG_EXT) or ".pr-" in f) and not f.endswith(".tmp") and f not in live]
+            self._remove(junk)
+
+    # -- compaction --
+    def _plan(self, m: Dict) -> List[List[Dict]]:
+        runs, run = [], []
+        for e in m["segments"]:
+            if e["rows"] < SMALL_ROWS:
+                run.append(e)
+            else:
+                if len(run) > 1: runs.append(run)
+                run = []
+        if len(run) > 1: runs.append(run)
+        return runs
+
+    def compact(self, force: bool = False) -> int:
+        """Merge runs of small adjacent segments (dropping superseded duplicate ids); returns segments merged."""
+        with self._lock:
+            m = self.manifest()
+            if not force and len(m["segments"]) <= MAX_SEGMENTS: return 0
+            _, segs = self.segments()
+            by_name = {s.name: s for s in segs}
+            runs = [([by_name[e["name"]] for e in run], [e.get("pr") for e in run]) for run in self._plan(m)]
+        merged = 0
+        for run, overlays in runs:
+            records, vecs = [], []
+            for seg in run:
+                records.extend(seg.rows()); vecs.append(seg.vectors())
+            mat = np.vstack(vecs)
+            last = {r["chunk_id"]: i for i, r in enumerate(records)}
+            keep = sorted(last.values())
+            # the merged rows carry the PageRank read above, so a set_pagerank() that landed
+            # meanwhile makes replace() refuse; the run is merged again by a later compaction
+            if self.replace([s.name for s in run], [records[i] for i in keep], mat[keep], overlays=overlays):
+                merged += len(run)
+        self._gc()
+        if merged: logging.info("compacted %d segments in %s", merged, self.root)
+        return merged
+
+    def maybe_compact_async(self) -> None:
+        if len(self.manifest()["segments"]) <= MAX_SEGMENTS: return
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive(): return
+            self._compactor = threading.Thread(target=self._compact_quietly, name="nm-compact", daemon=True)
+            self._compactor.start()
+
+    def _compact_quietly(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logging.exception("segment compaction failed")
+
+    # -- reads --
+    def rows(self) -> Iterator[Dict]:
+        for seg in self.segments()[1]:
+            yield from seg.rows()
+
+    def vectors_for(self, rows: List[Dict], embed_many: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Float32 unit vectors aligned with `rows` (latest segment wins); unknown ids are embedded."""
+        _, segs = self.segments()
+        where = {}
+        for si, seg in enumerate(segs):
+            for i, cid in enumerate(seg.ids):
+                where[cid] = (si, i)
+        hits = [where.get(str(r.get("chunk_id"))) for r in rows]
+        missing = [i for i, h in enumerate(hits) if h is None]
+        dim = segs[0].dim if segs else 0
+        new = None
+        if missing:
+            new = normalize_rows(embed_many([rows[i].get("text", "") for i in missing]))
+            dim = new.shape[1]
+        out = np.empty((len(rows), dim), dtype=np.float32)
+        for i, h in enumerate(hits):
+            if h is not None:
+                seg = segs[h[0]]
+                v = seg.raw[h[1]].astype(np.float32)
+                out[i] = v * seg.scales[h[1]] if seg.scales is not None else v
+        if new is not None: out[missing] = new
+        return out
+
+    # -- JSONL compatibility --
+    def import_jsonl(self, jsonl_path: str, embed_many: Callable[[List[str]], np.ndarray], model: str,
+                     dtype: str = VECTOR_DTYPE) -> int:
+        """Append every row of a chunks JSONL, reusing its persisted vectors (<jsonl>.vecs.f32) when present."""
+        n, batch = 0, []
+        def flush():
+            vecs = memory_bank.load_vectors(jsonl_path, batch, embed_many, model, persist=False, fmt="jsonl")
+            self.append(batch, vecs, dtype)
+        with open(jsonl_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    batch.append(json.loads(line))
+                except Exception:
+                    continue
+                if len(batch) >= IMPORT_ROWS:
+                    flush(); n += len(batch); batch = []
+        if batch:
+            flush(); n += len(batch)
+        return n
+
+    def export_jsonl(self, jsonl_path: str) -> int:
+        n = 0
+        with open(jsonl_path + ".tmp", "w", encoding="utf-8") as f:
+            for r in self.rows():
+                f.write(json.dumps(r, ensure_ascii=False) + "\n"); n += 1
+        os.replace(jsonl_path + ".tmp", jsonl_path)
+        return n
+
+_STORES: Dict[str, SegmentStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store(path: str) -> SegmentStore:
+    with _stores_lock:
+        store = _STORES.get(path)
+        if store is None:
+            store = _STORES[path] = SegmentStore(path)
+        return store
+
+def open_store(path: str, embed_many: Callable[[List[str]], np.ndarray], model: str) -> SegmentStore:
+    """get_store(), importing the chunks JSONL at `path` the first time the store is used."""
+    store = get_store(path)
+    with store._lock:
+        if not store.exists() and os.path.exists(path):
+            logging.info("importing %s into %s", path, store.root)
+            store.import_jsonl(path, embed_many, model)
+    return store
+
+# ---- bank view over segments ----
+class _Column(Sequence):
+    """Lazily decoded string column spanning several segments."""
+
+    def __init__(self, segs: List[Segment], col: str):
+        self.segs, self.col = segs, col
+        self.starts = np.cumsum([0] + [len(s) for s in segs])
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        s = int(np.searchsorted(self.starts, i, side="right")) - 1
+        value = self.segs[s].string(self.col, i - int(self.starts[s]))
+        return value or None if self.col == "doc_ids" else value
+
+def _exact_rows(segs: List[Segment]) -> Callable[[np.ndarray], np.ndarray]:
+    """Global row indices -> the most precise unit float32 rows the segments hold."""
+    starts = np.cumsum([0] + [len(s) for s in segs])
+    def fetch(idx: np.ndarray) -> np.ndarray:
+        which = np.searchsorted(starts, idx, side="right") - 1
+        out = np.empty((len(idx), segs[0].dim), dtype=np.float32)
+        for si in np.unique(which).tolist():
+            sel = which == si
+            local = idx[sel] - starts[si]
+            seg = segs[si]
+            out[sel] = dequantize(seg.raw[local], seg.scales[local] if seg.scales is not None else None)
+        return out
+    return fetch
+
+class SegmentBank:
+    """MemoryBank counterpart for the segment format: a snapshot is rebuilt only when the manifest changes.
+
+    float32 segments are scored straight from the map, or through a resident
+    NM_BANK_DTYPE copy (re-scored from the map) when that is float16/int8.
+    float16/int8 segments are scored from the map as they are.
+    """
+
+    def __init__(self, path: str, embed_many: Callable[[List[str]], np.ndarray], model: str):
+        self.path, self.embed_many, self.model = path, embed_many, model
+        self._lock = threading.Lock()
+        self._view: Optional[memory_bank.BankView] = None
+        self._key: Optional[Tuple[int, int]] = None
+        self._quant: Dict[str, Tuple[np.ndarray, Optional[np.ndarray]]] = {}  # segment name -> resident copy
+
+    def _blocks(self, segs: List[Segment]) -> Tuple[List[np.ndarray], np.ndarray, List[Optional[np.ndarray]]]:
+        live = {s.name for s in segs}
+        self._quant = {k: v for k, v in self._quant.items() if k in live}
+        blocks, scales = [], []
+        for s in segs:
+            raw, sc = s.raw, s.scales
+            if s.dtype == "float32" and memory_bank.BANK_DTYPE != "float32":
+                if s.name not in self._quant: self._quant[s.name] = quantize_rows(s.raw, memory_bank.BANK_DTYPE)
+                raw, sc = self._quant[s.name]
+            blocks.append(raw); scales.append(sc)
+        return blocks, np.concatenate([s.pagerank for s in segs]), scales
+
+    def snapshot(self) -> memory_bank.BankView:
+        with self._lock:
+            version, segs = open_store(self.path, self.embed_many, self.model).segments()
+            key = (memory_bank.generation(self.path), version)
+            if key == self._key and self._view is not None:
+                return self._view
+            if not segs:
+                rows = memory_bank.FALLBACK_ROWS
+                vecs = np.asarray(self.embed_many([r["text"] for r in rows]), dtype=np.float32)
+                self._view = memory_bank.BankView([r["chunk_id"] for r in rows], [r["doc_id"] for r in rows],
+                                                  [r["text"] for r in rows], ScoringMatrix(vecs), key[0])
+            else:
+                ids = [cid for s in segs for cid in s.ids]
+                scorer = ScoringMatrix.from_blocks(*self._blocks(segs), exact=_exact_rows(segs))
+                self._view = memory_bank.BankView(ids, _Column(segs, "doc_ids"), _Column(segs, "texts"), scorer, key[0])
+            self._key = key
+            return self._view
+
+if __name__ == "__main__":
+    from app.memory_retrieve import LOCAL_CHUNKS_PATH, EMBED_MODEL, local_embed_many
+    ap = argparse.ArgumentParser(description="Manage the segment-format memory bank.")
+    ap.add_argument("cmd", choices=("import", "export", "compact", "info"))
+    ap.add_argument("--path", default=LOCAL_CHUNKS_PATH, help="chunks JSONL the store sits next to")
+    ap.add_argument("--dtype", default=VECTOR_DTYPE, choices=sorted(DTYPE_CODES))
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    store = get_store(args.path)
+    if args.cmd == "import":
+        print("imported", store.import_jsonl(args.path, local_embed_many, EMBED_MODEL, args.dtype), "rows ->", store.root)
+    elif args.cmd == "export":
+        print("exported", store.export_jsonl(args.path), "rows ->", args.path)
+    elif args.cmd == "compact":
+        print("merged", store.compact(force=True), "segments")
+    else:
+        version, segs = store.segments()
+        print(json.dumps({"root": store.root, "version": version, "rows": sum(len(s) for s in segs),
+                          "bytes": sum(os.path.getsize(s.file_path) for s in segs),
+                          "segments": [{"name": s.name, "rows": len(s), "dtype": s.dtype} for s in segs]}, indent=1))
@@ -1,18 +1,31 @@
-﻿from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
 from typing import List, Dict, Optional
-import time, uuid, os, json
+import asyncio, threading, time, uuid, os, json
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import HTMLResponse
 from starlette.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
-from app.memory_retrieve import retrieve_with_alpha, LOCAL_CHUNKS_PATH
-from app.inference import generate_answer, build_prompt, count_tokens
+from app.memory_retrieve import (retrieve_with_alpha, retrieve_batch, embed_query, embed_queries, prepare_bq,
+                                 cache_stats, LOCAL_CHUNKS_PATH, NM_USE_BQ)
+from app.inference import (pack_prompt, generate_answer_async, stream_answer, generation_stats, decoding_beams,
+                           DECODING, STREAM_DECODINGS)
+from app.answer_cache import ANSWER_CACHE
+from app.executors import CPU_POOL, IO_POOL, STREAM_POOL, Overloaded
 from telemetry.logger import log_local
-from app.pagerank_local import recompute_pagerank
+from app.ingest_queue import IngestQueue
+from app import memory_bank, usage
+from app.models import REGISTRY, PRELOAD
 
 app = FastAPI(title="T5-NeuroMem", version="0.2.0")
+INGEST_QUEUE = IngestQueue(LOCAL_CHUNKS_PATH)
+PREDICT_BATCH_MAX = int(os.environ.get("NM_PREDICT_BATCH_MAX", "32"))
+STREAM_DISCONNECT_POLL_S = 0.25  # how often /predict/stream checks for a client that went away
+# citations are counted in memory and flushed in the background (see app/usage.py)
+USAGE = usage.UsageBuffer(usage.bq_sink(lambda: prepare_bq()[0]) if NM_USE_BQ
+                          else usage.local_sink(LOCAL_CHUNKS_PATH))
 
 # CORS for demo
 app.add_middleware(
@@ -24,6 +37,7 @@ class QueryRequest(BaseModel):
     text: str
     alpha: float = 0.5
     k: int = 3
+    decoding: Optional[str] = None  # "beam" | "greedy"; default NM_GEN_DECODING
 
 class PredictResponse(BaseModel):
     answer: str
@@ -31,6 +45,17 @@ class PredictResponse(BaseModel):
     k: int
     citations: List[str]
     chunks: List[Dict]
+    cache_hit: Optional[str] = None  # "exact" | "semantic" when the answer came from the answer cache
+    context: Optional[Dict] = None  # prompt packing report: chunk_ids packed, chunks/tokens used, cut, dropped, deduplicated
+
+class BatchQueryRequest(BaseModel):
+    texts: List[str]
+    alpha: float = 0.5
+    k: int = 3
+    decoding: Optional[str] = None
+
+class BatchPredictResponse(BaseModel):
+    results: List[PredictResponse]
 
 class IngestItem(BaseModel):
     text: str
@@ -48,9 +73,32 @@ def mode():
     return {
         "NM_USE_BQ": os.environ.get("NM_USE_BQ", "0"),
         "LOG_SINK": os.environ.get("LOG_SINK", "local"),
-        "memory_file": LOCAL_CHUNKS_PATH
+        "memory_file": LOCAL_CHUNKS_PATH,
+        "memory_format": memory_bank.FORMAT,
+        "queues": {"io": IO_POOL.stats(), "cpu": CPU_POOL.stats(), "stream": STREAM_POOL.stats(),
+                   "generate": generation_stats()},
+        "usage": USAGE.stats(),
     }
 
+@app.on_event("startup")
+def preload_models():
+    # load in the background so /health answers at once; /ready flips to 200 when everything is warm
+    if PRELOAD:
+        REGISTRY.preload_async(["embedder", "t5", "bigquery" if NM_USE_BQ else "bank"])
+
+@app.get("/ready")
+def ready():
+    body = {"ready": REGISTRY.ready(), "components": REGISTRY.status()}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.on_event("shutdown")
+def flush_usage():
+    USAGE.flush()
+
+@app.get("/cache")
+def cache():
+    return {"retrieval": cache_stats(), "answers": ANSWER_CACHE.stats()}
+
 @app.get("/", response_class=HTMLResponse)
 def root():
     return "<h3>T5-NeuroMem</h3><p>Try <a href='/demo'>/demo</a> or POST /predict</p>"
@@ -63,45 +111,195 @@ def demo():
     with open("app/static/index.html", "r", encoding="utf-8") as f:
         return HTMLResponse(f.read())
 
-def _row_dict(text, alpha, k, answer, citations, token_in, token_out, latency_ms):
+def _row_dict(text, alpha, k, answer, citations, token_in, token_out, latency_ms, cache_hit=None):
     return {
         "query_id": str(uuid.uuid4()), "user_id": "local", "text": text,
         "q_vector": None, "alpha": float(alpha), "k": int(k),
         "latency_ms": int(latency_ms), "response_text": answer,
         "citations": citations, "token_in": int(token_in),
-        "token_out": int(token_out), "cost_usd": 0.0,
+        "token_out": int(token_out), "cost_usd": 0.0, "cache_hit": cache_hit,
     }
 
-def _log_query(text, alpha, k, answer, citations, token_in, token_out, latency_ms):
-    log_local(_row_dict(text, alpha, k, answer, citations, token_in, token_out, latency_ms))
+def _log_query(text, alpha, k, answer, citations, token_in, token_out, latency_ms, cache_hit=None):
+    log_local(_row_dict(text, alpha, k, answer, citations, token_in, token_out, latency_ms, cache_hit))
+
+def _log_queries(rows):
+    for row in rows: log_local(row)
+
+async def _retrieve(text: str, alpha: float, k: int):
+    if not NM_USE_BQ:
+        return await CPU_POOL.run(retrieve_with_alpha, text, alpha=alpha, k=k)
+    # embed the query while the BigQuery client/schema round-trip is in flight
+    q_vec, bq = await asyncio.gather(CPU_POOL.run(embed_query, text), IO_POOL.run(prepare_bq))
+    return await IO_POOL.run(retrieve_with_alpha, text, alpha=alpha, k=k, q_vec=q_vec, bq=bq)
+
+async def _retrieve_many(texts: List[str], alpha: float, k: int):
+    if not NM_USE_BQ:
+        q_vecs = await CPU_POOL.run(embed_queries, texts)
+        return q_vecs, await CPU_POOL.run(retrieve_batch, texts, alpha=alpha, k=k, q_vecs=q_vecs)
+    q_vecs, bq = await asyncio.gather(CPU_POOL.run(embed_queries, texts), IO_POOL.run(prepare_bq))
+    return q_vecs, await IO_POOL.run(retrieve_batch, texts, alpha=alpha, k=k, q_vecs=q_vecs, bq=bq)
+
+def _check_decoding(decoding: Optional[str]) -> str:
+    try:
+        decoding_beams(decoding)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return decoding or DECODING
+
+async def _answer(text: str, chunks: List[Dict], q_vec=None, decoding: Optional[str] = None):
+    """Answer-cache lookup, else generation; returns (generation result + "context" report, cache_hit, citations).
+
+    Citations are the chunks packed into the prompt, not every retrieved one.
+    """
+    segments, packing = await CPU_POOL.run(pack_prompt, text, chunks)
+    citations = packing["chunk_ids"]
+    prompt = "".join(segments)
+    decoding = decoding or DECODING
+    variant = "" if decoding == "beam" else f"\x00{decoding}"  # beam keys unchanged from before
+    if ANSWER_CACHE.semantic and q_vec is None:
+        # embed_query is served from the embedding cache; only needed for semantic lookups
+        q_vec = await CPU_POOL.run(embed_query, text)
+    gen, cache_hit = ANSWER_CACHE.lookup(prompt, citations, q_vec, variant)
+    if gen is None:
+        gen = await generate_answer_async(text, chunks, decoding=decoding, segments=segments)
+        ANSWER_CACHE.store(prompt, citations, gen, q_vec, variant)
+    return {**gen, "context": packing}, cache_hit, citations
 
 @app.post("/predict", response_model=PredictResponse)
-def predict(req: QueryRequest):
+async def predict(req: QueryRequest):
     t0 = time.perf_counter()
-    res = retrieve_with_alpha(req.text, alpha=req.alpha, k=req.k)
-    chunks, _meta = (res if isinstance(res, (list,tuple)) and len(res)==2 and isinstance(res[1], dict) else (res, {}))
-    answer = generate_answer(req.text, chunks)
+    decoding = _check_decoding(req.decoding)
+    try:
+        res = await _retrieve(req.text, req.alpha, req.k)
+        chunks, _meta = (res if isinstance(res, (list,tuple)) and len(res)==2 and isinstance(res[1], dict) else (res, {}))
+        gen, cache_hit, citations = await _answer(req.text, chunks, decoding=decoding)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+    answer = gen["answer"]
+    if usage.ENABLED: USAGE.record(citations)
     latency_ms = int((time.perf_counter() - t0) * 1000)
-    prompt = build_prompt(req.text, chunks)
-    token_in = count_tokens(prompt); token_out = count_tokens(answer)
-    citations = [c.get("chunk_id") for c in chunks]
-    try: _log_query(req.text, req.alpha, req.k, answer, citations, token_in, token_out, latency_ms)
+    try: await IO_POOL.run(_log_query, req.text, req.alpha, req.k, answer, citations, gen["token_in"], gen["token_out"], latency_ms, cache_hit)
     except Exception as e: print("telemetry skipped:", e)
-    return {"answer": answer, "alpha": req.alpha, "k": req.k, "citations": citations, "chunks": chunks}
+    return {"answer": answer, "alpha": req.alpha, "k": req.k, "citations": citations, "chunks": chunks,
+            "cache_hit": cache_hit, "context": gen["context"]}
+
+@app.post("/predict/batch", response_model=BatchPredictResponse)
+async def predict_batch(req: BatchQueryRequest):
+    if not req.texts:
+        raise HTTPException(status_code=400, detail="No queries given.")
+    if len(req.texts) > PREDICT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX} queries per batch.")
+    decoding = _check_decoding(req.decoding)
+    t0 = time.perf_counter()
+    try:
+        # one embedding call and one scoring pass / BigQuery job for the whole batch;
+        # generation requests then coalesce in the micro-batcher
+        q_vecs, results = await _retrieve_many(req.texts, req.alpha, req.k)
+        answers = await asyncio.gather(*[_answer(text, chunks, q_vec, decoding) for text, (chunks, _meta), q_vec
+                                         in zip(req.texts, results, q_vecs)])
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+    latency_ms = int((time.perf_counter() - t0) * 1000)
+    out, rows = [], []
+    for text, (chunks, _meta), (gen, cache_hit, citations) in zip(req.texts, results, answers):
+        out.append({"answer": gen["answer"], "alpha": req.alpha, "k": req.k, "citations": citations,
+                    "chunks": chunks, "cache_hit": cache_hit, "context": gen["context"]})
+        rows.append(_row_dict(text, req.alpha, req.k, gen["answer"], citations, gen["token_in"],
+                              gen["token_out"], latency_ms, cache_hit))
+        if usage.ENABLED: USAGE.record(citations)
+    try: await IO_POOL.run(_log_queries, rows)
+    except Exception as e: print("telemetry skipped:", e)
+    return {"results": out}
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+_watchers = set()  # strong refs: the loop only keeps weak ones to running tasks
+
+def _cancel_on_disconnect(request: Request, cancel: threading.Event, fut) -> None:
+    """Set `cancel` once the client disconnects, even if the response never started streaming."""
+    async def watch():
+        while not fut.done() and not cancel.is_set():
+            if await request.is_disconnected():
+                cancel.set(); return
+            await asyncio.sleep(STREAM_DISCONNECT_POLL_S)
+    task = asyncio.create_task(watch())
+    _watchers.add(task)
+    task.add_done_callback(_watchers.discard)
+
+@app.post("/predict/stream")
+async def predict_stream(req: QueryRequest, request: Request):
+    """Server-sent events: `retrieval` (chunks, citations, packing) at once, one `token` per decoded
+    piece, then `done` (answer, token counts, timings) or `error`. Greedy by default; no answer cache."""
+    t0 = time.perf_counter()
+    decoding = req.decoding or "greedy"
+    if decoding not in STREAM_DECODINGS:
+        raise HTTPException(status_code=400, detail=f"decoding {decoding!r} can't be streamed; "
+                                                    f"expected one of {list(STREAM_DECODINGS)}")
+    loop = asyncio.get_running_loop()
+    pieces: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    cancel = threading.Event()
+
+    def run(segments):
+        try:
+            return stream_answer(req.text, chunks, lambda t: loop.call_soon_threadsafe(pieces.put_nowait, t),
+                                 decoding=decoding, segments=segments, cancel=cancel)
+        finally:
+            loop.call_soon_threadsafe(pieces.put_nowait, None)
+
+    try:
+        res = await _retrieve(req.text, req.alpha, req.k)
+        chunks, _meta = (res if isinstance(res, (list,tuple)) and len(res)==2 and isinstance(res[1], dict) else (res, {}))
+        segments, packing = await CPU_POOL.run(pack_prompt, req.text, chunks)
+        fut = STREAM_POOL.submit(run, segments)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+    # the generator's finally only runs once iteration starts; a client gone before that is caught here
+    _cancel_on_disconnect(request, cancel, fut)
+    citations = packing["chunk_ids"]
+
+    async def events():
+        try:
+            yield _sse("retrieval", {"alpha": req.alpha, "k": req.k, "citations": citations, "chunks": chunks,
+                                     "context": packing})
+            while (piece := await pieces.get()) is not None:
+                yield _sse("token", {"text": piece})
+            try:
+                gen = await asyncio.wrap_future(fut)
+            except Exception as e:
+                yield _sse("error", {"detail": f"{type(e).__name__}: {e}"})
+                return
+            yield _sse("done", {"answer": gen["answer"], "token_in": gen["token_in"], "token_out": gen["token_out"],
+                                "truncated": gen["truncated"], "timings": gen["timings"]})
+            if usage.ENABLED: USAGE.record(citations)
+            latency_ms = int((time.perf_counter() - t0) * 1000)
+            try: await IO_POOL.run(_log_query, req.text, req.alpha, req.k, gen["answer"], citations,
+                                   gen["token_in"], gen["token_out"], latency_ms)
+            except Exception as e: print("telemetry skipped:", e)
+        finally:
+            cancel.set()  # client gone (or done): stop generating at the next token
+
+    return StreamingResponse(events(), media_type="text/event-stream", background=BackgroundTask(cancel.set),
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/ingest")
 def ingest(batch: IngestBatch):
-    os.makedirs(os.path.dirname(LOCAL_CHUNKS_PATH) or ".", exist_ok=True)
-    appended = 0
-    with open(LOCAL_CHUNKS_PATH, "a", encoding="utf-8") as f:
-        for it in batch.items:
-            if not it.text or not it.text.strip():
-                continue
-            cid = f"{(it.doc_id or 'local')}_{uuid.uuid4().hex[:8]}"
-            record = {"chunk_id": cid, "doc_id": it.doc_id or "local", "text": it.text.strip(), "pagerank": 0.0}
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-            appended += 1
-    if appended == 0:
+    records = []
+    for it in batch.items:
+        if not it.text or not it.text.strip():
+            continue
+        cid = f"{(it.doc_id or 'local')}_{uuid.uuid4().hex[:8]}"
+        records.append({"chunk_id": cid, "doc_id": it.doc_id or "local", "text": it.text.strip(), "pagerank": 0.0})
+    if not records:
         raise HTTPException(status_code=400, detail="No valid items to ingest.")
-    n = recompute_pagerank()  # refresh PR after ingest
-    return {"ok": True, "ingested": appended, "total_chunks": n}
+    # embedding, the append and the PageRank refresh happen on the ingest worker
+    job_id = INGEST_QUEUE.submit(records)
+    return {"ok": True, "job_id": job_id, "queued": len(records), "chunk_ids": [r["chunk_id"] for r in records]}
+
+@app.get("/ingest/{job_id}")
+def ingest_status(job_id: str):
+    status = INGEST_QUEUE.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown ingest job.")
+    return status
@@ -0,0 +1,113 @@
+# app/usage.py
+"""Buffered usage accounting for served citations.
+
+`/predict` only bumps in-memory counters; a background thread flushes the
+aggregated (uses, last_used) per chunk every NM_USAGE_FLUSH_S seconds, so
+serving a query never writes anything. Locally a flush is one append to
+<chunks>.usage.jsonl (folded into the chunks by memory/retention_job.py); on
+BigQuery it is one UPDATE over an array of per-chunk structs.
+"""
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import json, logging, os, threading, time
+
+from app.memory_retrieve import BQ_DATASET, BQ_TABLE, bigquery
+
+USAGE_SUFFIX = ".usage.jsonl"
+ENABLED = os.environ.get("NM_USAGE_TRACKING", "1") == "1"
+FLUSH_S = float(os.environ.get("NM_USAGE_FLUSH_S", "60"))
+
+Usage = Dict[str, Tuple[int, float]]  # chunk_id -> (uses, last use in epoch seconds)
+
+class UsageBuffer:
+    def __init__(self, sink: Callable[[Usage], None], flush_s: float = FLUSH_S):
+        self.sink, self.flush_s = sink, flush_s
+        self._pending: Usage = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self.flushed = self.failures = 0
+
+    def record(self, chunk_ids: List[str]) -> None:
+        now = time.time()
+        with self._lock:
+            for cid in chunk_ids:
+                if not cid: continue
+                uses, _ = self._pending.get(cid, (0, now))
+                self._pending[cid] = (uses + 1, now)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="nm-usage", daemon=True)
+                self._flusher.start()
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch: return 0
+        try:
+            self.sink(batch)
+        except Exception:
+            logging.exception("usage flush failed; keeping %d chunks for the next flush", len(batch))
+            self.failures += 1
+            with self._lock:
+                for cid, (uses, ts) in batch.items():
+                    old_uses, old_ts = self._pending.get(cid, (0, ts))
+                    self._pending[cid] = (old_uses + uses, max(old_ts, ts))
+            return 0
+        self.flushed += len(batch)
+        return len(batch)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_s)
+            self.flush()
+
+    def stats(self) -> Dict:
+        return {"pending": len(self._pending), "flushed": self.flushed, "failures": self.failures,
+                "flush_s": self.flush_s}
+
+def local_sink(chunks_path: str) -> Callable[[Usage], None]:
+    def write(batch: Usage) -> None:
+        payload = "".join(json.dumps({"chunk_id": cid, "uses": uses, "ts": ts}) + "\n"
+                          for cid, (uses, ts) in batch.items())
+        with open(chunks_path + USAGE_SUFFIX, "a", encoding="utf-8") as f:
+            f.write(payload)
+    return write
+
+USAGE_UPDATE_SQL = """
+UPDATE `{table}` AS c
+SET usage_count = IFNULL(c.usage_count, 0) + u.uses,
+    last_used = IF(c.last_used IS NULL OR c.last_used < u.last_used, u.last_used, c.last_used)
+FROM UNNEST(@usage) AS u
+WHERE c.chunk_id = u.chunk_id
+"""
+
+def bq_sink(get_client: Callable[[], bigquery.Client]) -> Callable[[Usage], None]:
+    def write(batch: Usage) -> None:
+        client = get_client()
+        table_id = f"{client.project}.{BQ_DATASET}.{BQ_TABLE}"
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter("usage", "STRUCT", [
+                bigquery.StructQueryParameter(
+                    None,
+                    bigquery.ScalarQueryParameter("chunk_id", "STRING", cid),
+                    bigquery.ScalarQueryParameter("uses", "INT64", uses),
+                    bigquery.ScalarQueryParameter("last_used", "TIMESTAMP", datetime.fromtimestamp(ts, timezone.utc)))
+                for cid, (uses, ts) in batch.items()]),
+        ])
+        client.query(USAGE_UPDATE_SQL.format(table=table_id), job_config=job_config).result()
+    return write
+
+def read_local_usage(paths: List[str]) -> Usage:
+    """Aggregate usage log files (missing files are skipped)."""
+    out: Usage = {}
+    for path in paths:
+        if not os.path.exists(path): continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue  # torn last line from an interrupted flush
+                uses, ts = out.get(rec["chunk_id"], (0, 0.0))
+                out[rec["chunk_id"]] = (uses + int(rec["uses"]), max(ts, float(rec["ts"])))
+    return out
@@ -0,0 +1,276 @@
+# memory/ingest.py
+"""
+Bulk ingestion: documents -> chunks -> embeddings -> local memory bank or BigQuery.
+
+Usage:
+  python -m memory.ingest SOURCE [--target local|bq] [--out PATH] [--batch-size 256]
+
+SOURCE is a directory (every .txt/.md file is one document, doc_id = relative path
+without extension) or a JSONL file with one {"doc_id", "text"} object per line.
+
+- streams: one document and one embedding batch are in memory at a time
+- dedupes chunks by content hash (8 bytes per chunk, seeded from what the target already holds)
+- local target: each batch goes through the same writer as /ingest (vectors, ANN index, JSONL),
+  the ANN index is saved and PageRank refreshed once at the end
+- bq target: rows are spooled to a temp NDJSON file and loaded every --load-rows rows
+  with a load job, never held in memory
+- resumable: the checkpoint records the last document/chunk position that is durably
+  written; rerunning the same command continues from there
+Run the local target while the server is stopped (or on another --out file): the server's
+ingest worker assumes it is the bank's only writer.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from datetime import datetime, timezone
+import argparse, json, logging, os, sys, tempfile, time
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # add project root to sys.path
+
+import numpy as np
+
+from app.models import lazy_import
+from app.memory_bank import content_hash, iter_texts
+from app.memory_retrieve import local_embed_many, LOCAL_CHUNKS_PATH, BQ_DATASET, BQ_TABLE
+from app.ingest_queue import write_records
+from app.ann_index import save_index
+from app.pagerank_local import update_pagerank
+
+bigquery = lazy_import("google.cloud.bigquery")  # only imported by the bq target
+
+TEXT_EXTS = (".txt", ".md")
+BATCH_SIZE = int(os.environ.get("NM_INGEST_EMBED_BATCH", "256"))
+LOAD_ROWS = int(os.environ.get("NM_INGEST_LOAD_ROWS", "50000"))
+MAX_CHARS = 400
+
+def chunk_text_simple(text: str, max_chars: int = 400):
+    """Naive chunker: split by sentences/paragraphs if possible, else sliding window."""
+    parts = [p.strip() for p in text.split("\n\n") if p.strip()]
+    if not parts:
+        parts = [text]
+    out = []
+    for p in parts:
+        if len(p) <= max_chars:
+            out.append(p)
+        else:
+            # sliding window on whitespace to avoid cutting words aggressively
+            start = 0
+            while start < len(p):
+                end = start + max_chars
+                if end >= len(p):
+                    out.append(p[start:].strip())
+                    break
+                # backtrack to last space
+                split_at = p.rfind(" ", start, end)
+                if split_at <= start:
+                    split_at = end
+                out.append(p[start:split_at].strip())
+                start = split_at
+    return out
+
+def iter_documents(source: str) -> Iterator[Tuple[str, str]]:
+    """Yield (doc_id, text) in a stable order, so checkpoint positions survive a restart."""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.lower().endswith(TEXT_EXTS): continue
+                full = os.path.join(root, name)
+                doc_id = os.path.splitext(os.path.relpath(full, source))[0].replace(os.sep, "/")
+                with open(full, "r", encoding="utf-8", errors="replace") as f:
+                    yield doc_id, f.read()
+        return
+    base = os.path.splitext(os.path.basename(source))[0]
+    with open(source, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f):
+            if not line.strip(): continue
+            rec = json.loads(line)
+            yield str(rec.get("doc_id") or rec.get("id") or f"{base}_{lineno}"), rec.get("text") or ""
+
+class HashSet:
+    """Content hashes as a sorted uint64 array plus a small set of recent additions."""
+
+    def __init__(self, merge_at: int = 65536):
+        self._sorted = np.zeros(0, dtype=np.uint64)
+        self._recent = set()
+        self.merge_at = merge_at
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    def __contains__(self, h: int) -> bool:
+        if h in self._recent: return True
+        i = int(np.searchsorted(self._sorted, np.uint64(h)))
+        return i < len(self._sorted) and int(self._sorted[i]) == h
+
+    def add(self, h: int) -> None:
+        self._recent.add(h)
+        if len(self._recent) >= self.merge_at:
+            new = np.sort(np.fromiter(self._recent, dtype=np.uint64, count=len(self._recent)))
+            self._sorted = np.insert(self._sorted, np.searchsorted(self._sorted, new), new)
+            self._recent.clear()
+
+def _hash64(text: str) -> int:
+    return int(content_hash(text), 16)
+
+# ---- Sinks ----
+class LocalSink:
+    """Appends to the local bank (chunks JSONL + vector store, or a new segment); every batch is durable once written."""
+
+    def __init__(self, path: str, pagerank: bool = True):
+        self.path, self.pagerank = path, pagerank
+
+    def seed(self, seen: HashSet) -> None:
+        for text in iter_texts(self.path):
+            seen.add(_hash64(text))
+
+    def record(self, chunk_id: str, doc_id: str, text: str) -> Dict:
+        return {"chunk_id": chunk_id, "doc_id": doc_id, "text": text, "pagerank": 0.0}
+
+    def write(self, records: List[Dict], vecs: np.ndarray) -> bool:
+        write_records(self.path, records, vecs)
+        return True
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        save_index(self.path)  # once per job; batches only append to the index's vector file
+        if self.pagerank:
+            update_pagerank(self.path)
+
+class BigQuerySink:
+    """Spools rows to a temp NDJSON file and appends them to the chunks table with load jobs."""
+
+    def __init__(self, project: Optional[str] = None, load_rows: int = LOAD_ROWS):
+        self.client = bigquery.Client(project=project) if project else bigquery.Client()
+        self.table_id = f"{self.client.project}.{BQ_DATASET}.{BQ_TABLE}"
+        self.load_rows = load_rows
+        self._spool = tempfile.TemporaryFile(mode="w+b", suffix=".ndjson")
+        self._pending = 0
+
+    def seed(self, seen: HashSet) -> None:
+        # same hash as app.memory_bank.content_hash, computed in BigQuery
+        sql = f"SELECT DISTINCT SUBSTR(TO_HEX(SHA1(IFNULL(text, ''))), 1, 16) AS h FROM `{self.table_id}`"
+        for row in self.client.query(sql).result(page_size=100000):
+            seen.add(int(row["h"], 16))
+
+    def record(self, chunk_id: str, doc_id: str, text: str) -> Dict:
+        now = datetime.now(timezone.utc).isoformat()
+        return {"chunk_id": chunk_id, "doc_id": doc_id, "text": text, "pagerank": 0.0,
+                "retention_score": 0.5, "usage_count": 0, "created_at": now, "updated_at": now}
+
+    def write(self, records: List[Dict], vecs: np.ndarray) -> bool:
+        lines = (json.dumps(dict(r, vector=[float(x) for x in v]), ensure_ascii=False) + "\n"
+                 for r, v in zip(records, vecs))
+        self._spool.write("".join(lines).encode("utf-8"))
+        self._pending += len(records)
+        if self._pending < self.load_rows:
+            return False
+        self.flush()
+        return True
+
+    def flush(self) -> None:
+        if not self._pending: return
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            ignore_unknown_values=True,
+        )
+        self._spool.seek(0)
+        job = self.client.load_table_from_file(self._spool, self.table_id, job_config=job_config)
+        job.result()  # wait, so the checkpoint only ever covers loaded rows
+        logging.info("loaded %d rows into %s (job %s)", self._pending, self.table_id, job.job_id)
+        self._spool.seek(0)
+        self._spool.truncate()
+        self._pending = 0
+
+    def close(self) -> None:
+        self._spool.close()
+
+# ---- Checkpoint ----
+def _load_checkpoint(path: Optional[str], source: str) -> Dict:
+    fresh = {"source": os.path.abspath(source), "doc": 0, "chunk": 0, "written": 0, "done": False}
+    if not path or not os.path.exists(path): return fresh
+    with open(path, "r", encoding="utf-8") as f:
+        ckpt = json.load(f)
+    if ckpt.get("source") != fresh["source"]:
+        logging.warning("checkpoint %s is for %s; starting from the beginning", path, ckpt.get("source"))
+        return fresh
+    return ckpt
+
+def _save_checkpoint(path: Optional[str], ckpt: Dict) -> None:
+    if not path: return
+    ckpt = dict(ckpt, updated_at=time.time())
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(ckpt, f)
+    os.replace(path + ".tmp", path)
+
+# ---- Pipeline ----
+def ingest(source: str, sink, batch_size: int = BATCH_SIZE, max_chars: int = MAX_CHARS,
+           checkpoint: Optional[str] = None, embed_many=local_embed_many) -> Dict:
+    """Stream `source` into `sink`; returns counters. Resumes from `checkpoint` when it matches `source`."""
+    ckpt = _load_checkpoint(checkpoint, source)
+    start = (ckpt["doc"], ckpt["chunk"])
+    seen = HashSet()
+    sink.seed(seen)
+    stats = {"docs": 0, "chunks": 0, "duplicates": 0, "written": 0, "resumed_at": list(start)}
+    batch: List[Dict] = []
+    pos = start
+    t0 = time.perf_counter()
+
+    def flush_batch():
+        vecs = embed_many([r["text"] for r in batch])
+        durable = sink.write(batch, vecs)
+        stats["written"] += len(batch)
+        batch.clear()
+        if durable:
+            _save_checkpoint(checkpoint, dict(ckpt, doc=pos[0], chunk=pos[1], written=ckpt["written"] + stats["written"]))
+        logging.info("%d chunks written, %d duplicates, %.0f chunks/s", stats["written"], stats["duplicates"],
+                     stats["written"] / max(time.perf_counter() - t0, 1e-9))
+
+    for d, (doc_id, text) in enumerate(iter_documents(source)):
+        if d < start[0]: continue
+        stats["docs"] += 1
+        for i, chunk in enumerate(chunk_text_simple(text, max_chars)):
+            if (d, i) < start or not chunk: continue
+            pos = (d, i + 1)
+            stats["chunks"] += 1
+            h = content_hash(chunk)
+            if int(h, 16) in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(int(h, 16))
+            batch.append(sink.record(f"{doc_id}_{i}_{h[:8]}", doc_id, chunk))
+            if len(batch) >= batch_size:
+                flush_batch()
+    if batch:
+        flush_batch()
+    sink.flush()
+    _save_checkpoint(checkpoint, dict(ckpt, doc=pos[0], chunk=pos[1], written=ckpt["written"] + stats["written"], done=True))
+    sink.close()
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    return stats
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stream documents into the memory bank.")
+    ap.add_argument("source", help="directory of .txt/.md files, or a JSONL file of {doc_id, text}")
+    ap.add_argument("--target", choices=("local", "bq"), default="local")
+    ap.add_argument("--out", default=LOCAL_CHUNKS_PATH, help="local chunks JSONL (target=local)")
+    ap.add_argument("--project", default=os.environ.get("GOOGLE_CLOUD_PROJECT"), help="GCP project (target=bq)")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="chunks per embedding call")
+    ap.add_argument("--load-rows", type=int, default=LOAD_ROWS, help="rows per BigQuery load job")
+    ap.add_argument("--max-chars", type=int, default=MAX_CHARS)
+    ap.add_argument("--checkpoint", default=None, help="default: <out>.ingest.json, or telemetry/bq_ingest.json")
+    ap.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    ap.add_argument("--no-pagerank", action="store_true", help="skip the PageRank refresh (target=local)")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.target == "local":
+        sink = LocalSink(args.out, pagerank=not args.no_pagerank)
+        checkpoint = args.checkpoint or args.out + ".ingest.json"
+    else:
+        sink = BigQuerySink(args.project, args.load_rows)
+        checkpoint = args.checkpoint or os.path.join("telemetry", "bq_ingest.json")
+    os.makedirs(os.path.dirname(checkpoint) or ".", exist_ok=True)
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print(json.dumps(ingest(args.source, sink, args.batch_size, args.max_chars, checkpoint)))
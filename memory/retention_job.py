@@ -0,0 +1,247 @@
+# memory/retention_job.py
+"""
+Retention job: fold buffered usage into the chunks, decay retention scores, evict cold chunks.
+
+Usage:
+  python -m memory.retention_job [--target local|bq] [--half-life-days 14] [--evict-below 0.05]
+                                 [--max-chunks N] [--delete] [--dry-run]
+
+retention_score = 0.5 ** (age_days / half_life) * (1 - (1 - BOOST) ** (1 + usage_count))
+where age is the time since the chunk was last cited (or created, if never cited). A fresh,
+never-cited chunk scores 0.5 (the schema default), each citation moves it towards 1, and
+idle time halves it every half-life. The score is recomputed from scratch each run, so the
+job is idempotent and can run as often as wanted. Chunks without created_at (ingested before
+it was recorded) count as old as the oldest chunk that has one, or the oldest bank file.
+
+Chunks below --evict-below, plus the coldest ones beyond --max-chunks, are evicted:
+- local: removed from the chunks JSONL, the vector store and the ANN index (archived to
+  <chunks>.archive.jsonl unless --delete); PageRank is then recomputed on the smaller graph.
+  With NM_MEMORY_FORMAT=segments the segments present at the start are replaced by one
+  segment of the kept chunks; segments appended meanwhile are left alone
+- bq: moved to <table>_archive (or deleted) in one transaction
+Usage counts come from app/usage.py: <chunks>.usage.jsonl locally, already in the table on BigQuery.
+The local log is claimed by renaming it to <chunks>.usage.jsonl.<id>.processing; the rewritten bank
+names the claims it counted, so a claim left by a crash is either counted once or dropped as done.
+Lines appended to the local JSONL while the job runs are carried over, but run it while the ingest
+queue is idle: the rewrite swaps the file underneath any writer that is mid-append. A running
+server picks up the rewritten ANN index files on its next index access (see app/ann_index.py).
+"""
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
+import argparse, glob, json, logging, os, sys, time, uuid
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # add project root to sys.path
+
+import numpy as np
+
+from app import memory_bank
+from app.models import lazy_import
+from app.memory_bank import compact_vectors, bump_generation
+from app.memory_retrieve import EMBED_MODEL, LOCAL_CHUNKS_PATH, BQ_DATASET, BQ_TABLE, local_embed_many
+from app.ann_index import remove_chunks
+from app.pagerank_local import update_pagerank
+from app.scoring import top_k
+from app.usage import USAGE_SUFFIX, read_local_usage
+
+bigquery = lazy_import("google.cloud.bigquery")  # only imported by the bq target
+
+HALF_LIFE_DAYS = float(os.environ.get("NM_RETENTION_HALF_LIFE_DAYS", "14"))
+EVICT_BELOW = float(os.environ.get("NM_RETENTION_EVICT_BELOW", "0.05"))
+MAX_CHUNKS = int(os.environ.get("NM_RETENTION_MAX_CHUNKS", "0"))  # 0 = no cap
+BOOST = 0.5
+ARCHIVE_SUFFIX = ".archive.jsonl"
+CLAIM_SUFFIX = ".processing"
+CLAIMS_FIELD = "usage_claims"  # on the first kept row: the usage log claims folded into the counts
+
+def retention_scores(age_days, usage_count, half_life_days: float = HALF_LIFE_DAYS) -> np.ndarray:
+    age = np.maximum(np.asarray(age_days, dtype=np.float64), 0.0)
+    uses = np.asarray(usage_count, dtype=np.float64)
+    return 0.5 ** (age / half_life_days) * (1.0 - (1.0 - BOOST) ** (1.0 + uses))
+
+def select_evictions(scores: np.ndarray, evict_below: float, max_chunks: int = 0) -> np.ndarray:
+    """Boolean mask of chunks to evict: below the threshold, or outside the `max_chunks` hottest."""
+    evict = scores < evict_below
+    if max_chunks and len(scores) - int(evict.sum()) > max_chunks:
+        keep = np.zeros(len(scores), dtype=bool)
+        keep[top_k(np.where(evict, -np.inf, scores), max_chunks)] = True
+        evict = ~keep
+    return evict
+
+def _ts(value) -> Optional[float]:
+    if not value: return None
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+def _unstamped_created(rows: List[Dict], files: List[str]) -> float:
+    """created_at for rows written before ingest recorded it: they predate every stamped row,
+    so the oldest stamp bounds their age from below; with no stamp at all, the oldest bank file."""
+    stamped = [t for t in (_ts(r.get("created_at")) for r in rows) if t is not None]
+    return min(stamped) if stamped else min(os.path.getmtime(f) for f in files)
+
+# ---- Local bank ----
+def run_local(path: str = LOCAL_CHUNKS_PATH, half_life_days: float = HALF_LIFE_DAYS,
+              evict_below: float = EVICT_BELOW, max_chunks: int = MAX_CHUNKS,
+              archive: bool = True, dry_run: bool = False, now: Optional[float] = None) -> Dict:
+    now = time.time() if now is None else now
+    store = None
+    if memory_bank.FORMAT == "segments":
+        from app.segment_store import open_store
+        store = open_store(path, local_embed_many, EMBED_MODEL)
+    if not (store.exists() if store is not None else os.path.exists(path)):
+        return {"chunks": 0, "evicted": 0}
+    log = path + USAGE_SUFFIX
+    if not dry_run and os.path.exists(log):
+        os.replace(log, f"{log}.{uuid.uuid4().hex}{CLAIM_SUFFIX}")  # the server's next flush starts a fresh log
+    claims = sorted(glob.glob(glob.escape(log) + "*" + CLAIM_SUFFIX))  # with any left by a crashed run
+
+    rows: List[Dict] = []
+    if store is not None:
+        segments = store.segments()[1]
+        rows = [r for seg in segments for r in seg.rows()]
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+        size = len(data)
+        for line in data.splitlines():
+            try:
+                rows.append(json.loads(line))
+            except Exception:
+                continue
+    # a run that crashed after its rewrite but before deleting its claims already counted them
+    applied = {name for r in rows for name in (r.pop(CLAIMS_FIELD, None) or [])}
+    done = [c for c in claims if os.path.basename(c) in applied]
+    claims = [c for c in claims if c not in done]
+    usage = read_local_usage(claims + [log] if dry_run else claims)
+    unstamped = [r for r in rows if not r.get("created_at")]
+    if unstamped:
+        created = _iso(_unstamped_created(rows, [s.file_path for s in segments] if store is not None else [path]))
+        for r in unstamped: r["created_at"] = created
+    for r in rows:
+        uses, ts = usage.get(r.get("chunk_id"), (0, None))
+        r["usage_count"] = int(r.get("usage_count") or 0) + uses
+        last = max(filter(None, (_ts(r.get("last_used")), ts)), default=None)
+        if last is not None: r["last_used"] = _iso(last)
+    age_days = [(now - (_ts(r.get("last_used")) or _ts(r["created_at"]))) / 86400.0 for r in rows]
+    scores = retention_scores(age_days, [r["usage_count"] for r in rows], half_life_days)
+    evict = select_evictions(scores, evict_below, max_chunks)
+    for r, s in zip(rows, scores.tolist()):
+        r["retention_score"] = round(s, 6)
+    stats = {"chunks": len(rows), "evicted": int(evict.sum()), "cited": len(usage),
+             "kept": len(rows) - int(evict.sum()), "dry_run": dry_run}
+    if dry_run:
+        return stats
+
+    kept = [r for r, e in zip(rows, evict.tolist()) if not e]
+    gone = [r for r, e in zip(rows, evict.tolist()) if e]
+    if kept and done + claims:
+        kept[0][CLAIMS_FIELD] = [os.path.basename(c) for c in done + claims]
+    if archive and gone:
+        with open(path + ARCHIVE_SUFFIX, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(dict(r, archived_at=_iso(now)), ensure_ascii=False) + "\n" for r in gone))
+    if store is not None:
+        vecs = store.vectors_for(kept, local_embed_many)
+        if not store.replace([seg.name for seg in segments], kept, vecs):
+            raise RuntimeError(f"segments in {store.root} were compacted during the run; run the job again")
+    else:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in kept))
+            with open(path, "rb") as src:
+                src.seek(size)
+                tail = src.read()  # appended by an ingest while we were scoring: keep as-is
+            f.write(tail.decode("utf-8"))
+        os.replace(tmp, path)
+        bump_generation(path)
+    for claim in done + claims:  # the rewritten bank records them, so a crash before this is harmless
+        os.remove(claim)
+
+    if gone:
+        gone_ids = [r.get("chunk_id") for r in gone]
+        if store is None:
+            keep_ids = {r.get("chunk_id") for r in kept}
+            keep_ids.update(json.loads(l).get("chunk_id") for l in tail.decode("utf-8").splitlines() if l.strip())
+            compact_vectors(path, keep_ids, EMBED_MODEL)
+        remove_chunks(path, gone_ids)
+        update_pagerank(path)  # ids were removed, so this is a full recompute
+    return stats
+
+# ---- BigQuery ----
+# same formula as retention_scores(); a NULL created_at counts as the oldest one in the table
+SCORE_EXPR = """POW(0.5, TIMESTAMP_DIFF(CURRENT_TIMESTAMP(),
+           COALESCE(last_used, created_at, (SELECT MIN(created_at) FROM `{table}`), CURRENT_TIMESTAMP()), SECOND)
+           / 86400.0 / @half_life) * (1 - POW(1 - @boost, 1 + IFNULL(usage_count, 0)))"""
+
+SCORE_SQL = "UPDATE `{table}` SET retention_score = " + SCORE_EXPR + " WHERE TRUE"
+
+COLD_PREDICATE = """
+retention_score < @evict_below
+OR (@max_chunks > 0 AND chunk_id IN (
+  SELECT chunk_id FROM (
+    SELECT chunk_id, ROW_NUMBER() OVER (ORDER BY retention_score DESC) AS rn FROM {source}
+  ) WHERE rn > @max_chunks))
+"""
+
+# with --dry-run the scores are computed on the fly instead of written
+COUNT_SQL = """
+WITH scored AS (SELECT chunk_id, {score} AS retention_score FROM `{table}`)
+SELECT (SELECT COUNT(*) FROM scored) AS chunks,
+       (SELECT COUNT(*) FROM scored WHERE {cold}) AS evicted
+"""
+
+EVICT_SQL = """
+BEGIN TRANSACTION;
+{archive}
+DELETE FROM `{table}` WHERE {cold};
+COMMIT TRANSACTION;
+"""
+
+def run_bq(project: Optional[str] = None, half_life_days: float = HALF_LIFE_DAYS,
+           evict_below: float = EVICT_BELOW, max_chunks: int = MAX_CHUNKS,
+           archive: bool = True, dry_run: bool = False) -> Dict:
+    client = bigquery.Client(project=project) if project else bigquery.Client()
+    table = f"{client.project}.{BQ_DATASET}.{BQ_TABLE}"
+    score_params = [bigquery.ScalarQueryParameter("half_life", "FLOAT64", half_life_days),
+                    bigquery.ScalarQueryParameter("boost", "FLOAT64", BOOST)]
+    cold_params = [bigquery.ScalarQueryParameter("evict_below", "FLOAT64", evict_below),
+                   bigquery.ScalarQueryParameter("max_chunks", "INT64", max_chunks)]
+    if not dry_run:
+        client.query(SCORE_SQL.format(table=table),
+                     job_config=bigquery.QueryJobConfig(query_parameters=score_params)).result()
+    count_sql = COUNT_SQL.format(table=table, score=SCORE_EXPR.format(table=table) if dry_run else "retention_score",
+                                 cold=COLD_PREDICATE.format(source="scored"))
+    count_params = cold_params + (score_params if dry_run else [])
+    row = dict(next(iter(client.query(count_sql, job_config=bigquery.QueryJobConfig(query_parameters=count_params)).result())))
+    stats = {"chunks": int(row["chunks"]), "evicted": int(row["evicted"]), "dry_run": dry_run}
+    if dry_run or not stats["evicted"]:
+        return stats
+    cold = COLD_PREDICATE.format(source=f"`{table}`")
+    archive_sql = ""
+    if archive:
+        client.query(f"CREATE TABLE IF NOT EXISTS `{table}_archive` LIKE `{table}`").result()
+        archive_sql = f"INSERT INTO `{table}_archive` SELECT * FROM `{table}` WHERE {cold};"
+    client.query(EVICT_SQL.format(table=table, cold=cold, archive=archive_sql),
+                 job_config=bigquery.QueryJobConfig(query_parameters=cold_params)).result()
+    stats["kept"] = stats["chunks"] - stats["evicted"]
+    return stats
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Decay retention scores and evict cold chunks.")
+    ap.add_argument("--target", choices=("local", "bq"), default="bq" if os.environ.get("NM_USE_BQ", "1") == "1" else "local")
+    ap.add_argument("--path", default=LOCAL_CHUNKS_PATH, help="local chunks JSONL (target=local)")
+    ap.add_argument("--project", default=os.environ.get("GOOGLE_CLOUD_PROJECT"), help="GCP project (target=bq)")
+    ap.add_argument("--half-life-days", type=float, default=HALF_LIFE_DAYS)
+    ap.add_argument("--evict-below", type=float, default=EVICT_BELOW)
+    ap.add_argument("--max-chunks", type=int, default=MAX_CHUNKS, help="keep at most N hottest chunks (0 = no cap)")
+    ap.add_argument("--delete", action="store_true", help="drop evicted chunks instead of archiving them")
+    ap.add_argument("--dry-run", action="store_true", help="report what would be evicted, change nothing")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    common = dict(half_life_days=args.half_life_days, evict_below=args.evict_below,
+                  max_chunks=args.max_chunks, archive=not args.delete, dry_run=args.dry_run)
+    if args.target == "local":
+        stats = run_local(args.path, **common)
+    else:
+        stats = run_bq(args.project, **common)
+    print(json.dumps(stats))
@@ -0,0 +1,49 @@
+# tests/test_ann_index.py
+import numpy as np
+
+from app import ann_index
+from app.ann_index import IVFIndex, INDEX_SUFFIX, VECS_SUFFIX
+
+def _data(n=3000, dim=16, seed=0):
+    vecs = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return [f"c{i}" for i in range(n)], vecs
+
+def test_search_finds_the_query_vector():
+    ids, vecs = _data()
+    idx = IVFIndex(16, "float32")
+    idx.add(ids, vecs)
+    assert len(idx.centroids) > 1  # trained once past MIN_TRAIN
+    found, sims = idx.search(vecs[42], pool=5)
+    assert found[0] == "c42" and abs(float(sims[0]) - 1.0) < 1e-5
+
+def test_add_replaces_and_remove_drops():
+    ids, vecs = _data(50)
+    idx = IVFIndex(16, "float32")
+    idx.add(ids, vecs)
+    idx.add(["c0"], vecs[1:2])
+    assert len(idx) == 50
+    assert idx.search(vecs[1], pool=2)[0][:2] in (["c0", "c1"], ["c1", "c0"])
+    assert idx.remove(["c0", "nope"]) == 1
+    assert "c0" not in idx and len(idx) == 49
+
+def test_save_and_load_round_trip_from_the_vectors_file(tmp_path):
+    ids, vecs = _data(2000)
+    path = str(tmp_path / "c.jsonl")
+    idx = IVFIndex(16, "int8", path=path + VECS_SUFFIX)
+    idx.add(ids, vecs)
+    assert idx.dirty
+    idx.save(path + INDEX_SUFFIX)
+    assert not idx.dirty
+    back = IVFIndex.load(path + INDEX_SUFFIX, dtype="int8")
+    assert back.ids == idx.ids
+    assert np.allclose(back.vecs, idx.vecs)
+    assert back.search(vecs[7], pool=1)[0] == ["c7"]
+
+def test_add_chunks_defers_the_save(tmp_path):
+    ids, vecs = _data(100)
+    path = str(tmp_path / "c.jsonl")
+    ann_index.add_chunks(path, ids, vecs)
+    assert not (tmp_path / ("c.jsonl" + INDEX_SUFFIX)).exists()
+    assert ann_index.save_index(path)
+    assert not ann_index.save_index(path)  # nothing changed since
+    assert (tmp_path / ("c.jsonl" + INDEX_SUFFIX)).exists()
@@ -0,0 +1,34 @@
+# tests/test_answer_cache.py
+from app.answer_cache import AnswerCache
+
+def test_exact_hit_by_prompt_and_variant():
+    cache = AnswerCache(8)
+    cache.store("p", ["a"], {"answer": "x"})
+    assert cache.lookup("p", ["a"]) == ({"answer": "x"}, "exact")
+    assert cache.lookup("p", ["a"], variant="\x00greedy") == (None, None)
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_semantic_hit_needs_same_citations_and_close_query():
+    cache = AnswerCache(8, semantic=True, threshold=0.9)
+    cache.store("p1", ["a", "b"], {"answer": "x"}, q_vec=[1.0, 0.0])
+    assert cache.lookup("p2", ["b", "a"], q_vec=[1.0, 0.1]) == ({"answer": "x"}, "semantic")
+    assert cache.lookup("p2", ["a"], q_vec=[1.0, 0.1]) == (None, None)
+    assert cache.lookup("p2", ["a", "b"], q_vec=[0.0, 1.0]) == (None, None)
+
+def test_eviction_forgets_the_semantic_entry():
+    cache = AnswerCache(1, semantic=True, threshold=0.9)
+    cache.store("p1", ["a"], {"answer": "x"}, q_vec=[1.0, 0.0])
+    cache.store("p2", ["b"], {"answer": "y"}, q_vec=[1.0, 0.0])
+    assert cache.lookup("p3", ["a"], q_vec=[1.0, 0.0]) == (None, None)
+
+def test_hits_are_copies():
+    cache = AnswerCache(8)
+    cache.store("p", ["a"], {"answer": "x"})
+    cache.lookup("p", ["a"])[0]["answer"] = "changed"
+    assert cache.lookup("p", ["a"])[0]["answer"] == "x"
+
+def test_disabled_cache_stores_nothing():
+    cache = AnswerCache(0)
+    cache.store("p", ["a"], {"answer": "x"})
+    assert cache.lookup("p", ["a"]) == (None, None)
+    assert not cache.stats()["enabled"]
@@ -0,0 +1,50 @@
+# tests/test_bq_batch.py
+"""retrieve_batch on BigQuery against a fake client: one query job per batch, per-query jobs only on error."""
+import numpy as np
+import pytest
+
+from app import memory_retrieve as mr
+
+Q = np.random.default_rng(0).normal(size=(3, 8)).astype(np.float32)
+
+class FakeClient:
+    project = "proj"
+
+    def __init__(self, fail=False):
+        self.fail, self.sql = fail, []
+
+    def query(self, sql, job_config=None):
+        self.sql.append(sql)
+        if self.fail: raise RuntimeError("query rejected")
+        queries = job_config.query_parameters[0].values
+        rows = [{"qid": q.struct_values["qid"], "chunk_id": f"q{q.struct_values['qid']}_c{j}", "text": "t",
+                 "pagerank": 0.5, "cosine": 1.0 - j / 10} for q in queries for j in range(2)]
+        return type("Job", (), {"result": lambda self: rows})()
+
+@pytest.fixture
+def per_query(monkeypatch):
+    calls = []
+    monkeypatch.setattr(mr, "NM_USE_BQ", True)
+    monkeypatch.setattr(mr, "_retrieve_bq", lambda text, *a: calls.append(text) or ([], {"method": "single"}))
+    return calls
+
+@pytest.mark.parametrize("vector_type, sql, method", [
+    ("VECTOR", mr.VECTOR_BATCH_TOPK_SQL, "bq_vector_batch_sql"),
+    ("ARRAY", mr.ARRAY_BATCH_TOPK_SQL, "bq_array_batch_sql"),
+])
+def test_one_job_for_the_whole_batch(per_query, vector_type, sql, method):
+    client = FakeClient()
+    out = mr.retrieve_batch(["a", "b", "c"], k=2, q_vecs=Q, bq=(client, vector_type))
+    assert client.sql == [sql.format(table="proj.neuromem.chunks")]
+    assert per_query == []
+    for i, (chunks, meta) in enumerate(out):
+        assert meta["method"] == method
+        assert [c["chunk_id"] for c in chunks] == [f"q{i}_c0", f"q{i}_c1"]
+
+@pytest.mark.parametrize("vector_type", ["VECTOR", "ARRAY"])
+def test_failed_batch_falls_back_to_one_job_per_query(per_query, vector_type):
+    client = FakeClient(fail=True)
+    out = mr.retrieve_batch(["a", "b", "c"], k=2, q_vecs=Q, bq=(client, vector_type))
+    assert len(client.sql) == 1
+    assert per_query == ["a", "b", "c"]
+    assert [meta["method"] for _, meta in out] == ["single"] * 3
@@ -0,0 +1,82 @@
+# tests/test_bq_cache.py
+"""BigQuery client and schema caching in app/memory_retrieve.py, against a fake bigquery.Client."""
+import threading, types
+
+import pytest
+
+from app import memory_retrieve as mr
+from app.models import REGISTRY
+
+class FakeClient:
+    created = 0
+
+    def __init__(self, project=None):
+        FakeClient.created += 1
+        self.project = project or "proj"
+        self.lookups = 0
+
+    def get_table(self, table_id):
+        self.lookups += 1
+        field = types.SimpleNamespace(name="vector", field_type="FLOAT64", mode="REPEATED")
+        return types.SimpleNamespace(schema=[field])
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mr.bigquery, "Client", FakeClient)
+    monkeypatch.setattr(mr, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(FakeClient, "created", 0)
+    mr._bq_clients.clear(); mr._bq_schema.clear(); REGISTRY.reset("bigquery")
+    yield now
+    mr._bq_clients.clear(); mr._bq_schema.clear(); REGISTRY.reset("bigquery")
+
+def test_one_client_per_process(clock):
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(mr.prepare_bq()[0])) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert FakeClient.created == 1
+    assert all(c is seen[0] for c in seen)
+    assert REGISTRY.loaded("bigquery")
+
+def test_schema_looked_up_once_within_ttl(clock):
+    for _ in range(5):
+        client, vtype = mr.prepare_bq()
+    assert vtype == "ARRAY"
+    assert client.lookups == 1
+
+def test_schema_looked_up_again_after_ttl(clock):
+    client, _ = mr.prepare_bq()
+    clock[0] += mr.SCHEMA_TTL_S + 1
+    mr.prepare_bq()
+    assert client.lookups == 2
+    mr.prepare_bq()
+    assert client.lookups == 2
+
+def test_reset_bq_cache_forgets_schema_then_client(clock):
+    client, _ = mr.prepare_bq()
+    mr.reset_bq_cache()
+    assert mr.prepare_bq()[0] is client and client.lookups == 2
+    mr.reset_bq_cache(drop_client=True)
+    fresh, _ = mr.prepare_bq()
+    assert fresh is not client and FakeClient.created == 2 and fresh.lookups == 1
+
+def test_drop_client_invalidates_client_and_registry(clock):
+    client, _ = mr.prepare_bq()
+    mr._drop_client(client)
+    assert not REGISTRY.loaded("bigquery")
+    fresh, _ = mr.prepare_bq()
+    assert fresh is not client and fresh.lookups == 1
+
+def test_query_after_failed_preload_marks_ready(clock, monkeypatch):
+    calls = []
+    def flaky(project=None):
+        calls.append(project)
+        if len(calls) == 1: raise RuntimeError("no credentials yet")
+        return FakeClient(project)
+    monkeypatch.setattr(mr, "_get_client", flaky)
+    monkeypatch.setattr(REGISTRY, "wanted", ["bigquery"])
+    REGISTRY.preload(["bigquery"])
+    assert not REGISTRY.ready()
+    mr.prepare_bq()
+    assert REGISTRY.ready()
@@ -0,0 +1,19 @@
+# tests/test_emulate_bq_array_query.py
+"""The BigQuery ARRAY cosine queries, translated to SQLite, against the NumPy ranking."""
+import pytest
+
+from app import memory_retrieve as mr
+from tools import emulate_bq_array_query as emu
+
+def test_bigquery_queries_translate_to_sqlite():
+    for sql in (emu.SQLITE_ARRAY_TOPK_SQL, emu.SQLITE_ARRAY_BATCH_TOPK_SQL):
+        assert not any(token in sql for token in emu._BQ_ONLY)
+    assert "ROW_NUMBER() OVER (PARTITION BY qid ORDER BY cosine DESC) AS rn" in emu.SQLITE_ARRAY_BATCH_TOPK_SQL
+
+@pytest.mark.parametrize("pool", [1, 20])
+def test_emulated_queries_match_numpy(pool):
+    assert emu.check(emu.synthetic_rows(300, 32), pool=pool, batch=6)
+
+def test_unexpected_query_shape_is_reported():
+    with pytest.raises(ValueError, match="QUALIFY"):
+        emu.to_sqlite(mr.ARRAY_BATCH_TOPK_SQL.replace("<= @pool", "< @pool + 1"))
@@ -0,0 +1,79 @@
+# tests/test_inference.py
+"""pack_prompt against a small word-level tokenizer: no model weights are loaded."""
+import pytest
+
+from app import inference
+
+tokenizers = pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+def _toy_tokenizer():
+    # one token per word or punctuation run, so token counts are easy to reason about
+    vocab = {w: i for i, w in enumerate(["<pad>", "</s>", "<unk>"] + [f"w{i}" for i in range(1000)])}
+    tk = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    tk.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tk.post_processor = tokenizers.processors.TemplateProcessing(single="$A </s>", special_tokens=[("</s>", 1)])
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tk, pad_token="<pad>", eos_token="</s>",
+                                                unk_token="<unk>")
+
+@pytest.fixture
+def tok(monkeypatch):
+    tok = _toy_tokenizer()
+    monkeypatch.setattr(inference, "_tokenizer", tok)
+    inference._chunk_tokens.clear()
+    yield tok
+    inference._chunk_tokens.clear()
+
+def _chunk(cid, start, n, blend=None):
+    c = {"chunk_id": cid, "text": " ".join(f"w{i}" for i in range(start, start + n))}
+    if blend is not None: c["blend"] = blend
+    return c
+
+def _count(tok, segments):
+    return len(tok("".join(segments))["input_ids"])
+
+def _overhead(tok, query="q"):
+    return _count(tok, inference.pack_prompt(query, [])[0])
+
+def test_prompt_fits_the_token_budget(tok):
+    chunks = [_chunk(f"c{i}", 100 * i, 60) for i in range(5)]  # 5 x 63 tokens with the "[cN]" prefix
+    segments, report = inference.pack_prompt("q", chunks, max_input_tokens=200)
+    assert _count(tok, segments) == 200
+    assert report["tokens_used"] == 200 - _overhead(tok)
+    assert report["chunks_used"] + report["chunks_dropped"] == 5
+    assert report["chunks_cut"] == 1 and segments[-1] == inference._TRAILER
+    assert report["tokens_used"] + report["tokens_dropped"] == 5 * 63
+
+def test_chunks_are_packed_in_blend_order(tok):
+    chunks = [_chunk("low", 0, 10, 0.1), _chunk("high", 100, 10, 0.9), _chunk("mid", 200, 10, 0.5)]
+    segments, report = inference.pack_prompt("q", chunks)
+    assert report["chunk_ids"] == ["high", "mid", "low"]
+    assert [s.split("]")[0] for s in segments[1:-1]] == ["[high", "[mid", "[low"]
+    unscored = [_chunk("a", 0, 10), _chunk("b", 100, 10)]
+    assert inference.pack_prompt("q", unscored)[1]["chunk_ids"] == ["a", "b"]
+
+def test_near_duplicate_chunks_are_skipped(tok):
+    chunks = [_chunk("a", 0, 40, 0.9), _chunk("copy", 0, 40, 0.8), _chunk("overlap", 20, 40, 0.7),
+              _chunk("b", 500, 40, 0.6)]
+    report = inference.pack_prompt("q", chunks)[1]
+    assert report["duplicates"] == 1
+    assert report["chunk_ids"] == ["a", "overlap", "b"]  # half of overlap's 8-grams are new: kept
+
+def test_short_remainder_is_dropped_not_cut(tok, monkeypatch):
+    first = _chunk("a", 0, 80, 0.9)
+    budget = 130 - _overhead(tok)
+    for min_tokens, cut in ((budget - 83 + 1, False), (budget - 83, True)):
+        monkeypatch.setattr(inference, "PACK_MIN_TOKENS", min_tokens)
+        report = inference.pack_prompt("q", [first, _chunk("b", 100, 80, 0.5)], max_input_tokens=130)[1]
+        assert report["chunk_ids"] == (["a", "b"] if cut else ["a"])
+        assert report["chunks_cut"] == int(cut) and report["chunks_dropped"] == int(not cut)
+
+def test_report_lists_the_chunks_in_the_prompt(tok):
+    chunks = [_chunk("x", 0, 10, 0.2), _chunk("y", 100, 10, 0.8), _chunk("dup", 100, 10, 0.7),
+              _chunk("z", 200, 10, 0.1)]
+    segments, report = inference.pack_prompt("q", chunks, max_chunks=2)
+    assert report["chunk_ids"] == ["y", "x"]
+    assert report["chunks"] == 4 and report["chunks_used"] == 2
+    assert report["duplicates"] == 1 and report["chunks_dropped"] == 1
+    assert all(f"[{cid}] " in "".join(segments) for cid in report["chunk_ids"])
+    assert "[z]" not in "".join(segments)
@@ -0,0 +1,69 @@
+# tests/test_ingest.py
+"""memory/ingest.py into a local bank: resuming after a crash, and content-hash dedup across runs."""
+import os, subprocess, sys
+
+import numpy as np
+import pytest
+
+from app import memory_bank
+from memory import ingest
+
+def _embed(texts):
+    return np.array([np.random.default_rng(int(memory_bank.content_hash(t), 16)).normal(size=8) for t in texts],
+                    dtype=np.float32)
+
+def _docs(root, docs):
+    root.mkdir(exist_ok=True)
+    for name, paragraphs in docs.items():
+        (root / f"{name}.txt").write_text("\n\n".join(paragraphs), encoding="utf-8")
+    return str(root)
+
+DOCS = {f"doc{d}": [f"paragraph {p} of document {d}" for p in range(3)] for d in range(4)}
+
+class Crashing(ingest.LocalSink):
+    """Dies right after its n-th batch is written, before the checkpoint records it."""
+
+    def __init__(self, path, n):
+        super().__init__(path, pagerank=False)
+        self.n = n
+
+    def write(self, records, vecs):
+        super().write(records, vecs)
+        self.n -= 1
+        if self.n == 0: raise RuntimeError("killed")
+        return True
+
+def _texts(path):
+    return [r["text"] for r in memory_bank.read_rows(path)]
+
+def test_resume_after_a_crash_writes_every_chunk_once(tmp_path):
+    source, out = _docs(tmp_path / "src", DOCS), str(tmp_path / "c.jsonl")
+    ckpt = out + ".ingest.json"
+    with pytest.raises(RuntimeError):
+        ingest.ingest(source, Crashing(out, 3), batch_size=2, checkpoint=ckpt, embed_many=_embed)
+    assert len(_texts(out)) == 6
+    stats = ingest.ingest(source, ingest.LocalSink(out, pagerank=False), batch_size=2, checkpoint=ckpt,
+                          embed_many=_embed)
+    assert stats["resumed_at"] == [1, 1]  # the last batch the checkpoint covers ended at doc1, chunk 1
+    assert stats["duplicates"] == 2  # the batch written just before the crash
+    texts = _texts(out)
+    assert sorted(texts) == sorted(p for ps in DOCS.values() for p in ps)
+    done = ingest.ingest(source, ingest.LocalSink(out, pagerank=False), checkpoint=ckpt, embed_many=_embed)
+    assert done["written"] == 0 and _texts(out) == texts
+
+def test_hashes_dedupe_within_and_across_runs(tmp_path):
+    out = str(tmp_path / "c.jsonl")
+    first = _docs(tmp_path / "a", {"x": ["shared text", "only in x", "shared text"]})
+    stats = ingest.ingest(first, ingest.LocalSink(out, pagerank=False), embed_many=_embed)
+    assert (stats["written"], stats["duplicates"]) == (2, 1)
+    second = _docs(tmp_path / "b", {"y": ["shared text", "only in y"], "z": ["only in x"]})
+    stats = ingest.ingest(second, ingest.LocalSink(out, pagerank=False), embed_many=_embed)
+    assert (stats["written"], stats["duplicates"]) == (1, 2)
+    assert sorted(_texts(out)) == ["only in x", "only in y", "shared text"]
+
+def test_local_jobs_import_without_bigquery():
+    # a None entry in sys.modules makes `import google.cloud.bigquery` fail, as if it were not installed
+    code = ("import sys; sys.modules['google.cloud.bigquery'] = None\n"
+            "import memory.ingest, memory.retention_job, app.memory_retrieve")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], cwd=root, check=True)
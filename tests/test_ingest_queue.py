@@ -0,0 +1,62 @@
+# tests/test_ingest_queue.py
+import os, time
+
+import numpy as np
+import pytest
+
+from app import ann_index, ingest_queue, memory_bank
+
+def _embed(texts):
+    return np.array([[len(t), 1.0, 0.5, 0.25] for t in texts], dtype=np.float32)
+
+def _wait(q, job_id, state="done", timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = q.status(job_id)
+        if job["state"] == state: return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {q.status(job_id)['state']}")
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(ingest_queue, "local_embed_many", _embed)
+    monkeypatch.setattr(ingest_queue, "update_pagerank", refreshed.append)
+    monkeypatch.setattr(ingest_queue, "PR_DEBOUNCE_S", 0.05)
+    q = ingest_queue.IngestQueue(str(tmp_path / "c.jsonl"))
+    q.refreshed = refreshed
+    return q
+
+def _records(*ids):
+    return [{"chunk_id": cid, "doc_id": "d", "text": f"text of {cid}", "pagerank": 0.0} for cid in ids]
+
+def test_jobs_are_written_then_pagerank_refreshed_once(queue):
+    first = queue.submit(_records("a", "b"))
+    second = queue.submit(_records("c"))
+    assert _wait(queue, first)["chunk_ids"] == ["a", "b"]
+    _wait(queue, second)
+    assert [r["chunk_id"] for r in memory_bank.read_rows(queue.path)] == ["a", "b", "c"]
+    assert "c" in ann_index.get_index(queue.path, 4)
+    deadline = time.monotonic() + 5.0
+    while not queue.refreshed and time.monotonic() < deadline: time.sleep(0.01)
+    time.sleep(0.1)
+    assert queue.refreshed == [queue.path]
+    assert not queue.status(first)["pagerank_pending"]
+
+def test_no_ann_index_when_ann_is_off(queue, monkeypatch):
+    monkeypatch.setattr(ingest_queue, "NM_USE_ANN", False)
+    _wait(queue, queue.submit(_records("a")))
+    time.sleep(0.15)  # past the debounced refresh, which saves the index when there is one
+    assert queue.path not in ann_index._INDEXES
+    assert not os.path.exists(queue.path + ann_index.INDEX_SUFFIX)
+    assert [r["chunk_id"] for r in memory_bank.read_rows(queue.path)] == ["a"]
+
+def test_failed_batch_reports_the_error(queue, monkeypatch):
+    def broken(texts): raise RuntimeError("embedder down")
+    monkeypatch.setattr(ingest_queue, "local_embed_many", broken)
+    job = _wait(queue, queue.submit(_records("a")), state="failed")
+    assert "embedder down" in job["error"]
+    assert memory_bank.read_rows(queue.path) == []
+
+def test_unknown_job_is_none(queue):
+    assert queue.status("missing") is None
@@ -0,0 +1,129 @@
+# tests/test_pagerank_local.py
+import numpy as np
+import pytest
+
+from app import memory_bank, pagerank_local
+
+DIM = 8
+# three loose clusters, so the similarity graph has edges and some dangling nodes
+_rng = np.random.default_rng(0)
+VECS = (np.repeat(_rng.normal(size=(3, DIM)), 20, axis=0)[np.random.default_rng(1).permutation(60)]
+        + 0.6 * _rng.normal(size=(60, DIM))).astype(np.float32)
+
+def _embed(texts):
+    return np.array([VECS[int(t.split()[-1])] for t in texts], dtype=np.float32)
+
+def _append(path, ids):
+    records = [{"chunk_id": f"c{i}", "doc_id": "d", "text": f"text {i}", "pagerank": 0.0} for i in ids]
+    memory_bank.append_records(path, records, VECS[list(ids)], _embed, pagerank_local.EMBED_MODEL)
+
+@pytest.fixture
+def bank(tmp_path, monkeypatch):
+    monkeypatch.setattr(pagerank_local, "local_embed_many", _embed)
+    return str(tmp_path / "c.jsonl")
+
+@pytest.mark.parametrize("job", ["recompute_pagerank", "update_pagerank"])
+def test_rows_appended_during_a_run_are_kept(bank, monkeypatch, job):
+    _append(bank, range(10))
+    if job == "update_pagerank":
+        pagerank_local.recompute_pagerank(bank)
+        _append(bank, range(10, 15))
+    pagerank = pagerank_local._pagerank
+    def appending(*args, **kwargs):
+        _append(bank, [40, 41])  # an ingest lands while PageRank is being computed
+        return pagerank(*args, **kwargs)
+    monkeypatch.setattr(pagerank_local, "_pagerank", appending)
+    n = getattr(pagerank_local, job)(bank)
+    rows = memory_bank.read_rows(bank)
+    assert [r["chunk_id"] for r in rows][n:] == ["c40", "c41"]
+    assert max(r["pagerank"] for r in rows[:n]) == 1.0
+    monkeypatch.setattr(pagerank_local, "_pagerank", pagerank)
+    assert pagerank_local.update_pagerank(bank) == n + 2
+    assert [r["chunk_id"] for r in memory_bank.read_rows(bank)][n:] == ["c40", "c41"]
+
+def _dense_pagerank(w, damping=pagerank_local.DAMPING):
+    n = len(w)
+    out = w.sum(axis=1, keepdims=True)
+    p = np.where(out > 0, w / np.where(out > 0, out, 1.0), 1.0 / n)  # dangling rows spread uniformly
+    return np.linalg.solve(np.eye(n) - damping * p.T, np.full(n, (1 - damping) / n))
+
+def _dense(graph):
+    w = np.zeros((len(graph.ids), len(graph.ids)))
+    src = np.repeat(np.arange(len(graph.ids)), np.diff(graph.indptr))
+    w[src, graph.indices] = graph.weights
+    return w
+
+def test_similarity_edges_match_the_dense_threshold():
+    mat = pagerank_local.normalize_rows(VECS)
+    src, dst, w = pagerank_local._similarity_edges(mat, mat, 0.38, block=7)
+    sims = mat @ mat.T
+    np.fill_diagonal(sims, -np.inf)
+    want = np.argwhere(sims >= 0.38)
+    got = np.stack([src, dst], axis=1)
+    assert sorted(map(tuple, got.tolist())) == sorted(map(tuple, want.tolist()))
+    assert np.allclose(w, sims[src, dst], atol=1e-6)
+
+def test_build_graph_is_csr_of_the_similarity_edges(bank):
+    _append(bank, range(30))
+    rows = memory_bank.read_rows(bank)
+    graph = pagerank_local._build_graph(rows, bank)
+    mat = pagerank_local.normalize_rows(VECS[:30])
+    sims = mat @ mat.T
+    np.fill_diagonal(sims, 0.0)
+    assert graph.ids == [f"c{i}" for i in range(30)]
+    assert np.allclose(_dense(graph), np.where(sims >= pagerank_local.SIM_THRESHOLD, sims, 0.0), atol=1e-6)
+    for i in range(30):  # each row's targets are sorted
+        row = graph.indices[graph.indptr[i]:graph.indptr[i + 1]]
+        assert (np.diff(row) > 0).all()
+
+def test_power_iteration_matches_a_dense_reference():
+    ids = [f"n{i}" for i in range(6)]
+    # n4 and n5 have no out-edges: their mass must be spread, not lost
+    src, dst = np.array([0, 0, 1, 2, 3, 3, 0]), np.array([1, 2, 2, 0, 4, 0, 3])
+    w = np.array([0.9, 0.5, 0.7, 0.4, 0.8, 0.6, 0.3])
+    graph = pagerank_local._to_csr(ids, src, dst, w)
+    pr, stats = pagerank_local._pagerank(graph, tol=1e-12, max_iter=1000)
+    assert stats["converged"] and stats["edges"] == 7
+    assert abs(pr.sum() - 1.0) < 1e-9
+    assert np.allclose(pr, _dense_pagerank(_dense(graph)), atol=1e-9)
+
+def test_warm_start_converges_in_fewer_iterations(bank):
+    _append(bank, range(60))
+    graph = pagerank_local._build_graph(memory_bank.read_rows(bank), bank)
+    cold, cold_stats = pagerank_local._pagerank(graph)
+    warm, warm_stats = pagerank_local._pagerank(graph, start=cold)
+    assert cold_stats["converged"] and warm_stats["iterations"] < cold_stats["iterations"]
+    assert np.allclose(warm, _dense_pagerank(_dense(graph)), atol=1e-5)
+
+def test_incremental_graph_equals_a_full_rebuild(bank, monkeypatch):
+    monkeypatch.setattr(pagerank_local, "INCR_ITERS", 1000)
+    _append(bank, range(40))
+    pagerank_local.recompute_pagerank(bank)
+    _append(bank, range(40, 60))
+    assert pagerank_local.update_pagerank(bank) == 60
+    incr, incr_pr = pagerank_local._load_state(bank)
+    incr_rows = {r["chunk_id"]: r["pagerank"] for r in memory_bank.read_rows(bank)}
+    pagerank_local.recompute_pagerank(bank, warm_start=False)
+    full, full_pr = pagerank_local._load_state(bank)
+    assert incr.ids == full.ids
+    assert np.array_equal(incr.indptr, full.indptr) and np.array_equal(incr.indices, full.indices)
+    assert np.allclose(incr.weights, full.weights, atol=1e-6)
+    assert np.allclose(incr_pr, full_pr, atol=1e-5)
+    full_rows = {r["chunk_id"]: r["pagerank"] for r in memory_bank.read_rows(bank)}
+    assert all(abs(incr_rows[c] - full_rows[c]) < 1e-3 for c in full_rows)
+
+def test_removed_chunks_fall_back_to_a_full_recompute(bank, monkeypatch):
+    _append(bank, range(20))
+    pagerank_local.recompute_pagerank(bank)
+    with open(bank, encoding="utf-8") as f:
+        lines = [l for l in f if '"c3"' not in l]
+    with open(bank, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    _append(bank, [20])
+    calls = []
+    recompute = pagerank_local.recompute_pagerank
+    monkeypatch.setattr(pagerank_local, "recompute_pagerank", lambda p: calls.append(p) or recompute(p))
+    assert pagerank_local.update_pagerank(bank) == 20
+    assert calls == [bank]
+    graph, _ = pagerank_local._load_state(bank)
+    assert "c3" not in graph.ids and graph.ids[-1] == "c20"
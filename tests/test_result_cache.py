@@ -0,0 +1,60 @@
+# tests/test_result_cache.py
+"""retrieve_with_alpha's result cache on the local bank: writes must invalidate it through memory_version()."""
+import numpy as np
+import pytest
+
+from app import ingest_queue, memory_retrieve as mr, pagerank_local
+from app.models import REGISTRY
+
+DIM = 8
+VECS = np.random.default_rng(0).normal(size=(40, DIM)).astype(np.float32)
+
+def _embed(texts):
+    return np.array([VECS[int(t.split()[-1])] for t in texts], dtype=np.float32)
+
+def _write(path, ids):
+    records = [{"chunk_id": f"c{i}", "doc_id": "d", "text": f"text {i}", "pagerank": 0.0} for i in ids]
+    ingest_queue.write_records(path, records, VECS[list(ids)])
+
+@pytest.fixture
+def bank(tmp_path, monkeypatch):
+    path = str(tmp_path / "c.jsonl")
+    for mod in (mr, ingest_queue, pagerank_local):
+        monkeypatch.setattr(mod, "local_embed_many", _embed)
+    monkeypatch.setattr(mr, "NM_USE_BQ", False)
+    monkeypatch.setattr(mr, "NM_USE_ANN", False)
+    monkeypatch.setattr(ingest_queue, "NM_USE_ANN", False)
+    monkeypatch.setattr(mr, "LOCAL_CHUNKS_PATH", path)
+    REGISTRY.reset("bank"); mr._result_cache.clear()
+    _write(path, range(20))
+    yield path
+    REGISTRY.reset("bank"); mr._result_cache.clear()
+
+def _search(q):
+    misses = mr._result_cache.misses
+    chunks, _ = mr.retrieve_with_alpha("q", alpha=0.5, k=3, q_vec=q.tolist())
+    return [c["chunk_id"] for c in chunks], mr._result_cache.misses > misses
+
+def test_repeated_query_is_served_from_the_cache(bank):
+    before = mr.memory_version()
+    first, missed = _search(VECS[5])
+    assert missed and first[0] == "c5"
+    assert _search(VECS[5]) == (first, False)
+    assert mr.memory_version() == before
+
+def test_append_invalidates_cached_results(bank):
+    _search(VECS[25])
+    before = mr.memory_version()
+    _write(bank, range(20, 30))
+    assert mr.memory_version() != before
+    found, missed = _search(VECS[25])
+    assert missed and found[0] == "c25"
+
+def test_pagerank_rewrite_invalidates_cached_results(bank):
+    _search(VECS[5])
+    before = mr.memory_version()
+    pagerank_local.recompute_pagerank(bank)
+    assert mr.memory_version() != before
+    assert _search(VECS[5])[1]
+    chunks, _ = mr.retrieve_with_alpha("q", alpha=0.5, k=3, q_vec=VECS[5].tolist())
+    assert max(c["pagerank"] for c in chunks) > 0.0  # the new PageRank, not the cached zeros
@@ -0,0 +1,72 @@
+# tests/test_retention_job.py
+import glob, time
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from app import ann_index, memory_bank, usage
+from app.ingest_queue import write_records
+from memory import retention_job
+
+DIM = 8
+VECS = np.random.default_rng(0).normal(size=(60, DIM)).astype(np.float32)
+
+def _iso(days_ago: float) -> str:
+    return datetime.fromtimestamp(time.time() - days_ago * 86400, timezone.utc).isoformat()
+
+def _write(path, ids, days_ago=0.0):
+    records = [{"chunk_id": f"c{i}", "doc_id": "d", "text": f"text {i}", "pagerank": 0.0,
+                "created_at": _iso(days_ago)} for i in ids]
+    write_records(path, records, VECS[list(ids)])
+
+def test_retention_in_another_process_then_ingest_keeps_the_cached_index_consistent(tmp_path, monkeypatch):
+    path = str(tmp_path / "c.jsonl")
+    monkeypatch.setattr(retention_job, "update_pagerank", lambda p: 0)
+    _write(path, range(0, 20), days_ago=400)
+    _write(path, range(20, 40))
+    ann_index.save_index(path)
+    assert len(ann_index.get_index(path, DIM)) == 40  # the server's cached index
+
+    # the retention job runs in its own process: it has no cached index and rewrites the files
+    server_cache, server_stamps = ann_index._INDEXES, ann_index._STAMPS
+    monkeypatch.setattr(ann_index, "_INDEXES", {})
+    monkeypatch.setattr(ann_index, "_STAMPS", {})
+    stats = retention_job.run_local(path, max_chunks=20)
+    assert stats["evicted"] == 20
+    monkeypatch.setattr(ann_index, "_INDEXES", server_cache)
+    monkeypatch.setattr(ann_index, "_STAMPS", server_stamps)
+
+    _write(path, range(40, 60))  # the server's next ingest
+    ann_index.save_index(path)
+    for idx in (ann_index.get_index(path, DIM), ann_index.IVFIndex.load(path + ann_index.INDEX_SUFFIX)):
+        assert len(idx) == 40
+        for i in (20, 30, 45, 59):
+            assert idx.search(VECS[i], pool=1)[0] == [f"c{i}"]
+        assert "c10" not in idx
+
+def _usage_counts(path):
+    return {r["chunk_id"]: r["usage_count"] for r in memory_bank.read_rows(path)}
+
+@pytest.mark.parametrize("cited_meanwhile", [False, True])
+@pytest.mark.parametrize("crash_in", ["retention_scores", "bump_generation"])  # before / after the rewrite
+def test_usage_claimed_by_a_crashed_run_is_counted_once(tmp_path, monkeypatch, crash_in, cited_meanwhile):
+    path = str(tmp_path / "c.jsonl")
+    monkeypatch.setattr(retention_job, "update_pagerank", lambda p: 0)
+    _write(path, range(10))
+    sink = usage.local_sink(path)
+    sink({"c1": (2, time.time()), "c2": (1, time.time())})
+    real = getattr(retention_job, crash_in)
+    def crash(*args, **kwargs): raise RuntimeError("killed")
+    monkeypatch.setattr(retention_job, crash_in, crash)
+    with pytest.raises(RuntimeError):
+        retention_job.run_local(path)
+    monkeypatch.setattr(retention_job, crash_in, real)
+    if cited_meanwhile:
+        sink({"c1": (1, time.time())})  # a fresh log next to the crashed run's claim
+    retention_job.run_local(path)
+    counts = _usage_counts(path)
+    assert (counts["c1"], counts["c2"], counts["c3"]) == (2 + cited_meanwhile, 1, 0)
+    assert not glob.glob(path + usage.USAGE_SUFFIX + "*")
+    retention_job.run_local(path)
+    assert _usage_counts(path) == counts
@@ -0,0 +1,50 @@
+# tests/test_scoring.py
+import numpy as np
+
+from app.scoring import ScoringMatrix, normalize_rows, quantize_rows, dequantize, rank, top_k
+
+def _brute(vecs, pagerank, q, alpha, k):
+    cos = normalize_rows(vecs) @ normalize_rows(q)[0]
+    pr = (pagerank - pagerank.min()) / ((pagerank.max() - pagerank.min()) or 1.0)
+    return np.argsort(-(alpha * cos + (1 - alpha) * pr), kind="stable")[:k]
+
+def test_top_k_is_sorted_best_first():
+    scores = np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+    assert top_k(scores, 3).tolist() == [1, 3, 2]
+    assert top_k(scores, 10).tolist() == [1, 3, 2, 0]
+    assert top_k(scores, 0).tolist() == []
+
+def test_rank_blends_pagerank():
+    idx, blend = rank([0.5, 0.5], [0.0, 1.0], alpha=0.5, k=1)
+    assert idx.tolist() == [1]
+    assert blend.tolist() == [0.25, 0.75]
+
+def test_matrix_rank_matches_brute_force():
+    rng = np.random.default_rng(0)
+    vecs, pr, q = rng.normal(size=(500, 16)), rng.random(500), rng.normal(size=16)
+    idx, _, _ = ScoringMatrix(vecs, pr).rank(q, alpha=0.7, k=10)
+    assert idx.tolist() == _brute(vecs, pr, q, 0.7, 10).tolist()
+
+def test_int8_round_trip_is_close():
+    unit = normalize_rows(np.random.default_rng(1).normal(size=(64, 32)))
+    raw, scales = quantize_rows(unit, "int8")
+    assert raw.dtype == np.int8
+    assert np.abs(dequantize(raw, scales) - unit).max() < 0.01
+
+def test_quantized_blocks_are_rescored_exactly():
+    rng = np.random.default_rng(2)
+    vecs, pr, q = rng.normal(size=(2000, 16)), rng.random(2000), rng.normal(size=16)
+    unit = normalize_rows(vecs)
+    raw, scales = quantize_rows(unit, "int8")
+    m = ScoringMatrix.from_blocks([raw], pr, [scales], exact=lambda idx: unit[idx])
+    assert m.quantized
+    idx, cosine, _ = m.rank(q, alpha=0.7, k=10, pool=100)
+    assert idx.tolist() == _brute(vecs, pr, q, 0.7, 10).tolist()
+    assert np.allclose(cosine[idx], unit[idx] @ normalize_rows(q)[0], atol=1e-6)
+
+def test_rank_many_matches_rank():
+    rng = np.random.default_rng(3)
+    m = ScoringMatrix(rng.normal(size=(300, 8)), rng.random(300))
+    qs = rng.normal(size=(5, 8))
+    for q, (idx, _, _) in zip(qs, m.rank_many(qs, alpha=0.6, k=5, block=2)):
+        assert idx.tolist() == m.rank(q, alpha=0.6, k=5)[0].tolist()
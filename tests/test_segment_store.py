@@ -0,0 +1,44 @@
+# tests/test_segment_store.py
+import numpy as np
+
+from app.segment_store import SegmentStore
+
+def _append(store, i, pagerank=0.1):
+    store.append([{"chunk_id": f"c{i}", "doc_id": "d", "text": f"t{i}", "pagerank": pagerank}],
+                 np.full((1, 4), i + 1, dtype=np.float32))
+
+def test_append_and_read_back(tmp_path):
+    store = SegmentStore(str(tmp_path / "c.jsonl"))
+    for i in range(3): _append(store, i)
+    version, segs = store.segments()
+    assert version == 3 and [len(s) for s in segs] == [1, 1, 1]
+    assert [r["chunk_id"] for r in store.rows()] == ["c0", "c1", "c2"]
+
+def test_set_pagerank_keeps_missing_values(tmp_path):
+    store = SegmentStore(str(tmp_path / "c.jsonl"))
+    for i in range(2): _append(store, i, pagerank=0.25)
+    store.set_pagerank({"c1": 0.5})
+    assert [r["pagerank"] for r in store.rows()] == [0.25, 0.5]
+
+def test_compact_merges_and_keeps_the_latest_duplicate(tmp_path):
+    store = SegmentStore(str(tmp_path / "c.jsonl"))
+    for i in range(3): _append(store, i)
+    store.append([{"chunk_id": "c1", "text": "edited", "pagerank": 0.1}], np.ones((1, 4), dtype=np.float32))
+    assert store.compact(force=True) == 4
+    _, segs = store.segments()
+    assert len(segs) == 1
+    assert [(r["chunk_id"], r["text"]) for r in store.rows()] == [("c0", "t0"), ("c2", "t2"), ("c1", "edited")]
+
+def test_compact_refuses_when_pagerank_changed_meanwhile(tmp_path, monkeypatch):
+    store = SegmentStore(str(tmp_path / "c.jsonl"))
+    for i in range(3): _append(store, i)
+    replace = store.replace
+    def racing(*args, **kwargs):
+        store.set_pagerank({"c0": 0.9})  # lands between reading the run and swapping it
+        return replace(*args, **kwargs)
+    monkeypatch.setattr(store, "replace", racing)
+    assert store.compact(force=True) == 0
+    monkeypatch.undo()
+    assert abs(next(store.rows())["pagerank"] - 0.9) < 1e-6
+    assert store.compact(force=True) == 3
+    assert abs(next(store.rows())["pagerank"] - 0.9) < 1e-6
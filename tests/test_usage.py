@@ -0,0 +1,42 @@
+# tests/test_usage.py
+import time, types
+
+from app import usage
+
+def _clock(monkeypatch, now):
+    monkeypatch.setattr(usage, "time", types.SimpleNamespace(time=lambda: now, sleep=time.sleep))
+
+def test_record_aggregates_until_flush(monkeypatch):
+    batches = []
+    buf = usage.UsageBuffer(batches.append, flush_s=3600)
+    _clock(monkeypatch, 100.0)
+    buf.record(["a", "b", None])
+    _clock(monkeypatch, 200.0)
+    buf.record(["a"])
+    assert batches == []
+    assert buf.flush() == 2
+    assert batches == [{"a": (2, 200.0), "b": (1, 100.0)}]
+    assert buf.flush() == 0 and buf.stats()["flushed"] == 2
+
+def test_failed_flush_keeps_the_counts():
+    calls = []
+    def sink(batch):
+        calls.append(dict(batch))
+        if len(calls) == 1: raise OSError("down")
+    buf = usage.UsageBuffer(sink, flush_s=3600)
+    buf.record(["a"])
+    assert buf.flush() == 0
+    buf.record(["a"])
+    assert buf.flush() == 1
+    assert calls[-1]["a"][0] == 2
+    assert buf.stats()["failures"] == 1
+
+def test_local_sink_round_trip(tmp_path):
+    path = str(tmp_path / "c.jsonl")
+    sink = usage.local_sink(path)
+    sink({"a": (2, 10.0)})
+    sink({"a": (1, 30.0), "b": (1, 20.0)})
+    with open(path + usage.USAGE_SUFFIX, "a", encoding="utf-8") as f:
+        f.write('{"chunk_id": "b", "us')  # torn line from an interrupted flush
+    assert usage.read_local_usage([path + usage.USAGE_SUFFIX, str(tmp_path / "missing")]) == {
+        "a": (3, 30.0), "b": (1, 20.0)}
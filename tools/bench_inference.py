@@ -0,0 +1,91 @@
+# tools/bench_inference.py
+"""
+Latency / agreement benchmark for the T5 CPU backends in app/inference.py (NM_T5_BACKEND).
+- prompts: built with build_prompt() from random groups of --k chunks of the local bank (--path),
+  or from synthetic sentences when the bank is empty
+- every backend x decoding pair answers the same prompts one at a time (batch size 1, like /predict)
+- agreement is measured against the first backend x decoding that loads (default torch, beam):
+  exact-match rate and mean difflib similarity of the answers
+- the encoder-output cache (NM_ENCODER_CACHE) is off for every run, so no cell reuses another's work
+Usage: python tools/bench_inference.py [--backends torch,int8,onnx] [--decodings beam,greedy]
+                                       [--prompts 20] [--threads N] [--max-new-tokens 128]
+"""
+import os, sys, time, random, difflib, argparse
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # add project root to sys.path
+
+import numpy as np
+from app import inference
+
+def make_prompts(path: str, n: int, k: int, seed: int = 0):
+    from app.memory_bank import read_rows
+    rng = random.Random(seed)
+    rows = read_rows(path)
+    if not rows:
+        words = "memory graph retrieval answer context model cache query vector score".split()
+        rows = [{"chunk_id": f"syn_{i}", "text": " ".join(rng.choice(words) for _ in range(80))} for i in range(50)]
+    prompts = []
+    for _ in range(n):
+        chunks = rng.sample(rows, min(k, len(rows)))
+        question = (chunks[0].get("text") or "").split(".")[0][:120] + "?"
+        prompts.append(inference.build_prompt(question, chunks))
+    return prompts
+
+def run(backend: str, decoding: str, prompts, max_new_tokens: int):
+    beams = inference.decoding_beams(decoding)
+    inference._generate_batch(prompts[:1], 512, max_new_tokens, beams)  # warmup
+    answers, lat, tokens = [], [], []
+    for p in prompts:
+        t0 = time.perf_counter()
+        out = inference._generate_batch([p], 512, max_new_tokens, beams)[0]
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        answers.append(out["answer"]); tokens.append(out["token_out"])
+    return answers, {"backend": backend, "decoding": decoding,
+                     "p50_ms": round(float(np.percentile(lat, 50)), 1),
+                     "p95_ms": round(float(np.percentile(lat, 95)), 1),
+                     "mean_tokens_out": round(float(np.mean(tokens)), 1)}
+
+def agreement(answers, reference):
+    exact = np.mean([a.strip() == r.strip() for a, r in zip(answers, reference)])
+    sim = np.mean([difflib.SequenceMatcher(None, a, r).ratio() for a, r in zip(answers, reference)])
+    return round(float(exact), 3), round(float(sim), 3)
+
+def bench(backends, decodings, prompts, max_new_tokens: int, load=inference._load_t5):
+    results, reference = [], None
+    inference.ENCODER_CACHE_MODE = "off"
+    for backend in backends:
+        t0 = time.perf_counter()
+        try:
+            inference._tokenizer, inference._model, inference._device = load(backend)
+        except Exception as e:
+            print(f"{backend}: skipped ({e})")
+            continue
+        load_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        for decoding in decodings:
+            inference.ENCODER_CACHE.clear()
+            answers, row = run(backend, decoding, prompts, max_new_tokens)
+            if reference is None:
+                reference = answers
+            row["load_ms"] = load_ms
+            row["exact_match"], row["similarity"] = agreement(answers, reference)
+            results.append(row)
+    return results
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="torch,int8,onnx", help="the first one that loads is the reference (with the first decoding)")
+    ap.add_argument("--decodings", default="beam,greedy")
+    ap.add_argument("--path", default=os.environ.get("NM_LOCAL_CHUNKS", "telemetry/local_chunks.jsonl"))
+    ap.add_argument("--prompts", type=int, default=20)
+    ap.add_argument("--k", type=int, default=3, help="chunks per prompt")
+    ap.add_argument("--max-new-tokens", type=int, default=128)
+    ap.add_argument("--threads", type=int, default=0, help="torch.set_num_threads (0 = NM_TORCH_THREADS / default)")
+    args = ap.parse_args()
+    if args.threads: inference.NUM_THREADS = args.threads
+
+    prompts = make_prompts(args.path, args.prompts, args.k)
+    rows = bench(args.backends.split(","), args.decodings.split(","), prompts, args.max_new_tokens)
+    if not rows: raise SystemExit("no backend could be loaded")
+    cols = list(rows[0])
+    print("  ".join(f"{c:>15}" for c in cols))
+    for r in rows:
+        print("  ".join(f"{str(r[c]):>15}" for c in cols))
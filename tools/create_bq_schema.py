@@ -56,6 +56,7 @@ CREATE TABLE IF NOT EXISTS `{dataset_id}.queries` (
   token_in INT64,
   token_out INT64,
   cost_usd FLOAT64,
+  cache_hit STRING,         -- "exact" | "semantic" when served from the answer cache
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
 );
 """
@@ -79,7 +80,12 @@ CREATE TABLE IF NOT EXISTS `{dataset_id}.evals` (
 );
 """
 
-for sql in (ddl_chunks, ddl_queries, ddl_evals):
+# tables created before the answer cache existed
+ddl_queries_migrate = f"""
+ALTER TABLE `{dataset_id}.queries` ADD COLUMN IF NOT EXISTS cache_hit STRING;
+"""
+
+for sql in (ddl_chunks, ddl_queries, ddl_queries_migrate, ddl_evals):
     try:
         print("Running DDL...")
         job = client.query(sql)
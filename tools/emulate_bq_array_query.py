@@ -0,0 +1,117 @@
+# tools/emulate_bq_array_query.py
+"""
+Offline stand-in for the ARRAY<FLOAT64> cosine pushdown in app/memory_retrieve.py
+(ARRAY_TOPK_SQL, and ARRAY_BATCH_TOPK_SQL with --batch).
+- loads chunk rows (NDJSON with a "vector" array, e.g. tools/tmp_ingest.ndjson) into SQLite
+- runs those queries translated to SQLite (to_sqlite): UNNEST ... WITH OFFSET becomes json_each(...)
+  joined on the array key, QUALIFY ROW_NUMBER() becomes a filtered window subquery
+- checks the top-`pool` ids/scores against a brute-force NumPy ranking
+Usage: python tools/emulate_bq_array_query.py [--ndjson PATH | --synthetic N] [--pool 20] [--batch 8]
+"""
+import os, re, sys, json, math, sqlite3, argparse
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # add project root to sys.path
+
+import numpy as np
+from app.scoring import normalize_rows, cosine_scores, top_k
+from app.memory_retrieve import ARRAY_TOPK_SQL, ARRAY_BATCH_TOPK_SQL
+
+# The SQLite queries are translated from the BigQuery ones, so a change to ARRAY_TOPK_SQL or
+# ARRAY_BATCH_TOPK_SQL is exercised here too; a change the rewrites don't cover raises instead
+# of silently checking a stale copy.
+_REWRITES = [
+    # @queries is a JSON array of {"qid", "qvec"} objects
+    (r"SELECT qid, qvec FROM UNNEST\(@queries\)",
+     "SELECT json_extract(value, '$.qid') AS qid, json_extract(value, '$.qvec') AS qvec FROM json_each(@queries)"),
+    # dot product: UNNEST ... WITH OFFSET i indexing the query array becomes a join on the array key
+    (r"SUM\(v \* ([@\w.]+)\[OFFSET\(i\)\]\) FROM UNNEST\(([\w.]+)\) AS v WITH OFFSET i",
+     r"SUM(v.value * qv.value) FROM json_each(\2) AS v JOIN json_each(\1) AS qv ON qv.key = v.key"),
+    (r"SUM\(v \* v\) FROM UNNEST\(([\w.]+)\) AS v", r"SUM(v.value * v.value) FROM json_each(\1) AS v"),
+    (r"ARRAY_LENGTH\(", "json_array_length("),
+    (r"`\{table\}`", "chunks"),
+    # QUALIFY is not SQLite: filter a ROW_NUMBER() column in a wrapping query instead
+    (r"\nSELECT ([^\n]*) FROM \((.*)\n\)\nWHERE ([^\n]*)\nQUALIFY (.*) <= (@\w+)\n$",
+     r"\nSELECT \1 FROM (\n  SELECT *, \4 AS rn FROM (\2\n  )\n  WHERE \3\n)\nWHERE rn <= \5\n"),
+    (r"@(\w+)", r":\1"),
+]
+_BQ_ONLY = ("UNNEST", "OFFSET", "QUALIFY", "@", "`")
+
+def to_sqlite(sql: str) -> str:
+    """SQLite version of one of the BigQuery ARRAY queries; ValueError if its shape is not the expected one."""
+    for pattern, repl in _REWRITES:
+        sql = re.sub(pattern, repl, sql, flags=re.S)
+    left = [token for token in _BQ_ONLY if token in sql]
+    if left:
+        raise ValueError(f"no SQLite rewrite for {left} in:\n{sql}")
+    return sql
+
+SQLITE_ARRAY_TOPK_SQL = to_sqlite(ARRAY_TOPK_SQL)
+SQLITE_ARRAY_BATCH_TOPK_SQL = to_sqlite(ARRAY_BATCH_TOPK_SQL)
+
+def synthetic_rows(n, dim):
+    rng = np.random.default_rng(0)
+    return [{"chunk_id": f"syn_{i}", "text": f"synthetic {i}", "pagerank": 0.0,
+             "vector": rng.normal(size=dim).tolist()} for i in range(n)]
+
+def load_rows(args):
+    if args.synthetic:
+        return synthetic_rows(args.synthetic, args.dim)
+    with open(args.ndjson, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def build_db(rows):
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("SQRT", 1, lambda x: None if x is None else math.sqrt(x))
+    conn.execute("CREATE TABLE chunks (chunk_id TEXT, text TEXT, pagerank REAL, vector TEXT)")
+    conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                     [(r["chunk_id"], r.get("text"), float(r.get("pagerank") or 0.0),
+                       json.dumps(r["vector"]) if r.get("vector") is not None else None) for r in rows])
+    return conn
+
+def run(conn, q_vec, pool):
+    qvec = json.dumps([float(x) for x in normalize_rows(q_vec)[0]])
+    return conn.execute(SQLITE_ARRAY_TOPK_SQL, {"qvec": qvec, "pool": pool}).fetchall()
+
+def run_batch(conn, q_vecs, pool):
+    queries = json.dumps([{"qid": i, "qvec": [float(x) for x in q]} for i, q in enumerate(normalize_rows(q_vecs))])
+    per_query = [[] for _ in q_vecs]
+    for qid, cid, text, pr, cos in conn.execute(SQLITE_ARRAY_BATCH_TOPK_SQL, {"queries": queries, "pool": pool}):
+        per_query[qid].append((cid, text, pr, cos))
+    return [sorted(got, key=lambda g: -g[3]) for got in per_query]  # QUALIFY keeps the top rows, unordered
+
+def matches(got, sims, rows, pool):
+    want = [(rows[i]["chunk_id"], float(sims[i])) for i in top_k(sims, pool)]
+    return [g[0] for g in got] == [w[0] for w in want] and all(abs(g[3] - w[1]) < 1e-4 for g, w in zip(got, want))
+
+def check(rows, pool=20, batch=0, verbose=False):
+    """Run both queries on `rows` and compare them with the NumPy ranking; True when everything matches."""
+    rows = [r for r in rows if r.get("vector") is not None]
+    vecs = [r["vector"] for r in rows]
+    rng = np.random.default_rng(1)
+    q_vec = np.asarray(rows[0]["vector"]) + 0.05 * rng.normal(size=len(rows[0]["vector"]))
+    conn = build_db(rows)
+    got = run(conn, q_vec, pool)
+
+    ok = matches(got, cosine_scores(q_vec, vecs), rows, pool)
+    if verbose:
+        for cid, _text, _pr, cos in got[:10]:
+            print(f"{cid:40s} cosine={cos:.4f}")
+        print("rows:", len(rows), "| returned:", len(got), "| matches numpy ranking:", ok)
+
+    if batch:
+        q_vecs = [np.asarray(rows[i % len(rows)]["vector"]) + 0.05 * rng.normal(size=len(q_vec)) for i in range(batch)]
+        batch_ok = all(matches(g, cosine_scores(q, vecs), rows, pool)
+                       for g, q in zip(run_batch(conn, q_vecs, pool), q_vecs))
+        if verbose:
+            print("batch queries:", batch, "| matches numpy ranking:", batch_ok)
+        ok = ok and batch_ok
+    return ok
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ndjson", default=os.path.join(os.path.dirname(__file__), "tmp_ingest.ndjson"))
+    ap.add_argument("--synthetic", type=int, default=0, help="use N random rows instead of --ndjson")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--pool", type=int, default=20)
+    ap.add_argument("--batch", type=int, default=0, help="also check the batched query with N query vectors")
+    args = ap.parse_args()
+    sys.exit(0 if check(load_rows(args), args.pool, args.batch, verbose=True) else 1)
@@ -15,6 +15,7 @@ import uuid
 import time
 from datetime import datetime, timezone
 from app.memory_retrieve import local_embed
+from memory.ingest import chunk_text_simple
 
 client = bigquery.Client(project="t5-neuromem")
 dataset = f"{client.project}.neuromem"
@@ -36,31 +37,6 @@ DOCS = {
     ),
 }
 
-def chunk_text_simple(text: str, max_chars: int = 400):
-    """Naive chunker: split by sentences/paragraphs if possible, else sliding window."""
-    parts = [p.strip() for p in text.split("\n\n") if p.strip()]
-    if not parts:
-        parts = [text]
-    out = []
-    for p in parts:
-        if len(p) <= max_chars:
-            out.append(p)
-        else:
-            # sliding window on whitespace to avoid cutting words aggressively
-            start = 0
-            while start < len(p):
-                end = start + max_chars
-                if end >= len(p):
-                    out.append(p[start:].strip())
-                    break
-                # backtrack to last space
-                split_at = p.rfind(" ", start, end)
-                if split_at <= start:
-                    split_at = end
-                out.append(p[start:split_at].strip())
-                start = split_at
-    return out
-
 def build_rows():
     rows = []
     for doc_id, text in DOCS.items():
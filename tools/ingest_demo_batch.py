@@ -5,6 +5,7 @@ from app.memory_retrieve import local_embed
 
 # ensure project root importability if launched from tools/
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from memory.ingest import chunk_text_simple
 
 PROJECT = os.environ.get("GOOGLE_CLOUD_PROJECT") or "t5-neuromem"
 client = bigquery.Client(project=PROJECT)
@@ -28,28 +29,6 @@ DOCS = {
     ),
 }
 
-def chunk_text_simple(text: str, max_chars: int = 400):
-    parts = [p.strip() for p in text.split("\n\n") if p.strip()]
-    if not parts:
-        parts = [text]
-    out = []
-    for p in parts:
-        if len(p) <= max_chars:
-            out.append(p)
-        else:
-            start = 0
-            while start < len(p):
-                end = start + max_chars
-                if end >= len(p):
-                    out.append(p[start:].strip())
-                    break
-                split_at = p.rfind(" ", start, end)
-                if split_at <= start:
-                    split_at = end
-                out.append(p[start:split_at].strip())
-                start = split_at
-    return out
-
 def build_rows():
     rows = []
     for doc_id, text in DOCS.items():
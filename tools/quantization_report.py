@@ -0,0 +1,76 @@
+# tools/quantization_report.py
+"""
+Recall-vs-memory report for the quantized bank (NM_BANK_DTYPE).
+- corpus: the local bank's persisted vectors (--path, default NM_LOCAL_CHUNKS) or --synthetic N
+  clustered random unit vectors
+- queries: --queries corpus rows with gaussian noise (the ground truth is the float32 ranking)
+- for float32 / float16 / int8 prints resident bytes, recall@k scoring the quantized rows only,
+  recall@k after re-scoring the top --pool at full precision, and mean query latency
+Usage: python tools/quantization_report.py [--path CHUNKS | --synthetic N] [--dim 384] [--k 5] [--pool 200]
+"""
+import os, sys, time, argparse
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # add project root to sys.path
+
+import numpy as np
+from app.scoring import ScoringMatrix, normalize_rows, quantize_rows
+
+DTYPES = ("float32", "float16", "int8")
+
+def synthetic(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 50), dim)).astype(np.float32)
+    return normalize_rows(centers[rng.integers(0, len(centers), n)] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32))
+
+def load_bank(path: str) -> np.ndarray:
+    from app.memory_bank import read_rows, load_vectors
+    from app.memory_retrieve import local_embed_many, EMBED_MODEL
+    rows = read_rows(path)
+    if not rows: raise SystemExit(f"no chunks in {path}")
+    return normalize_rows(load_vectors(path, rows, local_embed_many, EMBED_MODEL))
+
+def recall(found, truth) -> float:
+    return float(np.mean([len(set(f.tolist()) & set(t.tolist())) / max(1, len(t)) for f, t in zip(found, truth)]))
+
+def report(mat: np.ndarray, queries: np.ndarray, pagerank: np.ndarray, alpha: float, k: int, pool: int):
+    full = ScoringMatrix.from_blocks([mat], pagerank)
+    truth = [idx for idx, _, _ in full.rank_many(queries, alpha, k)]
+    out = []
+    for dtype in DTYPES:
+        raw, scales = quantize_rows(mat, dtype)
+        scorer = ScoringMatrix.from_blocks([raw], pagerank, [scales], exact=lambda idx: mat[idx])
+        t0 = time.perf_counter()
+        plain = [idx for idx, _, _ in scorer.rank_many(queries, alpha, k)]
+        t1 = time.perf_counter()
+        rescored = [idx for idx, _, _ in scorer.rank_many(queries, alpha, k, pool=pool)]
+        t2 = time.perf_counter()
+        out.append({"dtype": dtype, "bytes": scorer.nbytes, "bytes_per_vec": round(scorer.nbytes / len(mat), 1),
+                    "x_smaller": round(mat.nbytes / scorer.nbytes, 2),
+                    f"recall@{k}": round(recall(plain, truth), 4),
+                    f"recall@{k}_rescored": round(recall(rescored, truth), 4),
+                    "ms_per_query": round(1000 * (t1 - t0) / len(queries), 3),
+                    "ms_per_query_rescored": round(1000 * (t2 - t1) / len(queries), 3)})
+    return out
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--path", default=os.environ.get("NM_LOCAL_CHUNKS", "telemetry/local_chunks.jsonl"))
+    ap.add_argument("--synthetic", type=int, default=0, help="use N random vectors instead of --path")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--noise", type=float, default=0.5, help="query = corpus row + noise * N(0, 1/dim)")
+    ap.add_argument("--alpha", type=float, default=0.7)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--pool", type=int, default=200)
+    args = ap.parse_args()
+
+    mat = synthetic(args.synthetic, args.dim) if args.synthetic else load_bank(args.path)
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(mat), args.queries)
+    queries = normalize_rows(mat[picks] + args.noise / np.sqrt(mat.shape[1]) * rng.normal(size=(args.queries, mat.shape[1])))
+    pagerank = rng.random(len(mat))
+    print(f"{len(mat)} vectors x {mat.shape[1]} dims, {args.queries} queries, alpha={args.alpha}, k={args.k}, pool={args.pool}")
+    rows = report(mat, queries.astype(np.float32), pagerank, args.alpha, args.k, args.pool)
+    cols = list(rows[0])
+    print("  ".join(f"{c:>22}" for c in cols))
+    for r in rows:
+        print("  ".join(f"{str(r[c]):>22}" for c in cols))